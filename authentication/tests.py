@@ -1,7 +1,7 @@
 from django.test import TestCase
 from django.contrib.auth.models import User
 from django.test import Client
-from quiz.models import Player
+from quiz.models import Player, PlayerRating, Subject, Category, PlayerAnswer, Question, Topic
 
 
 class LogoutTestCase(TestCase):
@@ -199,6 +199,26 @@ class AccountTestCase(TestCase):
         response = self.client.get('/authentication/account/')
         self.assertEqual(response.status_code, 200)
 
+    def test_account_page_standing(self):
+        category = Category.objects.create(title='TEST_CATEGORY')
+        subject = Subject.objects.create(title='TEST_SUBJECT', category=category)
+        other = Player.objects.create(user=User.objects.create(username='TEST_OTHER'))
+        PlayerRating.set_rating(self.user.player, 1300, subject)
+        PlayerRating.set_rating(other, 1200, subject)
+        self.client.login(username=self.TEST_USERNAME, password=self.TEST_PASS)
+        response = self.client.get('/authentication/account/')
+        self.assertEqual(response.context['standing'], (1, 2, 50))
+
+    def test_account_page_activity(self):
+        self.client.login(username=self.TEST_USERNAME, password=self.TEST_PASS)
+        category = Category.objects.create(title='TEST_CATEGORY')
+        topic = Topic.objects.create(title='TEST_TOPIC',
+                                     subject=Subject.objects.create(title='TEST_SUBJECT', category=category))
+        PlayerAnswer.objects.create(player=self.user.player,
+                                    question=Question.objects.create(question_text='Q', topic=topic), result=True)
+        response = self.client.get('/authentication/account/')
+        self.assertEqual((response.context['answered'], response.context['correct']), (1, 1))
+
 
 class ChangePasswordTestCase(TestCase):
     TEST_USERNAME = 'TEST_USERNAME'
@@ -8,7 +8,7 @@ from authentication.forms import LoginForm, RegistrationForm
 from django.contrib.auth import logout as djangologout
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth.admin import User
-from quiz.models import Player, PlayerRating, Subject
+from quiz.models import Player, PlayerRating
 
 
 def login(request):
@@ -104,16 +104,17 @@ def account(request):
         return HttpResponseRedirect('/')
 
     top_pr = PlayerRating.objects.filter(player=Player.objects.get(user=request.user)).order_by('-rating').first()
+    standing = PlayerRating.standing(request.user.player, top_pr.subject) if top_pr else None
 
-    player_subjects = request.user.player.subject_answers()
-    try:
-        fav_sub = Subject.objects.get(title=player_subjects[1][player_subjects[0].index(max(player_subjects[0]))])
-    except ValueError:
-        fav_sub = None
+    fav_sub = request.user.player.favourite_subject()
+    answered, correct = request.user.player.activity(30)
 
     context = {
         'top_pr': top_pr,
+        'standing': standing,
         'fav_sub': fav_sub,
+        'answered': answered,
+        'correct': correct,
         'login_form': None,
         'name_form': None,
     }
@@ -83,6 +83,19 @@ else:
     }
 
 
+# Cache
+# Must be shared by all processes: the achievement graph and the topic catalog are invalidated through it,
+# and a per-process cache such as the default LocMemCache would leave the other processes with stale copies.
+# Create the table with `python manage.py createcachetable`.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'eduquiz_cache',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
 
@@ -120,3 +133,26 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.10/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Achievements
+# Answers queue an AchievementEvent that is evaluated by the process_achievements command.
+# Set to True to evaluate achievements immediately instead, e.g. in tests.
+
+ACHIEVEMENTS_INLINE = False
+
+
+# Question reports
+# Reports that quarantine a question, taking it out of the selection until a moderator releases it.
+# For each flag, or 'reports' for all reports: the number of reports since the question was last released,
+# and the share of the question's answers they must also reach.
+
+QUARANTINE_THRESHOLDS = {
+    'reports': (10, 0.2),
+    'red_right': (5, 0.1),
+    'green_wrong': (5, 0.1),
+    'unclear': (5, 0.1),
+    'off_topic': (5, 0.1),
+    'inappropriate': (3, 0.02),
+    'other': (10, 0.2),
+}
@@ -40,6 +40,8 @@ class MultipleChoiceQuestionAdmin(admin.ModelAdmin):
                 'creation_date',
                 'rating',
                 'original_rating',
+                'status',
+                'released',
             ),
         }),
     )
@@ -68,6 +70,8 @@ class TextQuestionAdmin(admin.ModelAdmin):
                 'creation_date',
                 'rating',
                 'original_rating',
+                'status',
+                'released',
             ),
         }),
     )
@@ -92,6 +96,8 @@ class NumberQuestionAdmin(admin.ModelAdmin):
                 'creation_date',
                 'rating',
                 'original_rating',
+                'status',
+                'released',
             ),
         }),
     )
@@ -117,6 +123,8 @@ class TrueFalseQuestionAdmin(admin.ModelAdmin):
                 'creation_date',
                 'rating',
                 'original_rating',
+                'status',
+                'released',
             ),
         }),
     )
@@ -231,6 +239,18 @@ class PlayerAnswerAdmin(admin.ModelAdmin):
         }),
     )
 
+@admin.register(PlayerTopicDay)
+class PlayerTopicDayAdmin(admin.ModelAdmin):
+    list_display = ('day', 'player', 'topic', 'attempts', 'correct', 'report_skips', 'first_rating', 'last_rating')
+    list_filter = ('topic__subject',)
+    date_hierarchy = 'day'
+
+@admin.register(QuestionDay)
+class QuestionDayAdmin(admin.ModelAdmin):
+    list_display = ('day', 'question', 'attempts', 'correct', 'report_skips')
+    list_filter = ('question__topic__subject',)
+    date_hierarchy = 'day'
+
 @admin.register(PlayerRating)
 class PlayerRatingAdmin(admin.ModelAdmin):
     fieldsets = (
@@ -1,5 +1,34 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core import checks
+
+# Cache backends that are not shared between processes
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Warn if the default cache is not shared between processes,
+    the achievement graph and the topic catalog are invalidated through it
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_CACHES:
+        return [checks.Warning(
+            'The default cache %s is not shared between processes' % backend,
+            hint='Processes will keep stale achievement graphs and topic catalogs. '
+                 'Use a shared backend such as DatabaseCache or memcached.',
+            id='quiz.W001',
+        )]
+    return []
 
 
 class QuizConfig(AppConfig):
     name = 'quiz'
+
+    def ready(self):
+        from quiz import signals
+        signals.connect()
+        checks.register(check_shared_cache)
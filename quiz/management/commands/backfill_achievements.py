@@ -0,0 +1,82 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction, IntegrityError
+
+from quiz.models import Property, PropertyUnlock, Achievement, AchievementUnlock, Title, TitleUnlock
+
+
+class Command(BaseCommand):
+    help = 'Unlock properties, achievements and titles for every player who qualifies but has not unlocked them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--properties', help='Comma separated ids of the properties to evaluate, all by default')
+        parser.add_argument('--achievements',
+                            help='Comma separated ids of the achievements to evaluate. By default the achievements '
+                                 'of the evaluated properties, or all of them if no properties are given')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows inserted at a time')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+
+        properties = Property.objects.select_related(*Property.SUBCLASSES).order_by('id')
+        achievements = Achievement.objects.order_by('id')
+        if options['properties']:
+            properties = properties.filter(pk__in=self.ids(options['properties']))
+            if not options['achievements']:
+                achievements = achievements.filter(property__in=properties).distinct()
+        if options['achievements']:
+            achievements = achievements.filter(pk__in=self.ids(options['achievements']))
+
+        for prop in properties:
+            prop = prop.as_subclass()
+            count = self.insert(PropertyUnlock, prop.unlocked_players(), prop=prop)
+            self.stdout.write('Property %d (%s): %d unlocked' % (prop.pk, prop, count))
+
+        for achievement in achievements:
+            count = self.insert(AchievementUnlock, achievement.achieved_players(), achievement=achievement)
+            self.stdout.write('Achievement %d (%s): %d unlocked' % (achievement.pk, achievement, count))
+
+            for title in Title.objects.filter(achievement=achievement):
+                count = self.insert(TitleUnlock, AchievementUnlock.objects.filter(achievement=achievement)
+                                    .values_list('player', flat=True).distinct(), title=title)
+                self.stdout.write('Title %d (%s): %d unlocked' % (title.pk, title, count))
+
+    @staticmethod
+    def ids(value):
+        return [int(pk) for pk in value.split(',')]
+
+    def insert(self, model, player_ids, **fields):
+        """
+        Insert an unlock for every player that does not have one yet, batch_size rows at a time.
+        A batch that conflicts with unlocks inserted meanwhile by process_achievements or by answering
+        is inserted again a row at a time, leaving out the players who have the unlock by then
+
+        :param model: PropertyUnlock, AchievementUnlock or TitleUnlock
+        :param player_ids: Players who are to have the unlock
+        :param fields: What is unlocked, e.g. prop=prop
+
+        :return: Number of unlocks inserted
+        :rtype: int
+        """
+        existing = set(model.objects.filter(**fields).values_list('player_id', flat=True))
+        missing = (model(player_id=player_id, **fields)
+                   for player_id in player_ids.iterator() if player_id not in existing)
+
+        count = 0
+        while True:
+            batch = list(islice(missing, self.batch_size))
+            if not batch:
+                return count
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create(batch)
+                count += len(batch)
+            except IntegrityError:
+                for unlock in batch:
+                    try:
+                        with transaction.atomic():
+                            unlock.save(force_insert=True)
+                        count += 1
+                    except IntegrityError:
+                        pass
@@ -0,0 +1,73 @@
+import random
+import time
+
+from django.contrib.auth.admin import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from quiz.models import Category, Subject, Topic, Question, Player, PlayerTopic, PlayerAnswer, PlayerRating
+
+
+class Command(BaseCommand):
+    help = 'Measure query count and latency of question selection as a topic grows. ' \
+           'Runs against a throwaway test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,100000,1000000',
+                            help='Comma separated numbers of questions in the topic')
+        parser.add_argument('--iterations', type=int, default=200,
+                            help='Number of selections to time for each size')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        rng = random.Random(options['seed'])
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.run(sizes, options['iterations'], rng)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, sizes, iterations, rng):
+        category = Category.objects.create(title='BENCHMARK')
+        subject = Subject.objects.create(title='BENCHMARK', short='B', code='B', category=category)
+        topic = Topic.objects.create(title='BENCHMARK', subject=subject)
+        player = Player.objects.create(user=User.objects.create(username='BENCHMARK'))
+        PlayerTopic.objects.create(player=player, topic=topic)
+        topics = [topic]
+
+        self.stdout.write('%10s %8s %10s %10s' % ('questions', 'queries', 'median ms', 'p95 ms'))
+
+        created = 0
+        for size in sizes:
+            while created < size:
+                batch = min(10000, size - created)
+                Question.objects.bulk_create(
+                    Question(question_text='Q', topic=topic, rating=rng.gauss(1200, 200)) for _ in range(batch))
+                created += batch
+
+            if not PlayerAnswer.objects.filter(player=player).exists():
+                for question in Question.objects.all()[:5]:
+                    PlayerAnswer.objects.create(player=player, question=question, result=True)
+
+            timings = []
+            queries = 0
+            for _ in range(iterations):
+                PlayerRating.set_rating(player, rng.gauss(1200, 250))
+                connection.queries_log.clear()
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    player.next_question(topics)
+                    timings.append(time.perf_counter() - start)
+                queries = max(queries, len(context.captured_queries))
+
+            timings.sort()
+            self.stdout.write('%10d %8d %10.3f %10.3f' % (
+                size,
+                queries,
+                timings[len(timings) // 2] * 1000,
+                timings[int(len(timings) * 0.95)] * 1000,
+            ))
@@ -0,0 +1,209 @@
+import json
+import platform
+import random
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from quiz.models import Player, TextQuestion, NumberQuestion, TrueFalseQuestion
+
+# Text answers with accents, ligatures and letters that change length when case folded
+WORDS = ('Straße', 'Ørsted', 'Ålesund', 'Æøå', 'naïve', 'Σίσυφος', 'Dvořák', 'İstanbul', 'ﬁnal',
+         'Ångström', 'photosynthesis', 'mitochondria', 'Pythagoras', 'H2O', 'CO2', 'Newton', 'Bohr', 'Descartes')
+
+
+def text_corpus(rng, size):
+    """
+    Generate text questions and submissions: the correct answer, or another one,
+    with changed case, punctuation and surrounding whitespace
+
+    :param rng: Random number generator
+    :type rng: random.Random
+
+    :param size: Number of submissions
+    :type size: int
+
+    :return: (question, submission) pairs
+    :rtype: list
+    """
+    questions = []
+    for _ in range(50):
+        answer = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 3)))
+        questions.append(TextQuestion(question_text='Q', answer=answer))
+
+    corpus = []
+    for _ in range(size):
+        question = rng.choice(questions)
+        submission = question.answer if rng.random() < 0.6 else rng.choice(questions).answer
+        submission = rng.choice((str.upper, str.lower, str.title, str))(submission)
+        submission = rng.choice(('', ' ', '  ')) + submission.replace(' ', rng.choice((' ', '-', '_', '. '))) + \
+            rng.choice(('', '.', '!', ' '))
+        corpus.append((question, submission))
+    return corpus
+
+
+def number_answer(rng):
+    """ Generate a number answer: an integer, a decimal with point or comma, or a hex number """
+    kind = rng.random()
+    if kind < 0.3:
+        return str(rng.randint(0, 100000))
+    if kind < 0.8:
+        return ('%.*f' % (rng.randint(1, 4), rng.uniform(0, 1000))).replace('.', rng.choice(('.', ',')))
+    return '%x' % rng.randint(0, 0xfffff)
+
+
+def number_corpus(rng, size):
+    """
+    Generate number questions and submissions: the correct answer, or another one,
+    with leading and trailing zeros, comma decimals and upper case hex digits
+
+    :param rng: Random number generator
+    :type rng: random.Random
+
+    :param size: Number of submissions
+    :type size: int
+
+    :return: (question, submission) pairs
+    :rtype: list
+    """
+    questions = [NumberQuestion(question_text='Q', answer=number_answer(rng)) for _ in range(50)]
+
+    corpus = []
+    for _ in range(size):
+        question = rng.choice(questions)
+        submission = question.answer if rng.random() < 0.6 else number_answer(rng)
+        if rng.random() < 0.3:
+            submission = '0' * rng.randint(1, 3) + submission
+        if rng.random() < 0.3:
+            submission += ('' if '.' in submission or ',' in submission else '.') + '0' * rng.randint(1, 3)
+        if rng.random() < 0.2:
+            submission = submission.replace('.', ',').upper()
+        corpus.append((question, submission))
+    return corpus
+
+
+def benchmarks(rng, size):
+    """
+    Build the benchmarks: the benchmarked function and the arguments of each call
+
+    :param rng: Random number generator
+    :type rng: random.Random
+
+    :param size: Number of calls in each benchmark
+    :type size: int
+
+    :return: (name, function, list of argument tuples) triples
+    :rtype: list
+    """
+    texts = text_corpus(rng, size)
+    numbers = number_corpus(rng, size)
+    true_false = [(TrueFalseQuestion(question_text='Q', answer=rng.random() < 0.5),
+                   rng.choice(('true', 'false', 'True', 'False'))) for _ in range(size)]
+    ratings = [(rng.gauss(1200, 250), rng.gauss(1200, 250), rng.randint(0, 1)) for _ in range(size)]
+
+    # Validate each question once, so the canonical answers are computed before timing like for loaded questions
+    for question, _ in texts + numbers:
+        question.validate('')
+
+    return [
+        ('TextQuestion.validate', TextQuestion.validate, texts),
+        ('NumberQuestion.validate', NumberQuestion.validate, numbers),
+        ('TrueFalseQuestion.answer_feedback_raw', TrueFalseQuestion.answer_feedback_raw, true_false),
+        ('Player.exp', Player.exp, [(rating, question_rating) for rating, question_rating, _ in ratings]),
+        ('Player.rating_change', Player.rating_change, ratings),
+    ]
+
+
+def measure(function, calls, repeat, traced):
+    """
+    Time a benchmark and trace the memory allocated by its calls
+
+    :param function: Benchmarked function
+    :type function: function
+
+    :param calls: Arguments of each call
+    :type calls: list
+
+    :param repeat: Number of timed runs through all calls, the fastest one counts
+    :type repeat: int
+
+    :param traced: Number of calls whose allocations are traced, one at a time
+    :type traced: int
+
+    :return: Calls per second, and the mean bytes allocated at the peak of a call and still allocated after it
+    :rtype: dict
+    """
+    # A first run to warm up
+    timed(function, calls)
+    best = min(timed(function, calls) for _ in range(max(repeat, 1)))
+
+    peak_bytes = retained_bytes = 0
+    traced_calls = calls[:traced]
+    for args in traced_calls:
+        tracemalloc.start()
+        try:
+            before, _ = tracemalloc.get_traced_memory()
+            function(*args)
+            after, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peak_bytes += peak - before
+        retained_bytes += after - before
+
+    return {
+        'ops_per_sec': len(calls) / best,
+        'peak_bytes_per_op': peak_bytes / len(traced_calls),
+        'retained_bytes_per_op': retained_bytes / len(traced_calls),
+    }
+
+
+def timed(function, calls):
+    start = time.perf_counter()
+    for args in calls:
+        function(*args)
+    return time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = 'Measure calls per second and memory allocations of the answer validators and the rating math. ' \
+           'Needs no database. Results can be saved as JSON and compared with an earlier run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=10000, help='Number of calls per run of each benchmark')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs, the fastest one counts')
+        parser.add_argument('--traced', type=int, default=1000,
+                            help='Number of calls of each benchmark whose memory allocations are traced')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--only', help='Run only the benchmarks whose name contains this')
+        parser.add_argument('--json', help='Write the results to this file')
+        parser.add_argument('--compare', help='Compare with the results in this file, written by --json')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        previous = {}
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = json.load(f)['results']
+
+        results = {}
+        self.stdout.write('%-40s %14s %12s %12s %10s' % ('benchmark', 'ops/sec', 'peak B/op', 'kept B/op', 'change'))
+        for name, function, calls in benchmarks(rng, options['size']):
+            if options['only'] and options['only'] not in name:
+                continue
+            results[name] = result = measure(function, calls, options['repeat'], max(options['traced'], 1))
+
+            change = ''
+            if name in previous:
+                change = '%+.1f%%' % ((result['ops_per_sec'] / previous[name]['ops_per_sec'] - 1) * 100)
+            self.stdout.write('%-40s %14.0f %12.1f %12.1f %10s' % (
+                name, result['ops_per_sec'], result['peak_bytes_per_op'], result['retained_bytes_per_op'], change))
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump({
+                    'python': platform.python_version(),
+                    'size': options['size'],
+                    'seed': options['seed'],
+                    'results': results,
+                }, f, indent=2, sort_keys=True)
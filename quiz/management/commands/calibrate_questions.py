@@ -0,0 +1,153 @@
+import math
+from array import array
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, When, Value, Count, Sum, IntegerField
+
+from quiz.models import Subject, Question, PlayerAnswer, PlayerRating
+from quiz.management.commands.replay_ratings import write_ratings
+
+# Rating points per logit, the scale Player.exp uses: 1/(1+10^((b-a)/400)) = 1/(1+e^((b-a)/SCALE))
+SCALE = 400 / math.log(10)
+
+
+def load_results(subject_id):
+    """
+    Load the result matrix of a subject: how often each player answered each question, and how often correctly.
+    The database groups the answers, so memory grows with the number of player and question pairs,
+    not with the number of answers.
+
+    :param subject_id: id of the subject
+    :type subject_id: int
+
+    :return: Player ids, question ids, number of answers and number of correct answers of each pair
+    :rtype: tuple
+    """
+    pairs = PlayerAnswer.objects.filter(question__topic__subject_id=subject_id, report_skip=False)\
+        .exclude(question__status=Question.DELETED).order_by().values_list('player_id', 'question_id')\
+        .annotate(answers=Count('id'), wins=Sum(Case(When(result=True, then=Value(1)), default=Value(0),
+                                                     output_field=IntegerField())))
+
+    columns = [array('q') for _ in range(4)]
+    for row in pairs.iterator():
+        for column, value in zip(columns, row):
+            column.append(value)
+    return tuple(np.frombuffer(column, dtype=np.int64) if column else np.zeros(0, dtype=np.int64)
+                 for column in columns)
+
+
+def fit(players, questions, answers, wins, player_prior, question_prior, prior_precision, iterations, tolerance):
+    """
+    Fit player ability and question difficulty of a Rasch model, P(correct) = 1/(1+e^(difficulty-ability)),
+    by alternating Newton steps. Each parameter has a normal prior around its current rating,
+    so parameters with few answers stay close to it.
+
+    :param players: Dense player index of each pair
+    :type players: numpy.ndarray
+
+    :param questions: Dense question index of each pair
+    :type questions: numpy.ndarray
+
+    :param answers: Number of answers of each pair
+    :type answers: numpy.ndarray
+
+    :param wins: Number of correct answers of each pair
+    :type wins: numpy.ndarray
+
+    :param player_prior: Prior ability of each player, in logits
+    :type player_prior: numpy.ndarray
+
+    :param question_prior: Prior difficulty of each question, in logits
+    :type question_prior: numpy.ndarray
+
+    :param prior_precision: Precision of the priors, in 1/logits^2
+    :type prior_precision: float
+
+    :param iterations: Maximum number of iterations
+    :type iterations: int
+
+    :param tolerance: Stop when no difficulty moves more than this many logits in an iteration
+    :type tolerance: float
+
+    :return: Ability of each player and difficulty of each question, in logits
+    :rtype: tuple
+    """
+    ability = player_prior.copy()
+    difficulty = question_prior.copy()
+
+    for _ in range(iterations):
+        p = 1 / (1 + np.exp(difficulty[questions] - ability[players]))
+        gradient = np.bincount(players, wins - answers * p, len(ability)) - prior_precision * (ability - player_prior)
+        hessian = np.bincount(players, answers * p * (1 - p), len(ability)) + prior_precision
+        ability += gradient / hessian
+
+        p = 1 / (1 + np.exp(difficulty[questions] - ability[players]))
+        gradient = np.bincount(questions, answers * p - wins, len(difficulty)) \
+            - prior_precision * (difficulty - question_prior)
+        hessian = np.bincount(questions, answers * p * (1 - p), len(difficulty)) + prior_precision
+        step = gradient / hessian
+        difficulty += step
+
+        if not len(step) or np.abs(step).max() < tolerance:
+            break
+
+    return ability, difficulty
+
+
+class Command(BaseCommand):
+    help = 'Calibrate Question.rating by fitting question difficulty and player ability jointly ' \
+           'to all answers in each subject'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the calibrated ratings')
+        parser.add_argument('--subjects', help='Comma separated ids of the subjects to calibrate, all by default')
+        parser.add_argument('--prior-sd', type=float, default=300,
+                            help='Standard deviation in rating points of the prior around the current ratings')
+        parser.add_argument('--iterations', type=int, default=100)
+        parser.add_argument('--tolerance', type=float, default=0.01,
+                            help='Stop when no question rating moves more than this in an iteration')
+
+    def handle(self, *args, **options):
+        if options['subjects']:
+            subject_ids = [int(pk) for pk in options['subjects'].split(',')]
+        else:
+            subject_ids = list(Subject.objects.order_by('id').values_list('id', flat=True))
+
+        for subject_id in subject_ids:
+            self.calibrate(subject_id, options)
+
+    def calibrate(self, subject_id, options):
+        player_ids, question_ids, answers, wins = load_results(subject_id)
+        player_ids, players = np.unique(player_ids, return_inverse=True)
+        question_ids, questions = np.unique(question_ids, return_inverse=True)
+
+        current = dict(PlayerRating.objects.filter(subject_id=subject_id).values_list('player_id', 'rating'))
+        player_prior = np.array([float(current.get(pk, 1200)) for pk in player_ids.tolist()])
+        # Only the ratings, not the question rows
+        ratings = {pk: (rating, original_rating) for pk, rating, original_rating in Question.objects
+                   .filter(topic__subject_id=subject_id).values_list('id', 'rating', 'original_rating')}
+        question_prior = np.array([float(ratings[pk][0]) for pk in question_ids.tolist()])
+
+        _, difficulty = fit(
+            players, questions, answers.astype(np.float64), wins.astype(np.float64),
+            (player_prior - 1200) / SCALE, (question_prior - 1200) / SCALE,
+            (SCALE / options['prior_sd']) ** 2, options['iterations'], options['tolerance'] / SCALE,
+        )
+        calibrated = difficulty * SCALE + 1200
+
+        moved = []
+        for pk, rating in zip(question_ids.tolist(), calibrated.tolist()):
+            current, original = ratings[pk]
+            moved.append(rating - float(original))
+            self.stdout.write('Subject %d: question %d original %.3f, rating %.3f -> %.3f (%+.3f from original)' % (
+                subject_id, pk, original, current, rating, moved[-1]))
+
+        if not options['dry_run']:
+            with transaction.atomic():
+                write_ratings(Question.objects.all(), list(zip(question_ids.tolist(), calibrated.tolist())))
+
+        self.stdout.write('Subject %d: %d questions %s from %d answers, mean distance from original %.3f' % (
+            subject_id, len(question_ids), 'fitted' if options['dry_run'] else 'calibrated', answers.sum(),
+            np.abs(moved).mean() if moved else 0))
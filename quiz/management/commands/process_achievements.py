@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from quiz.models import AchievementEvent
+
+
+class Command(BaseCommand):
+    help = 'Evaluate the achievements of the players in the AchievementEvent queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of events taken from the queue at a time')
+        parser.add_argument('--forever', action='store_true',
+                            help='Keep polling the queue instead of stopping when it is empty')
+        parser.add_argument('--interval', type=float, default=1,
+                            help='Seconds to wait before polling an empty queue again')
+
+    def handle(self, *args, **options):
+        processed = 0
+        while True:
+            count = AchievementEvent.process(options['batch_size'])
+            processed += count
+            if not count:
+                if not options['forever']:
+                    break
+                time.sleep(options['interval'])
+
+        self.stdout.write('%d events processed' % processed)
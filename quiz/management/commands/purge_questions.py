@@ -0,0 +1,94 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F
+
+from quiz.management.commands.rebuild_subject_stats import count_if
+from quiz.models import Question, PlayerAnswer, RecentAnswer, QuestionReport, QuestionDay, MultipleChoiceAnswer, \
+    PlayerSubjectStats, RollupDay
+
+# Rows that refer to a question, purged before the question itself
+DEPENDENTS = (MultipleChoiceAnswer, QuestionReport, RecentAnswer, QuestionDay, PlayerAnswer)
+
+
+def purge_rows(queryset, batch_size, before_delete=None):
+    """
+    Delete the rows of a queryset a batch at a time, each batch in its own transaction,
+    so no lock is held on more than batch_size rows
+
+    :param queryset: Rows to delete
+    :type queryset: QuerySet
+
+    :param batch_size: Number of rows deleted at a time
+    :type batch_size: int
+
+    :param before_delete: Called with each batch before it is deleted, in the same transaction
+    :type before_delete: function
+
+    :return: Number of rows deleted
+    :rtype: int
+    """
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            batch = queryset.model.objects.filter(id__in=ids)
+            if before_delete:
+                before_delete(batch)
+            batch.delete()
+        deleted += len(ids)
+
+
+def uncount_answers(answers):
+    """
+    Take answers out of the PlayerSubjectStats counters of their players
+
+    :param answers: Answers about to be deleted
+    :type answers: QuerySet
+
+    :return: None
+    :rtype: None
+    """
+    counts = answers.filter(question__topic__isnull=False).order_by()\
+        .values_list('player_id', 'question__topic__subject_id')\
+        .annotate(answered=Count('id'), correct=count_if(result=True), report_skips=count_if(report_skip=True))
+    for player_id, subject_id, *values in counts:
+        PlayerSubjectStats.objects.filter(player_id=player_id, subject_id=subject_id).update(**{
+            field: F(field) - value for field, value in zip(('answered', 'correct', 'report_skips'), values)
+        })
+
+
+class Command(BaseCommand):
+    help = 'Remove deleted questions along with their answers, reports and daily summaries, a batch at a time. ' \
+           'The answers are taken out of PlayerSubjectStats, and the days they were rolled up in are rolled up ' \
+           'again. Ratings are left as they are, and so are the RatingBucket counts of them, ' \
+           'run replay_ratings to take the answers out of the ratings too.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of rows deleted at a time')
+
+    def handle(self, *args, **options):
+        question_ids = list(Question.all_objects.filter(status=Question.DELETED).values_list('id', flat=True))
+
+        for question_id in question_ids:
+            # Rolled up days with answers to the question, read before its QuestionDay rows are purged
+            days = list(QuestionDay.objects.filter(question_id=question_id).order_by('day')
+                        .values_list('day', flat=True))
+
+            for model in DEPENDENTS:
+                deleted = purge_rows(model.objects.filter(question_id=question_id), options['batch_size'],
+                                     uncount_answers if model is PlayerAnswer else None)
+                if deleted:
+                    self.stdout.write('Question %d: %d %s rows purged' % (
+                        question_id, deleted, model._meta.object_name))
+            Question.all_objects.filter(pk=question_id, status=Question.DELETED).delete()
+
+            # Replaces the PlayerTopicDay rows, which still counted the purged answers
+            for day in days:
+                RollupDay.roll_up(day)
+            if days:
+                self.stdout.write('Question %d: %d days rolled up again' % (question_id, len(days)))
+
+        self.stdout.write('%d questions purged' % len(question_ids))
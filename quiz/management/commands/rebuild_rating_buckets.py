@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from quiz.models import Subject, RatingBucket
+
+
+class Command(BaseCommand):
+    help = 'Count the RatingBucket rows of every subject again from PlayerRating'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subjects', help='Comma separated ids of the subjects to rebuild, all by default')
+
+    def handle(self, *args, **options):
+        if options['subjects']:
+            subject_ids = [int(pk) for pk in options['subjects'].split(',')]
+        else:
+            subject_ids = list(Subject.objects.order_by('id').values_list('id', flat=True))
+
+        for subject_id in subject_ids:
+            RatingBucket.rebuild(subject_id)
+
+        self.stdout.write('%d subjects rebuilt' % len(subject_ids))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from quiz.models import Player
+
+
+class Command(BaseCommand):
+    help = 'Check the streaks kept by Player.record_answer against the answer history and rebuild the ones that differ'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report players whose streak differs')
+
+    def handle(self, *args, **options):
+        checked = 0
+        mismatches = 0
+
+        players = Player.objects.exclude(streak_topics='').only('id', 'streak', 'streak_topics')
+        for player in players.iterator():
+            checked += 1
+            topic_ids = [int(pk) for pk in player.streak_topics.split(',')]
+            streak = player.streak_from_history(topic_ids)
+
+            if streak != player.streak:
+                mismatches += 1
+                self.stdout.write('Player %d: kept %r, history %r' % (player.id, player.streak, streak))
+                if not options['dry_run']:
+                    # Only overwrite the streak if it was not rebuilt for other topics in the meantime
+                    Player.objects.filter(pk=player.pk, streak_topics=player.streak_topics).update(streak=streak)
+
+        self.stdout.write('%d streaks checked, %d %s' % (
+            checked, mismatches, 'differ' if options['dry_run'] else 'rebuilt'))
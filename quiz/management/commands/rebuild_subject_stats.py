@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum, Case, When, Value, IntegerField
+
+from quiz.models import PlayerAnswer, PlayerSubjectStats
+
+
+def count_if(**condition):
+    return Sum(Case(When(then=Value(1), **condition), default=Value(0), output_field=IntegerField()))
+
+
+class Command(BaseCommand):
+    help = 'Check the PlayerSubjectStats counters against the answer history and rebuild the ones that differ'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report counters that differ')
+
+    def handle(self, *args, **options):
+        history = PlayerAnswer.objects.filter(question__topic__isnull=False).order_by()\
+            .values_list('player_id', 'question__topic__subject_id')\
+            .annotate(answered=Count('id'), correct=count_if(result=True), report_skips=count_if(report_skip=True))
+        expected = {(player_id, subject_id): counts for player_id, subject_id, *counts in history.iterator()}
+
+        kept = {}
+        for pk, player_id, subject_id, *counts in PlayerSubjectStats.objects\
+                .values_list('id', 'player_id', 'subject_id', 'answered', 'correct', 'report_skips').iterator():
+            kept[player_id, subject_id] = pk, counts
+
+        missing = []
+        mismatches = 0
+        with transaction.atomic():
+            for key in sorted(set(expected) | set(kept)):
+                counts = expected.get(key, [0, 0, 0])
+                pk, kept_counts = kept.get(key, (None, None))
+                if counts == kept_counts:
+                    continue
+
+                mismatches += 1
+                self.stdout.write('Player %d, subject %d: kept %r, history %r' % (key + (kept_counts, counts)))
+                if options['dry_run']:
+                    continue
+                fields = dict(zip(('answered', 'correct', 'report_skips'), counts))
+                if pk is None:
+                    missing.append(PlayerSubjectStats(player_id=key[0], subject_id=key[1], **fields))
+                else:
+                    PlayerSubjectStats.objects.filter(pk=pk).update(**fields)
+            PlayerSubjectStats.objects.bulk_create(missing, batch_size=1000)
+
+        self.stdout.write('%d counters checked, %d %s' % (
+            len(set(expected) | set(kept)), mismatches, 'differ' if options['dry_run'] else 'rebuilt'))
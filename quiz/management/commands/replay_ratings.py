@@ -0,0 +1,199 @@
+import multiprocessing
+from decimal import Decimal
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Case, When, Value, Q, DecimalField
+
+from quiz.models import Subject, Question, Player, PlayerAnswer, PlayerRating, RatingBucket
+
+# Rows per CASE update, kept well below SQLite's limit of 999 parameters per statement
+WRITE_BATCH = 300
+
+
+def replay_subject(subject_id, chunk_size):
+    """
+    Replay the answer history of a subject from scratch.
+    Players start at 1200 and questions at their original rating, and every answer to a question in the subject
+    is applied with Player.rating_change in the order it was given. Report skips are left out.
+
+    :param subject_id: id of the subject to replay
+    :type subject_id: int
+
+    :param chunk_size: Number of answers read from the database at a time
+    :type chunk_size: int
+
+    :return: Player ids, their replayed ratings, question ids, their replayed ratings and the number of answers
+    :rtype: tuple
+    """
+    # Report skips are stored as correct answers, but were never rated
+    answers = PlayerAnswer.objects.filter(question__topic__subject_id=subject_id, report_skip=False)
+
+    # Deleted questions are replayed until they are purged, their answers moved the players' ratings
+    questions = Question.all_objects.filter(topic__subject_id=subject_id).order_by('id')\
+        .values_list('id', 'original_rating')
+    question_ids = np.array([pk for pk, _ in questions], dtype=np.int64)
+    # Plain lists while replaying, numpy scalars are slower to read and write one at a time
+    question_ratings = [float(rating) for _, rating in questions]
+
+    player_ids = set(answers.values_list('player_id', flat=True).distinct())
+    player_ids.update(PlayerRating.objects.filter(subject_id=subject_id).values_list('player_id', flat=True))
+    player_ids = np.array(sorted(player_ids), dtype=np.int64)
+    player_ratings = [1200.0] * len(player_ids)
+
+    rating_change = Player.rating_change
+    count = 0
+    last = None
+    chunks = answers.order_by('answer_date', 'id').values_list('answer_date', 'id', 'player_id', 'question_id', 'result')
+    while True:
+        # Keyset pagination on (answer_date, id), so every chunk is read from where the previous one ended
+        chunk = chunks
+        if last:
+            chunk = chunk.filter(Q(answer_date__gt=last[0]) | Q(answer_date=last[0], id__gt=last[1]))
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            break
+        last = chunk[-1]
+        count += len(chunk)
+
+        # Only the lookups are batched, Elo updates depend on the order of the answers and are applied one by one
+        _, _, players, questions, results = zip(*chunk)
+        players = np.searchsorted(player_ids, players).tolist()
+        questions = np.searchsorted(question_ids, questions).tolist()
+
+        for p, q, win in zip(players, questions, results):
+            new_ratings = rating_change(player_ratings[p], question_ratings[q], int(win))
+            if new_ratings:
+                # Round like the rating fields do, so the replay matches answers applied one at a time
+                player_ratings[p] = round(new_ratings[0], 3)
+                question_ratings[q] = round(new_ratings[1], 3)
+
+    return player_ids, np.array(player_ratings), question_ids, np.array(question_ratings), count
+
+
+def changed(ids, ratings, current):
+    """
+    Compare replayed ratings with the ones in the database
+
+    :param ids: Object ids, sorted
+    :type ids: numpy.ndarray
+
+    :param ratings: Replayed rating of each object
+    :type ratings: numpy.ndarray
+
+    :param current: Current rating by object id
+    :type current: dict
+
+    :return: (id, current rating or None, replayed rating) of every object whose rating differs
+    :rtype: list
+    """
+    return [(pk, current.get(pk), rating) for pk, rating in zip(ids.tolist(), ratings.tolist())
+            if pk not in current or abs(current[pk] - rating) >= 0.0005]
+
+
+def write_ratings(queryset, changes):
+    """
+    Set the rating of the objects in queryset, a batch of objects per UPDATE statement
+
+    :param queryset: Objects to update, filtered further by primary key
+    :type queryset: QuerySet
+
+    :param changes: (primary key, rating) pairs
+    :type changes: list
+    """
+    for i in range(0, len(changes), WRITE_BATCH):
+        batch = changes[i:i + WRITE_BATCH]
+        queryset.filter(pk__in=[pk for pk, _ in batch]).update(rating=Case(
+            *[When(pk=pk, then=Value(Decimal('%.3f' % rating))) for pk, rating in batch],
+            output_field=DecimalField(max_digits=8, decimal_places=3)
+        ))
+
+
+def replay_job(job):
+    """
+    Replay one subject and write the changed ratings, or only report them on a dry run.
+    Runs in a worker process when the subjects are replayed in parallel.
+
+    :param job: Subject id, chunk size and whether it is a dry run
+    :type job: tuple
+
+    :return: Lines to report
+    :rtype: list
+    """
+    subject_id, chunk_size, dry_run = job
+    player_ids, player_ratings, question_ids, question_ratings, count = replay_subject(subject_id, chunk_size)
+
+    player_rating_ids = {}
+    current = {}
+    for pk, player_id, rating in PlayerRating.objects.filter(subject_id=subject_id)\
+            .values_list('id', 'player_id', 'rating'):
+        player_rating_ids[player_id] = pk
+        current[player_id] = float(rating)
+    player_changes = changed(player_ids, player_ratings, current)
+
+    current = {pk: float(rating) for pk, rating in Question.all_objects.filter(topic__subject_id=subject_id)
+               .values_list('id', 'rating')}
+    question_changes = changed(question_ids, question_ratings, current)
+
+    lines = []
+    if dry_run:
+        for player_id, old, new in player_changes:
+            lines.append('Subject %d: player %d %s -> %.3f' % (
+                subject_id, player_id, 'none' if old is None else '%.3f' % old, new))
+        for question_id, old, new in question_changes:
+            lines.append('Subject %d: question %d %.3f -> %.3f' % (subject_id, question_id, old, new))
+    else:
+        with transaction.atomic():
+            PlayerRating.objects.bulk_create(
+                PlayerRating(player_id=player_id, subject_id=subject_id, rating=Decimal('%.3f' % new))
+                for player_id, old, new in player_changes if player_id not in player_rating_ids
+            )
+            write_ratings(PlayerRating.objects.all(), [
+                (player_rating_ids[player_id], new)
+                for player_id, old, new in player_changes if player_id in player_rating_ids
+            ])
+            write_ratings(Question.all_objects.all(),
+                          [(question_id, new) for question_id, old, new in question_changes])
+            RatingBucket.rebuild(subject_id)
+
+    lines.append('Subject %d: %d answers replayed, %d player ratings and %d question ratings %s' % (
+        subject_id, count, len(player_changes), len(question_changes), 'differ' if dry_run else 'changed'))
+    return lines
+
+
+def init_worker():
+    # Connections inherited from the parent process must not be shared
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Recompute every PlayerRating and Question.rating by replaying the PlayerAnswer history ' \
+           'with Player.rating_change. Answers to questions without a topic are not replayed. ' \
+           'Answers given while the replay runs may be overwritten.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report ratings that would change')
+        parser.add_argument('--subjects', help='Comma separated ids of the subjects to replay, all by default')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Number of subjects replayed in parallel, each in its own process')
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Number of answers read from the database at a time')
+
+    def handle(self, *args, **options):
+        if options['subjects']:
+            subject_ids = [int(pk) for pk in options['subjects'].split(',')]
+        else:
+            subject_ids = list(Subject.objects.order_by('id').values_list('id', flat=True))
+        jobs = [(subject_id, options['chunk_size'], options['dry_run']) for subject_id in subject_ids]
+
+        if options['processes'] > 1:
+            connections.close_all()
+            with multiprocessing.Pool(options['processes'], initializer=init_worker) as pool:
+                results = list(pool.imap(replay_job, jobs))
+        else:
+            results = map(replay_job, jobs)
+
+        for lines in results:
+            for line in lines:
+                self.stdout.write(line)
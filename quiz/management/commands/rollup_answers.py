@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from quiz.models import PlayerAnswer, RollupDay
+
+
+class Command(BaseCommand):
+    help = 'Roll up the answers of every ended day that has not been rolled up yet into PlayerTopicDay and QuestionDay'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Roll up the days from this date (YYYY-MM-DD) again')
+
+    def handle(self, *args, **options):
+        yesterday = timezone.now().astimezone(timezone.utc).date() - timedelta(days=1)
+
+        if options['since']:
+            try:
+                day = datetime.strptime(options['since'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--since must be a date like 2017-03-31')
+        else:
+            last = RollupDay.last()
+            if last:
+                day = last + timedelta(days=1)
+            else:
+                first = PlayerAnswer.objects.order_by('answer_date').values_list('answer_date', flat=True).first()
+                day = first.astimezone(timezone.utc).date() if first else yesterday + timedelta(days=1)
+
+        days = 0
+        answers = 0
+        while day <= yesterday:
+            answers += RollupDay.roll_up(day)
+            days += 1
+            day += timedelta(days=1)
+
+        self.stdout.write('%d days rolled up, %d answers' % (days, answers))
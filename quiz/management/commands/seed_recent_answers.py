@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from quiz.models import Player, PlayerAnswer, RecentAnswer
+
+
+def seed_ring(player_id):
+    """
+    Fill a player's ring of recent answers from the player's latest answers
+
+    :param player_id: id of the player
+    :type player_id: int
+
+    :return: Number of answers in the ring, None if the ring already holds every answer it can
+    :rtype: int
+    """
+    with transaction.atomic():
+        # Lock the player like record_answer does, so no answer is recorded while the ring is replaced
+        recent_count = Player.objects.select_for_update().values_list('recent_count', flat=True).get(pk=player_id)
+        latest = list(PlayerAnswer.objects.filter(player_id=player_id).order_by('-answer_date', '-id')
+                      .values_list('question_id', 'report_skip')[:RecentAnswer.SIZE])
+        if RecentAnswer.objects.filter(player_id=player_id).count() >= len(latest):
+            return None
+
+        # The newest answer keeps the latest position, so answers recorded later follow on from it
+        position = max(recent_count, len(latest))
+        RecentAnswer.objects.filter(player_id=player_id).delete()
+        RecentAnswer.objects.bulk_create(
+            RecentAnswer(player_id=player_id, slot=(position - i) % RecentAnswer.SIZE, position=position - i,
+                         question_id=question_id, report_skip=report_skip)
+            for i, (question_id, report_skip) in enumerate(latest)
+        )
+        if position != recent_count:
+            Player.objects.filter(pk=player_id).update(recent_count=position)
+        return len(latest)
+
+
+class Command(BaseCommand):
+    help = 'Fill the rings of recent answers that are not full from the answer history, ' \
+           'for players who answered before the rings were kept'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report players whose ring is not full')
+
+    def handle(self, *args, **options):
+        rings = dict(RecentAnswer.objects.order_by().values_list('player_id').annotate(count=Count('id')))
+        player_ids = PlayerAnswer.objects.order_by('player_id').values_list('player_id', flat=True).distinct()
+
+        seeded = 0
+        for player_id in player_ids.iterator():
+            if rings.get(player_id, 0) >= RecentAnswer.SIZE:
+                continue
+            if options['dry_run']:
+                self.stdout.write('Player %d: %d recent answers kept' % (player_id, rings.get(player_id, 0)))
+                seeded += 1
+                continue
+            count = seed_ring(player_id)
+            if count is not None:
+                self.stdout.write('Player %d: %d recent answers seeded' % (player_id, count))
+                seeded += 1
+
+        self.stdout.write('%d rings %s' % (seeded, 'not full' if options['dry_run'] else 'seeded'))
@@ -1,9 +1,16 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.conf import settings
 from django.contrib.auth.admin import User
 from django.utils import timezone
-from re import match
-from django.db.models import Count
-from datetime import datetime
+from django.db.models import Count, Sum, F, Q, Case, When, Value, IntegerField, prefetch_related_objects
+from django.core.exceptions import ObjectDoesNotExist
+from datetime import datetime, time, timedelta
+from django.core.cache import cache
+from collections import Counter, OrderedDict, defaultdict
+import json
+import math
+import re
+import uuid
 
 
 class Achievement(models.Model):
@@ -11,28 +18,75 @@ class Achievement(models.Model):
     badge = models.ImageField(verbose_name='Badge', blank=True, null=True)
 
     def is_achieved(self, player):
-        for prop in self.property_set.all():
-            try:
-                PropertyUnlock.objects.get(player=player, prop=prop)
-            except PropertyUnlock.DoesNotExist:
-                return False
-        return True
+        return not self.property_set.exclude(propertyunlock__player=player).exists()
 
     def update(self, player):
-        if self.is_achieved(player):
-            try:
-                AchievementUnlock.objects.get(player=player, achievement=self)
-            except AchievementUnlock.DoesNotExist:
-                AchievementUnlock(player=player, achievement=self).save()
-                titles = Title.objects.filter(achievement=self)
-                for title in titles:
-                    TitleUnlock(title=title, player=player).save()
+        Achievement.update_all(player, [self.pk])
+
+    def achieved_players(self):
+        """
+        Get the players who have unlocked every property of the achievement, in one grouped query
+
+        :return: Player ids
+        :rtype: QuerySet
+        """
+        properties = self.property_set.count()
+        if not properties:
+            return Player.objects.values_list('id', flat=True)
+        return PropertyUnlock.objects.filter(prop__achievements=self).values('player')\
+            .annotate(unlocked=Count('prop', distinct=True)).filter(unlocked=properties)\
+            .values_list('player', flat=True)
+
+    @staticmethod
+    def update_all(player, achievement_ids, graph=None):
+        """
+        Unlock the achievements whose properties have all been unlocked by the player, and their titles.
+        The definitions are read from the AchievementGraph, and the unlocks are written in bulk.
+
+        :param player: Player to unlock achievements for
+        :type player: Player object
+
+        :param achievement_ids: ids of the achievements to check
+        :type achievement_ids: iterable
+
+        :param graph: Graph already got by the caller, AchievementGraph.get() by default
+        :type graph: AchievementGraph
+
+        :return: ids of the newly unlocked achievements
+        :rtype: list
+        """
+        graph = graph or AchievementGraph.get()
+        achievement_ids = set(achievement_ids) & set(graph.achievement_properties)
+        if not achievement_ids:
+            return []
+
+        achievement_ids -= set(AchievementUnlock.objects.filter(player=player, achievement__in=achievement_ids)
+                               .values_list('achievement_id', flat=True))
+        property_ids = set().union(*(graph.achievement_properties[pk] for pk in achievement_ids))
+        unlocked = set()
+        if property_ids:
+            unlocked = set(PropertyUnlock.objects.filter(player=player, prop__in=property_ids)
+                           .values_list('prop_id', flat=True))
+        achieved = sorted(pk for pk in achievement_ids if graph.achievement_properties[pk] <= unlocked)
+
+        if achieved:
+            AchievementUnlock.objects.bulk_create(
+                AchievementUnlock(player=player, achievement_id=pk) for pk in achieved
+            )
+            TitleUnlock.objects.bulk_create(
+                TitleUnlock(player=player, title_id=title_id)
+                for pk in achieved for title_id in graph.achievement_titles.get(pk, ())
+            )
+        return achieved
 
     def __str__(self):
         return self.name
 
 
 class Property(models.Model):
+    # Reverse one-to-one accessors of the concrete property types
+    SUBCLASSES = ('propansweredquestioninsubject',)
+
     name = models.CharField(max_length=50, verbose_name='Name', default='')
     achievements = models.ManyToManyField(Achievement, blank=True)
 
@@ -42,18 +96,65 @@ class Property(models.Model):
         return True
 
     def update(self, player):
-        if self.is_unlocked(player):
-            try:
-                PropertyUnlock.objects.get(player=player, prop=self)
-            except PropertyUnlock.DoesNotExist:
-                PropertyUnlock(player=player, prop=self).save()
-            for achievement in self.achievements.all():
-                achievement.update(player)
-        else:
+        Property.update_all(player, [self])
+
+    def unlocked_players(self):
+        """
+        Get the players for whom the property is unlocked, in one query.
+        Implemented in subclasses along with is_unlocked
+
+        :return: Player ids
+        :rtype: QuerySet
+        """
+        return Player.objects.values_list('id', flat=True)
+
+    @staticmethod
+    def update_all(player, properties, graph=None):
+        """
+        Lock or unlock properties for a player, then check the achievements of the unlocked properties.
+        Unlocks are written in bulk, so the number of queries only depends on the number of properties.
+
+        :param player: Player to update properties for
+        :type player: Player object
+
+        :param properties: Properties of concrete type, see as_subclass
+        :type properties: list
+
+        :param graph: Graph already got by the caller, AchievementGraph.get() by default
+        :type graph: AchievementGraph
+
+        :return: None
+        :rtype: None
+        """
+        unlocked = {prop.pk for prop in properties if prop.is_unlocked(player)}
+        locked = {prop.pk for prop in properties} - unlocked
+
+        with transaction.atomic():
+            existing = set(PropertyUnlock.objects.filter(player=player, prop__in=[prop.pk for prop in properties])
+                           .values_list('prop_id', flat=True))
+            if locked & existing:
+                PropertyUnlock.objects.filter(player=player, prop__in=locked & existing).delete()
+            if unlocked - existing:
+                PropertyUnlock.objects.bulk_create(
+                    PropertyUnlock(player=player, prop_id=prop_id) for prop_id in unlocked - existing
+                )
+            if unlocked:
+                graph = graph or AchievementGraph.get()
+                Achievement.update_all(player, graph.achievements_of(unlocked), graph)
+
+    def as_subclass(self):
+        """
+        Returns the instance of the concrete property type, without a query if it was selected related
+
+        :return: Property of concrete type, self if it has none
+        :rtype: Property object
+        """
+        for name in Property.SUBCLASSES:
             try:
-                PropertyUnlock.objects.get(player=player, prop=self).delete()
-            except PropertyUnlock.DoesNotExist:
-                pass
+                return getattr(self, name)
+            except ObjectDoesNotExist:
+                continue
+        return self
 
     def __str__(self):
         return self.name
@@ -67,13 +168,195 @@ class Trigger(models.Model):
     properties = models.ManyToManyField(Property, blank=True)
 
     def trigger(self, player):
-        for prop in self.properties.all():
-            prop.update(player)
+        graph = AchievementGraph.get()
+        Property.update_all(player, graph.properties_of({self.pk}), graph)
 
     def __str__(self):
         return self.name
 
 
+class AchievementGraph(object):
+    """
+    The trigger -> property -> achievement -> title definitions, compiled once per process,
+    so evaluating achievements does not query them.
+    quiz.signals calls invalidate when an admin changes a definition. The graph is then compiled again
+    on its next use in every process that shares the cache, see CACHES.
+    """
+    CACHE_KEY = 'quiz.achievement_graph'
+
+    # (token, graph) of the graph compiled in this process
+    _compiled = None
+
+    def __init__(self):
+        properties = Property.objects.select_related(*Property.SUBCLASSES).order_by('id')
+        # Concrete properties by id, only read after compiling
+        self.properties = {prop.pk: prop.as_subclass() for prop in properties}
+
+        trigger_properties = defaultdict(set)
+        for trigger_id, property_id in Trigger.properties.through.objects.values_list('trigger_id', 'property_id'):
+            trigger_properties[trigger_id].add(property_id)
+        self.trigger_properties = {pk: frozenset(ids) for pk, ids in trigger_properties.items()}
+        self.triggered = frozenset().union(*self.trigger_properties.values())
+
+        achievement_properties = {pk: set() for pk in Achievement.objects.values_list('id', flat=True)}
+        property_achievements = defaultdict(set)
+        for property_id, achievement_id in Property.achievements.through.objects\
+                .values_list('property_id', 'achievement_id'):
+            achievement_properties[achievement_id].add(property_id)
+            property_achievements[property_id].add(achievement_id)
+        self.achievement_properties = {pk: frozenset(ids) for pk, ids in achievement_properties.items()}
+        self.property_achievements = {pk: frozenset(ids) for pk, ids in property_achievements.items()}
+
+        achievement_titles = defaultdict(list)
+        for achievement_id, title_id in Title.objects.filter(achievement__isnull=False).order_by('id')\
+                .values_list('achievement_id', 'id'):
+            achievement_titles[achievement_id].append(title_id)
+        self.achievement_titles = {pk: tuple(ids) for pk, ids in achievement_titles.items()}
+
+    def properties_of(self, trigger_ids):
+        """
+        Get the properties of some triggers
+
+        :param trigger_ids: ids of the triggers, None among them for every trigger
+        :type trigger_ids: set
+
+        :return: Properties of concrete type
+        :rtype: list
+        """
+        if None in trigger_ids:
+            property_ids = self.triggered
+        else:
+            property_ids = frozenset().union(*(self.trigger_properties.get(pk, ()) for pk in trigger_ids))
+        return [self.properties[pk] for pk in sorted(property_ids)]
+
+    def achievements_of(self, property_ids):
+        """
+        Get the achievements that have any of the properties
+
+        :param property_ids: ids of the properties
+        :type property_ids: iterable
+
+        :return: ids of the achievements
+        :rtype: set
+        """
+        return set().union(*(self.property_achievements.get(pk, ()) for pk in property_ids))
+
+    @staticmethod
+    def get():
+        """
+        Get the compiled graph, compiling it if the definitions have changed since it was compiled.
+        Reads the token from the cache, which must be shared by all processes for them to see changes.
+
+        :return: Compiled graph
+        :rtype: AchievementGraph
+        """
+        token = cache.get(AchievementGraph.CACHE_KEY)
+        if token is None:
+            cache.add(AchievementGraph.CACHE_KEY, uuid.uuid4().hex, None)
+            token = cache.get(AchievementGraph.CACHE_KEY)
+
+        compiled = AchievementGraph._compiled
+        if compiled is None or compiled[0] != token:
+            compiled = AchievementGraph._compiled = (token, AchievementGraph())
+        return compiled[1]
+
+    @staticmethod
+    def invalidate():
+        """
+        Make every process compile the graph again on its next use
+
+        :return: None
+        :rtype: None
+        """
+        AchievementGraph._compiled = None
+        cache.set(AchievementGraph.CACHE_KEY, uuid.uuid4().hex, None)
+
+
+class AchievementEvent(models.Model):
+    """
+    A player whose achievements are to be evaluated, queued when the player answers and drained
+    by the process_achievements command. Events are only deleted in the transaction that evaluated them,
+    so every event is evaluated at least once.
+    """
+    player = models.ForeignKey('Player')
+    # None to evaluate the properties of every trigger
+    trigger = models.ForeignKey(Trigger, blank=True, null=True)
+    created = models.DateTimeField(default=timezone.now, verbose_name='Date')
+
+    @staticmethod
+    def enqueue(player, trigger=None):
+        """
+        Queue an evaluation of a player's achievements, or evaluate them right away if ACHIEVEMENTS_INLINE is set
+
+        :param player: Player to evaluate
+        :type player: Player object
+
+        :param trigger: Trigger whose properties are to be evaluated, None for every trigger
+        :type trigger: Trigger object
+
+        :return: None
+        :rtype: None
+        """
+        if settings.ACHIEVEMENTS_INLINE:
+            AchievementEvent.evaluate(player.pk, {trigger.pk if trigger else None})
+        else:
+            AchievementEvent.objects.create(player=player, trigger=trigger)
+
+    @staticmethod
+    def evaluate(player_id, trigger_ids, graph=None):
+        """
+        Update the properties of some triggers for a player.
+        The player is locked, so workers running side by side never evaluate the same player at once.
+
+        :param player_id: id of the player
+        :type player_id: int
+
+        :param trigger_ids: ids of the triggers, None among them for every trigger
+        :type trigger_ids: set
+
+        :param graph: Graph already got by the caller, AchievementGraph.get() by default
+        :type graph: AchievementGraph
+
+        :return: None
+        :rtype: None
+        """
+        graph = graph or AchievementGraph.get()
+        properties = graph.properties_of(trigger_ids)
+
+        with transaction.atomic():
+            player = Player.objects.select_for_update().get(pk=player_id)
+            Property.update_all(player, properties, graph)
+
+    @staticmethod
+    def process(batch_size=1000):
+        """
+        Evaluate a batch of queued events, oldest first.
+        All events of a player in the batch are coalesced into one evaluation.
+
+        :param batch_size: Maximum number of events to take from the queue
+        :type batch_size: int
+
+        :return: Number of events processed
+        :rtype: int
+        """
+        events = list(AchievementEvent.objects.order_by('id').values_list('id', 'player_id', 'trigger_id')[:batch_size])
+
+        players = OrderedDict()
+        for pk, player_id, trigger_id in events:
+            event_ids, trigger_ids = players.setdefault(player_id, ([], set()))
+            event_ids.append(pk)
+            trigger_ids.add(trigger_id)
+
+        # The definitions are checked for changes once per batch
+        graph = AchievementGraph.get() if players else None
+        for player_id, (event_ids, trigger_ids) in players.items():
+            with transaction.atomic():
+                AchievementEvent.evaluate(player_id, trigger_ids, graph)
+                AchievementEvent.objects.filter(pk__in=event_ids).delete()
+
+        return len(events)
+
+
 class Title(models.Model):
     title = models.CharField(max_length=50, verbose_name='Title')
     achievement = models.ForeignKey(Achievement, blank=True, null=True)
@@ -85,6 +368,34 @@ class Title(models.Model):
 class Player(models.Model):
     title = models.ForeignKey(Title, blank=True, null=True)
     user = models.OneToOneField(User)
+    # Number of answers ever pushed to the player's RecentAnswer ring
+    recent_count = models.PositiveIntegerField(default=0)
+    # Comma separated ids of the next questions to be answered, selected at queue_rating
+    # for the topics of topic_version queue_version
+    question_queue = models.CharField(max_length=200, blank=True, default='')
+    queue_rating = models.DecimalField(max_digits=8, decimal_places=3, blank=True, null=True)
+    queue_version = models.PositiveIntegerField(blank=True, null=True)
+
+    # Results of the latest answers in the topics streak_topics (comma separated ids), oldest first,
+    # built for the topics of topic_version streak_version.
+    # '1' is a correct answer, '0' a wrong one, report skips are left out
+    streak = models.CharField(max_length=10, blank=True, default='')
+    streak_topics = models.TextField(blank=True, default='')
+    streak_version = models.PositiveIntegerField(blank=True, null=True)
+    # Incremented whenever the player's topics change. The queue and the streak are kept for a topic_version,
+    # and selected or built again when it has changed
+    topic_version = models.PositiveIntegerField(default=0)
+
+    # Number of questions selected at once, and how far the rating may move before they are selected again
+    QUEUE_SIZE = 5
+    QUEUE_THRESHOLD = 50
+
+    # Number of latest answers that make up the streak used by virtual_rating
+    STREAK_LENGTH = 5
+
+    # Default and largest number of points of a rating history
+    RATING_HISTORY_POINTS = 200
+    RATING_HISTORY_MAX_POINTS = 1000
 
     def set_rating(self, rating):
         PlayerRating.set_rating(self, rating)
@@ -93,17 +404,26 @@ class Player(models.Model):
         counts = []
         titles = []
 
-        query = PlayerAnswer.objects.filter(player=self).values('question__topic__subject')\
-            .annotate(count=Count('question__topic__subject'))
+        query = PlayerSubjectStats.objects.filter(player=self, answered__gt=0).select_related('subject')\
+            .order_by('subject_id')
 
-        for element in query:
-            sub = Subject.objects.get(pk=element['question__topic__subject'])
-            count = element['count']
-            counts.append(count)
-            titles.append(sub.title)
+        for stats in query:
+            counts.append(stats.answered)
+            titles.append(stats.subject.title)
 
         return counts, titles
 
+    def favourite_subject(self):
+        """
+        Get the subject in which the player has answered the most questions
+
+        :return: Subject, None if the player has not answered any questions
+        :rtype: Subject object
+        """
+        stats = PlayerSubjectStats.objects.filter(player=self, answered__gt=0).select_related('subject')\
+            .order_by('-answered', 'subject_id').first()
+        return stats.subject if stats else None
+
     def rating_list(self, subject=None):
         if subject is None:
             subject = self.subject()
@@ -112,9 +432,161 @@ class Player(models.Model):
 
         return [float(a[0]) for a in qset], [datetime.strftime(a[1], '%d %B') for a in qset]
 
+    def rating_days(self, subject):
+        """
+        Get the player's rating in a subject summarized per day, oldest first.
+        Days that have been rolled up are read from PlayerTopicDay, so only the answers of later days are read.
+
+        :param subject: Subject whose ratings are wanted
+        :type subject: Subject object
+
+        :return: List of (day, open, high, low, close), open and close being the ratings after the day's
+        first and last answers
+        :rtype: list
+        """
+        rolled_up = RollupDay.last()
+
+        days = []
+        # A day's rows of the subject's topics, by when their first answer was given
+        rows = PlayerTopicDay.objects.filter(player=self, topic__subject=subject).order_by('day', 'first_answer')\
+            .values_list('day', 'first_rating', 'high_rating', 'low_rating', 'last_rating', 'last_answer')
+        last_answers = {}
+        for day, first, high, low, last, last_answer in rows:
+            first, high, low, last = float(first), float(high), float(low), float(last)
+            if days and days[-1][0] == day:
+                _, open_rating, day_high, day_low, close = days[-1]
+                if last_answer > last_answers[day]:
+                    last_answers[day] = last_answer
+                    close = last
+                days[-1] = (day, open_rating, max(day_high, high), min(day_low, low), close)
+            else:
+                last_answers[day] = last_answer
+                days.append((day, first, high, low, last))
+
+        answers = PlayerAnswer.objects.filter(player=self, question__topic__subject=subject)
+        if rolled_up:
+            answers = answers.filter(answer_date__gte=RollupDay.start(rolled_up + timedelta(days=1)))
+
+        for answer_date, rating in answers.order_by('answer_date', 'id').values_list('answer_date', 'rating'):
+            day = answer_date.astimezone(timezone.utc).date()
+            rating = float(rating)
+            if days and days[-1][0] == day:
+                _, open_rating, high, low, _ = days[-1]
+                days[-1] = (day, open_rating, max(high, rating), min(low, rating), rating)
+            else:
+                days.append((day, rating, rating, rating, rating))
+
+        return days
+
+    def activity(self, days):
+        """
+        Get how many questions the player has answered in the last days, today included.
+        Answers to questions without a topic are left out, as they are from PlayerTopicDay
+
+        :param days: Number of days
+        :type days: int
+
+        :return: Number of answers and number of correct answers
+        :rtype: tuple
+        """
+        today = timezone.now().astimezone(timezone.utc).date()
+        first_day = today - timedelta(days=days - 1)
+        rolled_up = RollupDay.last()
+
+        rolled = PlayerTopicDay.objects.filter(player=self, day__gte=first_day)
+        raw = PlayerAnswer.objects.filter(player=self, answer_date__gte=RollupDay.start(first_day),
+                                          question__topic__isnull=False)
+        if rolled_up:
+            rolled = rolled.filter(day__lte=rolled_up)
+            raw = raw.filter(answer_date__gte=RollupDay.start(rolled_up + timedelta(days=1)))
+        else:
+            rolled = rolled.none()
+
+        rolled = rolled.aggregate(attempts=models.Sum('attempts'), correct=models.Sum('correct'))
+        raw = raw.aggregate(attempts=Count('id'), correct=Count(Case(When(result=True, then=Value(1)))))
+        return (rolled['attempts'] or 0) + raw['attempts'], (rolled['correct'] or 0) + raw['correct']
+
+    def rating_history(self, subject, points):
+        """
+        Get the player's rating history in a subject with at most points points.
+        Every answer is a point if there are few enough of them, otherwise every day is a point,
+        and days are left out with largest_triangle_three_buckets if there are too many of them.
+
+        :param subject: Subject whose ratings are wanted
+        :type subject: Subject object
+
+        :param points: Maximum number of points
+        :type points: int
+
+        :return: Resolution ('answer' or 'day'), labels, and open, high, low and close rating of every point
+        :rtype: dict
+        """
+        answered = PlayerSubjectStats.objects.filter(player=self, subject=subject)\
+            .values_list('answered', flat=True).first() or 0
+
+        if answered <= points:
+            rows = PlayerAnswer.objects.filter(player=self, question__topic__subject=subject)\
+                .order_by('answer_date', 'id').values_list('answer_date', 'rating')
+            resolution = 'answer'
+            rows = [(answer_date.isoformat(), float(rating)) for answer_date, rating in rows]
+            rows = [(label, rating, rating, rating, rating) for label, rating in rows]
+        else:
+            resolution = 'day'
+            rows = self.rating_days(subject)
+            if len(rows) > points:
+                keep = Player.largest_triangle_three_buckets(
+                    [(day.toordinal(), close) for day, _, _, _, close in rows], points)
+                rows = [rows[i] for i in keep]
+            rows = [(day.isoformat(),) + tuple(ratings) for day, *ratings in rows]
+
+        labels, opens, highs, lows, closes = (list(column) for column in zip(*rows)) if rows else ([],) * 5
+        return {
+            'resolution': resolution,
+            'labels': labels,
+            'open': opens,
+            'high': highs,
+            'low': lows,
+            'close': closes,
+        }
+
+    @staticmethod
+    def largest_triangle_three_buckets(points, threshold):
+        """
+        Choose threshold of the points so a line through them keeps the shape of a line through all of them.
+        The first and last point are kept, the others are split into buckets, and from each bucket the point
+        making the largest triangle with the point chosen before it and the average of the next bucket is kept.
+
+        :param points: (x, y) of every point, ordered by x
+        :type points: list
+
+        :param threshold: Number of points to keep, at least 3
+        :type threshold: int
+
+        :return: Indices of the points to keep
+        :rtype: list
+        """
+        if threshold >= len(points) or threshold < 3:
+            return list(range(len(points)))
+
+        size = (len(points) - 2) / (threshold - 2)
+        keep = [0]
+        for bucket in range(threshold - 2):
+            start = int(bucket * size) + 1
+            end = int((bucket + 1) * size) + 1
+            next_end = min(int((bucket + 2) * size) + 1, len(points))
+            following = points[end:next_end] or [points[-1]]
+            average_x = sum(x for x, _ in following) / len(following)
+            average_y = sum(y for _, y in following) / len(following)
+
+            ax, ay = points[keep[-1]]
+            keep.append(max(range(start, end), key=lambda i: abs(
+                (ax - average_x) * (points[i][1] - ay) - (ax - points[i][0]) * (average_y - ay))))
+        keep.append(len(points) - 1)
+        return keep
+
     def subject(self):
         try:
-            return PlayerTopic.objects.filter(player=self).first().topic.subject
+            return PlayerTopic.objects.filter(player=self).select_related('topic__subject').first().topic.subject
         except AttributeError:
             return None
 
@@ -123,7 +595,15 @@ class Player(models.Model):
 
     def update(self, question, win):
         """
-        Adjust rating of player and question when question has been answered
+        Adjust rating of player and question when question has been answered.
+        Everything happens in one transaction with a fixed number of statements. The player's rating row
+        and then the question row are locked before they are read, so concurrent answers by the same player
+        or to the same question are applied one after the other and no rating update is lost.
+        Eleven statements in all, once the player has a rating and a full ring of recent answers:
+        the subject, the locked reads of the rating, the question and the player, one write to each of
+        them and to the ring and the subject stats, and the inserted answer and achievement event.
+        Each writes another table, or reads a row the Elo update or the ring position depends on.
+        Moving to another rating bucket adds two F() updates.
 
         :param question: question that has been answered
         :type question: Question object
@@ -135,22 +615,61 @@ class Player(models.Model):
         :rtype: None
         """
         win = int(win)
+
+        with transaction.atomic():
+            subject_id = PlayerTopic.objects.filter(player=self).values_list('topic__subject', flat=True).first()
+
+            player_rating = None
+            rating = 1200
+            if subject_id:
+                player_rating, created = PlayerRating.objects.select_for_update()\
+                    .get_or_create(player=self, subject_id=subject_id)
+                rating = float(player_rating.rating)
+
+            # The question may have been deleted since it was served
+            question_rating = float(Question.all_objects.select_for_update()
+                                    .values_list('rating', flat=True).get(pk=question.pk))
+
+            new_ratings = Player.rating_change(rating, question_rating, win)
+            if new_ratings:
+                old_rating = rating
+                rating, question.rating = new_ratings
+                Question.all_objects.filter(pk=question.pk).update(rating=question.rating)
+                if player_rating:
+                    PlayerRating.objects.filter(pk=player_rating.pk).update(rating=rating)
+                    RatingBucket.move(subject_id, old_rating, rating)
+
+            PlayerAnswer.objects.create(player=self, question=question, result=win, rating=rating)
+
+    @staticmethod
+    def rating_change(rating, question_rating, win):
+        """
+        Compute the new ratings of a player and a question after the player has answered the question
+
+        :param rating: Player's rating
+        :type rating: float
+
+        :param question_rating: Question's rating
+        :type question_rating: float
+
+        :param win: 1 if the question was answered correctly, 0 otherwise
+        :type win: int
+
+        :return: New rating of the player and of the question, None if the ratings are not to be changed
+        :rtype: tuple
+        """
         question_k = 8
         player_k = 16
         rating_cap = 150
 
-        rating = float(self.rating())
-        question_rating = float(question.rating)
-
-        if rating - question_rating < rating_cap:
-            new_rating = rating + player_k * (win - self.exp(rating, question_rating))
-            question.rating = question_rating + question_k * ((1-win) - self.exp(question_rating, rating))
-            question.save()
-            PlayerRating.set_rating(self, new_rating)
+        if rating - question_rating >= rating_cap:
+            return None
 
-        PlayerAnswer.objects.create(player=self, question=question, result=win)
+        return (rating + player_k * (win - Player.exp(rating, question_rating)),
+                question_rating + question_k * ((1-win) - Player.exp(question_rating, rating)))
 
-    def exp(self, a, b):
+    @staticmethod
+    def exp(a, b):
         """
         Returns a fraction to be used in adjustment of rating.
         The larger the difference between opponents, the smaller the return value will be,
@@ -170,24 +689,230 @@ class Player(models.Model):
     def virtual_rating(self, topics):
         """
         Return rating adjusted up if player is on win streak, down if on loss streak.
+        The streak is kept up to date by record_answer, and only rebuilt from the answer history
+        when it was built for another topic_version than the player's.
 
-        :param topics: List of PlayerTopic objects
+        :param topics: The player's topics, read after the player's topic_version
         :type topics: list
 
         :return: Player's adjusted rating
         :rtype: float
         """
         virtual_k = 10
-        virtual_c = 5
 
-        # Get the virtual_c latest answers that are not reports
-        # (report_skip must equal False) and in/decrease rating thereafter
-        answers = [pa for pa in PlayerAnswer.objects.filter(player=self, question__topic__in=topics)
-                   .order_by('-answer_date') if pa.report_skip is not True][:virtual_c]
+        self.refresh_from_db(fields=['streak', 'streak_version'])
+
+        if self.streak_version != self.topic_version:
+            self.streak = self.streak_from_history(topics)
+            self.streak_topics = ','.join(str(pk) for pk in sorted(topic.id for topic in topics))
+            self.streak_version = self.topic_version
+            # Not kept if the topics have changed again since
+            Player.objects.filter(pk=self.pk, topic_version=self.topic_version)\
+                .update(streak=self.streak, streak_topics=self.streak_topics, streak_version=self.streak_version)
 
-        virtual = sum([virtual_k if answer.result else -virtual_k for answer in answers])
+        virtual = sum([virtual_k if result == '1' else -virtual_k for result in self.streak])
         return PlayerRating.get_rating(self) + virtual
 
+    def streak_from_history(self, topics):
+        """
+        Return the streak of the player in the topics, computed from the answer history
+
+        :param topics: List of Topic objects or topic ids
+        :type topics: list
+
+        :return: Results of the latest answers that are not report skips, oldest first
+        :rtype: str
+        """
+        # Get the STREAK_LENGTH latest answers that are not reports
+        # (report_skip must equal False) and in/decrease rating thereafter
+        results = PlayerAnswer.objects.filter(player=self, question__topic__in=topics, report_skip=False)\
+            .order_by('-answer_date', '-id').values_list('result', flat=True)[:Player.STREAK_LENGTH]
+
+        return ''.join('1' if result else '0' for result in reversed(results))
+
+    def next_question(self, topics, recent_answers=None):
+        """
+        Return the question to be answered next: the one closest to the player's virtual rating
+        that is not among the player's latest answers.
+        The closest questions are selected QUEUE_SIZE at a time and queued, the queue is selected again
+        when it runs empty, the player's rating has moved more than QUEUE_THRESHOLD since
+        or it was selected for another topic_version than the player's.
+        After an answer the queue is refilled by refill_queue, so it is normally only popped here.
+
+        :param topics: The player's topics, read after the player's topic_version
+        :type topics: list
+
+        :param recent_answers: The player's recent answers if already fetched, see recent_answers()
+        :type recent_answers: list
+
+        :return: Question of concrete type to be answered, None if there are no questions in the topics
+        :rtype: Question object
+        """
+        self.refresh_from_db(fields=['question_queue', 'queue_rating', 'queue_version'])
+        rating = self.rating()
+
+        if self.queue_valid(rating):
+            # Questions may have been quarantined since they were queued
+            questions = [question for question in
+                         Question.get_subclasses([int(pk) for pk in self.question_queue.split(',')])
+                         if question.status == Question.ACTIVE]
+            if questions:
+                return questions[0]
+
+        queue, recent = self.select_queue(topics, rating, recent_answers)
+        if queue:
+            return Question.get_subclass(queue[0])
+
+        # Every question in the topics has been answered recently, repeat the one answered longest ago
+        recent_in_topics = Question.objects.filter(id__in=recent, topic__in=topics, status=Question.ACTIVE)\
+            .values_list('id', flat=True)
+        for question_id in reversed(recent):
+            if question_id in recent_in_topics:
+                return Question.get_subclass(question_id)
+
+        return None
+
+    def queue_valid(self, rating):
+        """
+        Return whether the loaded question queue can be popped: it is not empty, was selected for the player's
+        topic_version and the player's rating has not moved more than QUEUE_THRESHOLD since
+
+        :param rating: The player's rating
+        :type rating: float
+
+        :return: True if the queue can be popped
+        :rtype: boolean
+        """
+        return bool(self.question_queue) and self.queue_version == self.topic_version and \
+            abs(float(rating) - float(self.queue_rating)) <= Player.QUEUE_THRESHOLD
+
+    def select_queue(self, topics, rating, recent_answers=None):
+        """
+        Select the QUEUE_SIZE questions closest to the player's virtual rating that are not among the player's
+        latest answers, and store them as the player's question queue
+
+        :param topics: The player's topics, read after the player's topic_version
+        :type topics: list
+
+        :param rating: The player's rating
+        :type rating: float
+
+        :param recent_answers: The player's recent answers if already fetched, see recent_answers()
+        :type recent_answers: list
+
+        :return: Ids of the queued questions, and ids of the recently answered questions that were left out
+        :rtype: tuple
+        """
+        repeat = 5
+
+        if recent_answers is None:
+            recent_answers = self.recent_answers()
+        recent = [recent_answer.question_id for recent_answer in recent_answers[:repeat]]
+
+        queue = [question.id for question in
+                 Question.nearest(topics, self.virtual_rating(topics), exclude=recent, count=Player.QUEUE_SIZE)]
+        # Not kept if the topics have changed since they were read
+        Player.objects.filter(pk=self.pk, topic_version=self.topic_version)\
+            .update(question_queue=','.join(str(pk) for pk in queue), queue_rating=rating,
+                    queue_version=self.topic_version)
+        return queue, recent
+
+    def refill_queue(self):
+        """
+        Select the question queue again if the next question cannot be popped from it.
+        Called once an answer has been committed, so the request for the next question only pops the queue.
+
+        :return: None
+        :rtype: None
+        """
+        self.refresh_from_db(fields=['topic_version', 'question_queue', 'queue_rating', 'queue_version'])
+        rating = self.rating()
+        if self.queue_valid(rating):
+            return
+
+        topics = [player_topic.topic for player_topic in
+                  PlayerTopic.objects.filter(player=self).select_related('topic')]
+        if topics:
+            self.select_queue(topics, rating)
+
+    def set_topics(self, topic_ids):
+        """
+        Make the given topics the player's topics, inserting and deleting only the PlayerTopic objects that differ.
+        If the topics change, topic_version is incremented, which invalidates the question queue and the streak,
+        and the queue is emptied.
+
+        :param topic_ids: Ids of the topics to select
+        :type topic_ids: iterable
+
+        :return: The player's topic version after the change
+        :rtype: int
+        """
+        topic_ids = set(topic_ids)
+        with transaction.atomic():
+            # Lock the player, so concurrent selections are applied one after the other
+            version = Player.objects.select_for_update().values_list('topic_version', flat=True).get(pk=self.pk)
+            current = set(PlayerTopic.objects.filter(player=self).values_list('topic_id', flat=True))
+
+            removed = current - topic_ids
+            if removed:
+                PlayerTopic.objects.filter(player=self, topic_id__in=removed).delete()
+            added = topic_ids - current
+            if added:
+                PlayerTopic.objects.bulk_create(PlayerTopic(player=self, topic_id=pk) for pk in sorted(added))
+
+            if added or removed:
+                version += 1
+                Player.objects.filter(pk=self.pk).update(question_queue='', topic_version=version)
+                self.question_queue = ''
+
+        self.topic_version = version
+        return version
+
+    def recent_answers(self):
+        """
+        Return the player's latest answers and report skips, newest first
+
+        :return: At most RecentAnswer.SIZE RecentAnswer objects with their questions
+        :rtype: list
+        """
+        return list(RecentAnswer.objects.filter(player=self).select_related('question').order_by('-position'))
+
+    def record_answer(self, question, result, report_skip=False):
+        """
+        Store an answer in the player's ring of recent answers, overwriting the oldest one when full,
+        take the question out of the player's question queue and add the result to the player's streak.
+        The player's row is locked before it is read and written back in one statement,
+        so concurrent answers by the same player get distinct positions and do not lose updates.
+
+        :param question: Question that has been answered
+        :type question: Question object
+
+        :param result: True if the question was answered correctly
+        :type result: boolean
+
+        :param report_skip: True if the question was skipped because it was reported
+        :type report_skip: boolean
+
+        :return: None
+        :rtype: None
+        """
+        with transaction.atomic(savepoint=False):
+            position, queue, streak, streak_topics = Player.objects.select_for_update()\
+                .values_list('recent_count', 'question_queue', 'streak', 'streak_topics').get(pk=self.pk)
+            position += 1
+
+            changes = {'recent_count': position}
+            if str(question.id) in queue.split(','):
+                changes['question_queue'] = ','.join(pk for pk in queue.split(',') if pk != str(question.id))
+            if not report_skip and str(question.topic_id) in streak_topics.split(','):
+                changes['streak'] = (streak + ('1' if result else '0'))[-Player.STREAK_LENGTH:]
+            Player.objects.filter(pk=self.pk).update(**changes)
+
+            # The slot only has to be inserted while the ring is filling up
+            recent = {'position': position, 'question': question, 'report_skip': report_skip}
+            if not RecentAnswer.objects.filter(player=self, slot=position % RecentAnswer.SIZE).update(**recent):
+                RecentAnswer.objects.create(player=self, slot=position % RecentAnswer.SIZE, **recent)
+
     def __str__(self):
         return self.user.username
 
@@ -196,17 +921,32 @@ class PropertyUnlock(models.Model):
     player = models.ForeignKey(Player)
     prop = models.ForeignKey(Property)
 
+    class Meta:
+        unique_together = (
+            ('player', 'prop'),
+        )
+
 
 class AchievementUnlock(models.Model):
     player = models.ForeignKey(Player)
     achievement = models.ForeignKey(Achievement)
     date = models.DateTimeField(default=timezone.now, verbose_name='Date')
 
+    class Meta:
+        unique_together = (
+            ('player', 'achievement'),
+        )
+
 
 class TitleUnlock(models.Model):
     player = models.ForeignKey(Player)
     title = models.ForeignKey(Title)
 
+    class Meta:
+        unique_together = (
+            ('player', 'title'),
+        )
+
 
 class Category(models.Model):
     title = models.CharField(max_length=100, verbose_name='Title')
@@ -224,9 +964,30 @@ class Subject(models.Model):
     def __str__(self):
         return '%s - %s' % (self.code, self.title)
 
-    def high_score(self):
-        query = PlayerRating.objects.filter(subject=self).values_list('player', 'rating').order_by('-rating')
-        return [(a[0]+1, Player.objects.get(pk=a[1][0]).user.username, int(a[1][1])) for a in enumerate(query)]
+    # Number of players on a page of the high score list
+    HIGH_SCORE_PAGE_SIZE = 20
+
+    def high_score(self, page=1, page_size=None):
+        """
+        Get a page of the players in the subject, highest rating first.
+        The (subject, rating, id) index on PlayerRating keeps the ratings and their tiebreak in order,
+        so a page is read backwards along it in one query without sorting or loading the other players.
+
+        :param page: Page number, starting at 1
+        :type page: int
+
+        :param page_size: Number of players on a page, HIGH_SCORE_PAGE_SIZE by default
+        :type page_size: int
+
+        :return: List of (rank, username, rating)
+        :rtype: list
+        """
+        if page_size is None:
+            page_size = self.HIGH_SCORE_PAGE_SIZE
+        start = (max(page, 1) - 1) * page_size
+        query = PlayerRating.objects.filter(subject=self).order_by('-rating', '-id')\
+            .values_list('player__user__username', 'rating')[start:start + page_size]
+        return [(start + i + 1, username, int(rating)) for i, (username, rating) in enumerate(query)]
 
 
 class Topic(models.Model):
@@ -237,6 +998,68 @@ class Topic(models.Model):
         return self.title
 
 
+class Catalog(object):
+    """
+    Every subject and topic, with the number of active questions in each topic,
+    as shown by the topic and question forms. Built in one query and kept in the cache until it is invalidated:
+    by quiz.signals when a subject, topic or question is saved or deleted, and when a question's status changes.
+    The cache must be shared by all processes, so an invalidation in one process is seen by the others.
+    """
+    CACHE_KEY = 'quiz.catalog'
+
+    def __init__(self):
+        subjects = OrderedDict()
+        # Topics ordered by subject
+        self.topics = []
+        rows = Subject.objects.order_by('id', 'topic__id')\
+            .values_list('id', 'title', 'short', 'code', 'category_id', 'topic__id', 'topic__title')\
+            .annotate(question_count=Sum(Case(When(topic__question__status=Question.ACTIVE, then=Value(1)),
+                                              default=Value(0), output_field=IntegerField())))
+        for subject_id, title, short, code, category_id, topic_id, topic_title, question_count in rows:
+            if subject_id not in subjects:
+                subjects[subject_id] = Subject(id=subject_id, title=title, short=short, code=code,
+                                               category_id=category_id)
+            if topic_id is not None:
+                topic = Topic(id=topic_id, title=topic_title, subject=subjects[subject_id])
+                topic.question_count = question_count
+                self.topics.append(topic)
+
+        self.subjects = list(subjects.values())
+        self.subjects_by_id = subjects
+        # Topics that have questions, the only ones that can be selected to play
+        self.playable_topics = [topic for topic in self.topics if topic.question_count]
+        self.subject_dict = json.dumps(OrderedDict(
+            (subject.title, [topic.title for topic in self.playable_topics if topic.subject_id == subject.id])
+            for subject in self.subjects
+        ))
+
+    def subject(self, subject_id):
+        """ Return the subject with the given id, or None """
+        return self.subjects_by_id.get(subject_id)
+
+    def subject_topics(self, subject):
+        """ Return the topics of a subject """
+        return [topic for topic in self.topics if topic.subject_id == subject.id]
+
+    @staticmethod
+    def get():
+        """
+        Get the catalog from the cache, building it if it is not there
+
+        :return: Catalog
+        :rtype: Catalog
+        """
+        catalog = cache.get(Catalog.CACHE_KEY)
+        if catalog is None:
+            catalog = Catalog()
+            cache.set(Catalog.CACHE_KEY, catalog, None)
+        return catalog
+
+    @staticmethod
+    def invalidate():
+        cache.delete(Catalog.CACHE_KEY)
+
+
 class PlayerTopic(models.Model):
     player = models.ForeignKey(Player)
     topic = models.ForeignKey(Topic)
@@ -247,6 +1070,14 @@ class PlayerRating(models.Model):
     subject = models.ForeignKey(Subject)
     rating = models.DecimalField(default=1200, max_digits=8, decimal_places=3, verbose_name='Rating')
 
+    class Meta:
+        unique_together = (
+            ('player', 'subject'),
+        )
+        index_together = [
+            ('subject', 'rating', 'id'),
+        ]
+
     @staticmethod
     def get_rating_object(player, subject=None):
         if subject is None:
@@ -299,8 +1130,252 @@ class PlayerRating(models.Model):
         player_rating.rating = rating
         player_rating.save()
 
+    @staticmethod
+    def standing(player, subject=None):
+        """
+        Get a player's rank and percentile in a subject.
+        Players rated in other buckets are counted from the subject's RatingBucket rows,
+        so only the ratings in the player's own bucket are read.
+
+        :param player: Player whose standing is wanted
+        :type player: Player object
+
+        :param subject: Subject in which the standing is wanted
+        :type subject: Subject object
+
+        :return: Rank (1 is the highest rating), number of rated players, and the percentage of them rated lower.
+        None if the player has no subject or no rating in it
+        :rtype: tuple
+        """
+        if subject is None:
+            subject = player.subject()
+        if not subject:
+            return None
+        # Only look the rating up, viewing a standing must not rate the player in the subject
+        player_rating = PlayerRating.objects.filter(player=player, subject=subject).first()
+        if not player_rating:
+            return None
+
+        rating = player_rating.rating
+        own = RatingBucket.bucket_of(rating)
+        above = below = total = 0
+        for bucket, count in RatingBucket.objects.filter(subject_id=player_rating.subject_id)\
+                .values_list('bucket', 'count'):
+            total += count
+            if bucket > own:
+                above += count
+            elif bucket < own:
+                below += count
+
+        in_bucket = PlayerRating.objects.filter(
+            subject_id=player_rating.subject_id,
+            rating__gte=own * RatingBucket.WIDTH,
+            rating__lt=(own + 1) * RatingBucket.WIDTH,
+        ).aggregate(
+            above=Count(Case(When(rating__gt=rating, then=Value(1)))),
+            below=Count(Case(When(rating__lt=rating, then=Value(1)))),
+        )
+        above += in_bucket['above']
+        below += in_bucket['below']
+
+        return above + 1, total, 100 * below / total if total else 0
+
+    def save(self, *args, **kwargs):
+        """
+        Saves PlayerRating and moves it to the bucket of its new rating
+        Model.save doc: https://docs.djangoproject.com/en/1.10/_modules/django/db/models/base/#Model.save
+
+        :param args: see Model.save documentation
+        :param kwargs: see Model.save documentation
+
+        :return: None
+        :rtype: None
+        """
+        with transaction.atomic():
+            old = None
+            if self.pk is not None:
+                old = PlayerRating.objects.filter(pk=self.pk).values_list('rating', flat=True).first()
+            super(PlayerRating, self).save(*args, **kwargs)
+            RatingBucket.move(self.subject_id, old, self.rating)
+
+
+class RatingBucket(models.Model):
+    """
+    Number of players in a subject with a rating in [bucket * WIDTH, (bucket + 1) * WIDTH).
+    Kept up to date whenever a PlayerRating changes, and rebuilt by the rebuild_rating_buckets command.
+    """
+    WIDTH = 10
+
+    subject = models.ForeignKey(Subject)
+    bucket = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (
+            ('subject', 'bucket'),
+        )
+
+    @staticmethod
+    def bucket_of(rating):
+        # Rounded like the rating field, so a rating is counted where it is stored
+        return int(math.floor(round(float(rating), 3) / RatingBucket.WIDTH))
+
+    @staticmethod
+    def add(subject_id, rating, count=1):
+        """
+        Add count players to the bucket of a rating
+
+        :param subject_id: id of the subject
+        :type subject_id: int
+
+        :param rating: Rating of the players
+        :type rating: float
+
+        :param count: Number of players to add, negative to remove them
+        :type count: int
+
+        :return: None
+        :rtype: None
+        """
+        bucket = RatingBucket.bucket_of(rating)
+        rows = RatingBucket.objects.filter(subject_id=subject_id, bucket=bucket)
+        if not rows.update(count=F('count') + count):
+            try:
+                # In a savepoint, so a failed insert leaves the caller's transaction usable
+                with transaction.atomic():
+                    RatingBucket.objects.create(subject_id=subject_id, bucket=bucket, count=count)
+            except IntegrityError:
+                # Another transaction created the bucket since the update
+                rows.update(count=F('count') + count)
+
+    @staticmethod
+    def move(subject_id, old, new):
+        """
+        Move a player from the bucket of its old rating to the bucket of its new rating.
+        The two rows are updated in bucket order, so concurrent moves across the same boundary
+        in opposite directions lock them in the same order and do not deadlock.
+
+        :param subject_id: id of the subject
+        :type subject_id: int
+
+        :param old: Old rating, None if the player was not rated in the subject
+        :type old: float
+
+        :param new: New rating
+        :type new: float
+
+        :return: None
+        :rtype: None
+        """
+        changes = [(new, 1)]
+        if old is not None:
+            if RatingBucket.bucket_of(old) == RatingBucket.bucket_of(new):
+                return
+            changes.append((old, -1))
+        for rating, count in sorted(changes, key=lambda change: RatingBucket.bucket_of(change[0])):
+            RatingBucket.add(subject_id, rating, count)
+
+    @staticmethod
+    def remove(subject_id, rating):
+        """
+        Take a deleted rating out of its bucket. Nothing is created if the bucket is gone,
+        as it is when the subject is deleted along with its ratings
+
+        :param subject_id: id of the subject
+        :type subject_id: int
+
+        :param rating: Rating of the deleted PlayerRating
+        :type rating: float
+
+        :return: None
+        :rtype: None
+        """
+        RatingBucket.objects.filter(subject_id=subject_id, bucket=RatingBucket.bucket_of(rating))\
+            .update(count=F('count') - 1)
+
+    @staticmethod
+    def rebuild(subject_id):
+        """
+        Count the ratings of a subject again from PlayerRating
+
+        :param subject_id: id of the subject
+        :type subject_id: int
+
+        :return: None
+        :rtype: None
+        """
+        counts = Counter(RatingBucket.bucket_of(rating) for rating in PlayerRating.objects
+                         .filter(subject_id=subject_id).values_list('rating', flat=True).iterator())
+        with transaction.atomic():
+            RatingBucket.objects.filter(subject_id=subject_id).delete()
+            RatingBucket.objects.bulk_create(
+                RatingBucket(subject_id=subject_id, bucket=bucket, count=count) for bucket, count in counts.items()
+            )
+
+
+class PlayerSubjectStats(models.Model):
+    """
+    Number of answers a player has given in a subject, counted when the answers are saved.
+    Report skips are counted both as answered and in report_skips.
+    """
+    player = models.ForeignKey(Player)
+    subject = models.ForeignKey(Subject)
+    answered = models.PositiveIntegerField(default=0)
+    correct = models.PositiveIntegerField(default=0)
+    report_skips = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (
+            ('player', 'subject'),
+        )
+
+    @staticmethod
+    def count_answer(player, question, result, report_skip=False):
+        """
+        Count an answer in the player's stats for the question's subject.
+        Must run after Player.record_answer in the same transaction, which locks the player's row,
+        so the stats row of a player is never created twice.
+
+        :param player: Player who answered
+        :type player: Player object
+
+        :param question: Question that has been answered
+        :type question: Question object
+
+        :param result: True if the question was answered correctly
+        :type result: boolean
+
+        :param report_skip: True if the question was skipped because it was reported
+        :type report_skip: boolean
+
+        :return: None
+        :rtype: None
+        """
+        if hasattr(question, Question._meta.get_field('topic').get_cache_name()):
+            subject_id = question.topic.subject_id if question.topic else None
+        else:
+            subject_id = Topic.objects.filter(pk=question.topic_id).values_list('subject_id', flat=True).first()
+        if subject_id is None:
+            return
+
+        counts = {'answered': 1, 'correct': int(bool(result)), 'report_skips': int(bool(report_skip))}
+        if not PlayerSubjectStats.objects.filter(player=player, subject_id=subject_id)\
+                .update(**{field: F(field) + count for field, count in counts.items()}):
+            PlayerSubjectStats.objects.create(player=player, subject_id=subject_id, **counts)
+
+
+class QuestionManager(models.Manager):
+    """ Default manager of questions, leaves out deleted questions """
+
+    def get_queryset(self):
+        return super(QuestionManager, self).get_queryset().exclude(status=Question.DELETED)
+
 
 class Question(models.Model):
+    # Reverse one-to-one accessors of the concrete question types
+    SUBCLASSES = ('truefalsequestion', 'multiplechoicequestion', 'textquestion', 'numberquestion')
+    question_type = 'question'
+
     question_text = models.TextField(max_length=300, verbose_name='Question')
     creator = models.ForeignKey(User, blank=True, null=True)
     creation_date = models.DateTimeField(default=timezone.now, verbose_name='Date')
@@ -308,6 +1383,29 @@ class Question(models.Model):
     original_rating = models.DecimalField(default=1200, max_digits=8, decimal_places=3, verbose_name='Original rating')
     topic = models.ForeignKey(Topic, null=True, blank=True)
 
+    # Quarantined questions are taken out of the selection until a moderator releases them
+    # Deleted questions are hidden everywhere, and removed with their answers and reports by purge_questions
+    ACTIVE = 0
+    QUARANTINED = 1
+    DELETED = 2
+    STATUSES = (
+        (ACTIVE, 'Active'),
+        (QUARANTINED, 'Quarantined'),
+        (DELETED, 'Deleted'),
+    )
+    status = models.PositiveSmallIntegerField(choices=STATUSES, default=ACTIVE, verbose_name='Status')
+    # When the question was last released, only later reports can quarantine it again
+    released = models.DateTimeField(blank=True, null=True, verbose_name='Released')
+
+    objects = QuestionManager()
+    # Including deleted questions
+    all_objects = models.Manager()
+
+    class Meta:
+        index_together = [
+            ('topic', 'status', 'rating', 'id'),
+        ]
+
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         if not self.pk:
             self.original_rating = self.rating
@@ -316,6 +1414,188 @@ class Question(models.Model):
     def __str__(self):
         return self.question_text
 
+    @staticmethod
+    def nearest(topics, rating, exclude=(), count=None):
+        """
+        Get the question closest to a rating, or the count closest questions.
+        Each topic is probed once above and once below the rating on the (topic, status, rating, id) index,
+        scanned forwards above and backwards below, so the cost does not grow with the number of questions
+        in the topics. Quarantined questions are left out.
+
+        :param topics: Topics to select from
+        :type topics: list
+
+        :param rating: Rating the question should be close to
+        :type rating: float
+
+        :param exclude: Ids of questions that must not be selected
+        :type exclude: list
+
+        :param count: Number of questions to get, None to get a single question
+        :type count: int
+
+        :return: Closest question, None if there are no candidates. A list of questions, closest first, if count is given
+        :rtype: Question object
+        """
+        rating = float(rating)
+        candidates = Question.objects.filter(status=Question.ACTIVE).exclude(id__in=exclude)
+        limit = count or 1
+        questions = []
+
+        for topic in topics:
+            questions.extend(candidates.filter(topic=topic, rating__gte=rating).order_by('rating', 'id')[:limit])
+            questions.extend(candidates.filter(topic=topic, rating__lt=rating).order_by('-rating', '-id')[:limit])
+
+        # Stable sort, so questions above the rating win ties
+        questions.sort(key=lambda question: abs(float(question.rating) - rating))
+
+        if count is None:
+            return questions[0] if questions else None
+        return questions[:count]
+
+    @staticmethod
+    def check_reports(question_id):
+        """
+        Quarantine an active question if its reports since it was last released reach one of
+        settings.QUARANTINE_THRESHOLDS, both in number and as a share of the question's answers
+
+        :param question_id: Id of the question
+        :type question_id: int
+
+        :return: True if the question was quarantined
+        :rtype: bool
+        """
+        released = list(Question.objects.filter(pk=question_id, status=Question.ACTIVE)
+                        .values_list('released', flat=True))
+        if not released:
+            return False
+
+        reports = QuestionReport.objects.filter(question_id=question_id)
+        if released[0]:
+            reports = reports.filter(date__gt=released[0])
+        counts = reports.aggregate(reports=Count('id'), **QuestionReport.flag_counts())
+        answers = PlayerAnswer.objects.filter(question_id=question_id, report_skip=False).count()
+
+        for key, (number, share) in settings.QUARANTINE_THRESHOLDS.items():
+            count = counts['reports'] if key == 'reports' else counts[key + '_count'] or 0
+            if count >= number and count >= share * answers:
+                quarantined = Question.objects.filter(pk=question_id, status=Question.ACTIVE)\
+                    .update(status=Question.QUARANTINED)
+                Catalog.invalidate()
+                return bool(quarantined)
+        return False
+
+    @staticmethod
+    def release(question_ids):
+        """
+        Put quarantined questions back into the selection
+
+        :param question_ids: Ids of the questions
+        :type question_ids: list
+
+        :return: Number of questions released
+        :rtype: int
+        """
+        released = Question.objects.filter(id__in=question_ids, status=Question.QUARANTINED)\
+            .update(status=Question.ACTIVE, released=timezone.now())
+        Catalog.invalidate()
+        return released
+
+    @staticmethod
+    def soft_delete(question_ids):
+        """
+        Delete questions without touching their answers and reports, which are removed later by purge_questions.
+        The questions are hidden from the default manager right away.
+
+        :param question_ids: Ids of the questions
+        :type question_ids: list
+
+        :return: Number of questions deleted
+        :rtype: int
+        """
+        deleted = Question.objects.filter(id__in=question_ids).update(status=Question.DELETED)
+        Catalog.invalidate()
+        return deleted
+
+    @staticmethod
+    def get_subclass(question_id):
+        """
+        Get a question as an instance of its concrete type
+
+        :param question_id: Id of the question
+        :type question_id: int
+
+        :return: TrueFalseQuestion, MultipleChoiceQuestion, TextQuestion or NumberQuestion object,
+            None if the question does not exist
+        :rtype: Question object
+        """
+        questions = Question.get_subclasses([question_id])
+        return questions[0] if questions else None
+
+    @staticmethod
+    def get_subclasses(question_ids):
+        """
+        Get questions as instances of their concrete types.
+        All types are joined in one query, the alternatives of multiple choice questions are prefetched.
+
+        :param question_ids: Ids of the questions
+        :type question_ids: list
+
+        :return: Questions in the order of the ids, ids that do not exist are left out
+        :rtype: list
+        """
+        questions = dict((question.id, question.as_subclass()) for question in Question.objects
+                         .filter(id__in=question_ids).select_related('topic__subject', *Question.SUBCLASSES))
+
+        prefetch_related_objects([question for question in questions.values()
+                                  if isinstance(question, MultipleChoiceQuestion)], 'multiplechoiceanswer_set')
+
+        return [questions[question_id] for question_id in question_ids if question_id in questions]
+
+    def as_subclass(self):
+        """
+        Returns the instance of the concrete question type, without a query if it was selected related
+
+        :return: Question of concrete type, self if it has none
+        :rtype: Question object
+        """
+        for name in Question.SUBCLASSES:
+            try:
+                subclass = getattr(self, name)
+            except ObjectDoesNotExist:
+                continue
+            # Hand over the topic if it was selected related
+            topic_cache = Question._meta.get_field('topic').get_cache_name()
+            if hasattr(self, topic_cache):
+                setattr(subclass, topic_cache, getattr(self, topic_cache))
+            return subclass
+        return self
+
+    def question_json(self):
+        """
+        Returns the question as JSON-object, without revealing the answer
+
+        :return: JSON-object
+        :rtype: dict
+        """
+        return {
+            'id': self.id,
+            'type': self.question_type,
+            'question_text': self.question_text,
+            'topic': self.topic.title if self.topic else '',
+            'subject': self.topic.subject.code if self.topic else '',
+            'alternatives': self.alternatives(),
+        }
+
+    def alternatives(self):
+        """
+        Returns the alternatives the player can choose between as [value, text] pairs
+
+        :return: Alternatives
+        :rtype: list
+        """
+        return []
+
     def answer_to_list(self):
         """
         Returns the answer as a text string in a list
@@ -326,8 +1606,52 @@ class Question(models.Model):
         return []
       
 
-class TextQuestion(Question):
+class CanonicalAnswer(object):
+    """
+    Mixin for questions whose answer is compared in a canonical form.
+    The canonical form is computed when the question is saved and stored in canonical_answer,
+    so validating a submission only normalizes the player's answer. Subclasses define canonical()
+    and prepare(), and recompute the canonical form if answer is changed without being saved.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        question = super(CanonicalAnswer, cls).from_db(db, field_names, values)
+        # Rows saved before canonical_answer existed have it empty, and compute it when it is first needed
+        if question.__dict__.get('canonical_answer'):
+            question._canonical_source = question.__dict__.get('answer')
+        return question
+
+    def save(self, *args, **kwargs):
+        self.correct_answer()
+        super(CanonicalAnswer, self).save(*args, **kwargs)
+
+    def correct_answer(self):
+        """
+        Returns the correct answer as prepared for comparison, computing it again if answer has changed
+
+        :return: See prepare()
+        """
+        answer = self.answer
+        if getattr(self, '_prepared_source', None) != answer:
+            if getattr(self, '_canonical_source', None) != answer:
+                # The answer is only converted to a string when it is saved
+                self.canonical_answer = self.canonical(str(answer))
+                self._canonical_source = answer
+            self._prepared = self.prepare(self.canonical_answer)
+            self._prepared_source = answer
+        return self._prepared
+
+
+class TextQuestion(CanonicalAnswer, Question):
+    question_type = 'text'
     answer = models.CharField(max_length=50, verbose_name='Answer')
+    # Lower case alphanumeric characters of the answer, see canonical()
+    canonical_answer = models.CharField(max_length=150, blank=True, default='', editable=False)
+
+    # Managers of concrete models are not inherited
+    objects = QuestionManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return self.question_text
@@ -342,14 +1666,24 @@ class TextQuestion(Question):
         :return: Whether answer is right or not
         :rtype: boolean
         """
-        user_answer = in_answer.strip().casefold()
-        correct_answer = self.answer.strip().casefold()
+        return TextQuestion.canonical(in_answer) == self.correct_answer()
 
-        # Fjerner alt som ikke er alfanumerisk
-        user_answer = ''.join([c for c in user_answer if c.isalnum()])
-        correct_answer = ''.join([c for c in correct_answer if c.isalnum()])
+    @staticmethod
+    def canonical(answer):
+        """
+        Returns the form text answers are compared in, ignoring capitalization and everything but letters and digits
 
-        return user_answer == correct_answer
+        :param answer: Answer
+        :type answer: str
+
+        :return: Canonical form of the answer
+        :rtype: str
+        """
+        return ''.join(filter(str.isalnum, answer.casefold()))
+
+    @staticmethod
+    def prepare(canonical_answer):
+        return canonical_answer
 
     def answer_feedback_raw(self, answer):
         return self.answer_feedback(answer)
@@ -381,8 +1715,15 @@ class TextQuestion(Question):
         return [self.answer]
 
 
-class NumberQuestion(Question):
+class NumberQuestion(CanonicalAnswer, Question):
+    question_type = 'number'
     answer = models.CharField(max_length=50, verbose_name='Answer')
+    # Answer in lower case, stripped and with decimal point, see canonical()
+    canonical_answer = models.CharField(max_length=150, blank=True, default='', editable=False)
+
+    # Managers of concrete models are not inherited
+    objects = QuestionManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return self.question_text
@@ -400,27 +1741,31 @@ class NumberQuestion(Question):
         if in_answer == '':
             return False
 
-        user_answer = in_answer.casefold().strip().replace(',', '.')
-        correct_answer = self.answer.casefold().strip().replace(',', '.')
+        correct_answer, correct_num_of_decimals, correct_pattern_match = self.correct_answer()
+
+        user_answer = NumberQuestion.canonical(in_answer)
+        if not user_answer:
+            return False
 
         # Removes leading zeros
-        while len(user_answer) > 1 and user_answer[0] == '0':
-            user_answer = user_answer[1:]
+        user_answer = user_answer.lstrip('0') or '0'
 
         # If no integer part, set it to '0'
         if user_answer[0] == '.':
             user_answer = '0' + user_answer
 
         # If answer not a decimal, check if user's answer only has zeros in the decimal part and compare
-        if '.' not in correct_answer:
+        if correct_num_of_decimals is None:
             if '.' in user_answer:
                 spl = user_answer.split('.')
-                if match(r'^0*$', spl[1]):
+                if NumberQuestion.ZEROS.match(spl[1]):
                     return spl[0] == correct_answer
                 return False
             return user_answer == correct_answer
 
-        correct_num_of_decimals = len(correct_answer.split('.')[1])
+        # The answer can not be right unless it is on the right format, like the correct answer
+        if not correct_pattern_match:
+            return False
 
         if '.' in user_answer:
             user_answer = user_answer.split('.')
@@ -428,23 +1773,53 @@ class NumberQuestion(Question):
 
             # Adds zeros to decimal part to get correct length
             if num_of_decimals < correct_num_of_decimals:
-                user_answer[1] += ''.join(['0']*(correct_num_of_decimals-num_of_decimals))
+                user_answer[1] += '0' * (correct_num_of_decimals - num_of_decimals)
 
             # Remove trailing zeros to get correct length
             if num_of_decimals > correct_num_of_decimals:
-                extra = user_answer[1][correct_num_of_decimals:]
-                zero_match = match(r'^0*$', extra)
-                if zero_match:
+                if NumberQuestion.ZEROS.match(user_answer[1][correct_num_of_decimals:]):
                     user_answer[1] = user_answer[1][0:correct_num_of_decimals]
 
             user_answer = '.'.join(user_answer)
         else:
-            user_answer += '.' + ''.join(['0']*correct_num_of_decimals)
+            user_answer += '.' + '0' * correct_num_of_decimals
 
-        # Make sure user's answer is on right format
-        pattern_match = bool(match(r'^0*[0-9a-f]*[.][0-9a-f]*$', user_answer))
         # Compare user's answer with the actual answer
-        return (user_answer == correct_answer) and pattern_match
+        return user_answer == correct_answer
+
+    # Only zeros, and the format of a decimal answer
+    ZEROS = re.compile(r'^0*$')
+    PATTERN = re.compile(r'^0*[0-9a-f]*[.][0-9a-f]*$')
+
+    @staticmethod
+    def canonical(answer):
+        """
+        Returns the form number answers are compared in: lower case, stripped and with a decimal point
+
+        :param answer: Answer
+        :type answer: str
+
+        :return: Canonical form of the answer
+        :rtype: str
+        """
+        return answer.casefold().strip().replace(',', '.')
+
+    @staticmethod
+    def prepare(canonical_answer):
+        """
+        Returns what validate() needs to know about the correct answer
+
+        :param canonical_answer: Canonical form of the correct answer
+        :type canonical_answer: str
+
+        :return: The canonical answer, its number of decimals, None if it has no decimal point,
+                 and whether it is on the format of a decimal answer
+        :rtype: tuple
+        """
+        if '.' not in canonical_answer:
+            return canonical_answer, None, False
+        return (canonical_answer, len(canonical_answer.split('.')[1]),
+                bool(NumberQuestion.PATTERN.match(canonical_answer)))
 
     def answer_feedback_raw(self, answer):
         return self.answer_feedback(answer)
@@ -477,11 +1852,19 @@ class NumberQuestion(Question):
 
 
 class TrueFalseQuestion(Question):
+    question_type = 'truefalse'
     answer = models.BooleanField(verbose_name='Answer')
 
+    # Managers of concrete models are not inherited
+    objects = QuestionManager()
+    all_objects = models.Manager()
+
     def __str__(self):
         return self.question_text
 
+    def alternatives(self):
+        return [['true', 'True'], ['false', 'False']]
+
     def answer_feedback_raw(self, answer):
         return self.answer_feedback(answer.capitalize() == 'True')
 
@@ -513,10 +1896,18 @@ class TrueFalseQuestion(Question):
 
 
 class MultipleChoiceQuestion(Question):
+    question_type = 'multiplechoice'
+
+    # Managers of concrete models are not inherited
+    objects = QuestionManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return self.question_text
 
+    def alternatives(self):
+        return [[alternative.id, alternative.answer] for alternative in self.multiplechoiceanswer_set.all()]
+
     def answer_feedback_raw(self, answer):
         try:
             return self.answer_feedback(int(answer))
@@ -533,10 +1924,13 @@ class MultipleChoiceQuestion(Question):
         :return: JSON-object
         :rtype: dict
         """
-        answer = MultipleChoiceAnswer.objects.get(id=answer_id)
+        alternatives = self.multiplechoiceanswer_set.all()
+        try:
+            answer = next(alternative for alternative in alternatives if alternative.id == answer_id)
+        except StopIteration:
+            answer = MultipleChoiceAnswer.objects.get(id=answer_id)
         answered_correct = answer.correct
-        answers = MultipleChoiceAnswer.objects.filter(question=self.id, correct=True)
-        answer_ids = [answer.id for answer in answers]
+        answer_ids = [alternative.id for alternative in alternatives if alternative.correct]
         return {
             'answer': answer_id,
             'correct': answer_ids,
@@ -553,7 +1947,7 @@ class MultipleChoiceQuestion(Question):
 
         return_list = []
 
-        for ans in MultipleChoiceAnswer.objects.filter(question=self):
+        for ans in self.multiplechoiceanswer_set.all():
             tmp = '-' + ans.answer
             if ans.correct:
                 tmp += ' -> Correct'
@@ -579,9 +1973,15 @@ class PlayerAnswer(models.Model):
     rating = models.DecimalField(max_digits=8, decimal_places=3, verbose_name='Rating')
     report_skip = models.BooleanField(verbose_name='Report', default=False)
 
+    class Meta:
+        index_together = [
+            ('player', 'answer_date'),
+        ]
+
     def save(self, *args, **kwargs):
         """
-        Saves PlayerAnswer after setting rating to player's rating
+        Saves PlayerAnswer after setting rating to player's rating, unless it has been given,
+        and queues an evaluation of the player's achievements
         Model.save doc: https://docs.djangoproject.com/en/1.10/_modules/django/db/models/base/#Model.save
 
         :param args: see Model.save documentation
@@ -590,8 +1990,149 @@ class PlayerAnswer(models.Model):
         :return: None
         :rtype: None
         """
-        self.rating = self.player.rating()
-        super(PlayerAnswer, self).save(*args, **kwargs)
+        if self.rating is None:
+            self.rating = self.player.rating()
+        # No savepoint inside Player.update's transaction, nothing here is rolled back on its own
+        with transaction.atomic(savepoint=False):
+            created = self.pk is None
+            super(PlayerAnswer, self).save(*args, **kwargs)
+            if created:
+                self.player.record_answer(self.question, self.result, self.report_skip)
+                PlayerSubjectStats.count_answer(self.player, self.question, self.result, self.report_skip)
+                if not self.report_skip:
+                    AchievementEvent.enqueue(self.player)
+
+
+class RollupDay(models.Model):
+    """
+    A day whose answers have been rolled up into PlayerTopicDay and QuestionDay by the rollup_answers command.
+    Days are UTC dates
+    """
+    day = models.DateField(unique=True)
+
+    @staticmethod
+    def last():
+        """
+        Get the last day that has been rolled up
+
+        :return: Day, None if no day has been rolled up
+        :rtype: date
+        """
+        return RollupDay.objects.order_by('-day').values_list('day', flat=True).first()
+
+    @staticmethod
+    def start(day):
+        """ Return the time a day starts """
+        return timezone.make_aware(datetime.combine(day, time.min), timezone.utc)
+
+    @staticmethod
+    def roll_up(day):
+        """
+        Summarize the answers of a day per player and topic, and per question.
+        The day's rows are replaced, so rolling up a day again gives the same rows.
+
+        :param day: Day to roll up
+        :type day: date
+
+        :return: Number of answers rolled up
+        :rtype: int
+        """
+        player_topics = OrderedDict()
+        questions = OrderedDict()
+        answers = PlayerAnswer.objects\
+            .filter(answer_date__gte=RollupDay.start(day), answer_date__lt=RollupDay.start(day + timedelta(days=1)))\
+            .order_by('answer_date', 'id')\
+            .values_list('player_id', 'question_id', 'question__topic_id', 'result', 'report_skip', 'rating',
+                         'answer_date')
+
+        count = 0
+        for player_id, question_id, topic_id, result, report_skip, rating, answer_date in answers.iterator():
+            count += 1
+            summaries = [questions.setdefault(question_id, QuestionDay(question_id=question_id, day=day))]
+            if topic_id is not None:
+                summaries.append(player_topics.setdefault(
+                    (player_id, topic_id), PlayerTopicDay(player_id=player_id, topic_id=topic_id, day=day)))
+
+            for summary in summaries:
+                if not summary.attempts:
+                    summary.first_rating = summary.high_rating = summary.low_rating = rating
+                    summary.first_answer = answer_date
+                summary.attempts += 1
+                summary.correct += int(bool(result))
+                summary.report_skips += int(bool(report_skip))
+                summary.last_rating = rating
+                summary.last_answer = answer_date
+                summary.high_rating = max(summary.high_rating, rating)
+                summary.low_rating = min(summary.low_rating, rating)
+
+        with transaction.atomic():
+            PlayerTopicDay.objects.filter(day=day).delete()
+            QuestionDay.objects.filter(day=day).delete()
+            PlayerTopicDay.objects.bulk_create(player_topics.values(), batch_size=1000)
+            QuestionDay.objects.bulk_create(questions.values(), batch_size=1000)
+            RollupDay.objects.get_or_create(day=day)
+
+        return count
+
+
+class DaySummary(models.Model):
+    """
+    Answers of a day. The ratings are the answering players' ratings after their answers,
+    first and last being the ones of the day's first and last answer
+    """
+    day = models.DateField(verbose_name='Day')
+    attempts = models.PositiveIntegerField(default=0)
+    correct = models.PositiveIntegerField(default=0)
+    report_skips = models.PositiveIntegerField(default=0)
+    first_rating = models.DecimalField(max_digits=8, decimal_places=3)
+    last_rating = models.DecimalField(max_digits=8, decimal_places=3)
+    high_rating = models.DecimalField(max_digits=8, decimal_places=3)
+    low_rating = models.DecimalField(max_digits=8, decimal_places=3)
+    first_answer = models.DateTimeField()
+    last_answer = models.DateTimeField()
+
+    class Meta:
+        abstract = True
+
+
+class PlayerTopicDay(DaySummary):
+    player = models.ForeignKey(Player)
+    topic = models.ForeignKey(Topic)
+
+    class Meta:
+        unique_together = (
+            ('player', 'topic', 'day'),
+        )
+        index_together = [
+            ('player', 'day'),
+        ]
+
+
+class QuestionDay(DaySummary):
+    question = models.ForeignKey(Question)
+
+    class Meta:
+        unique_together = (
+            ('question', 'day'),
+        )
+
+
+class RecentAnswer(models.Model):
+    """
+    Fixed size ring of a player's latest answers, slot is position modulo SIZE
+    """
+    SIZE = 10
+
+    player = models.ForeignKey(Player)
+    slot = models.PositiveSmallIntegerField(verbose_name='Slot')
+    position = models.PositiveIntegerField(verbose_name='Position')
+    question = models.ForeignKey(Question)
+    report_skip = models.BooleanField(verbose_name='Report', default=False)
+
+    class Meta:
+        unique_together = (
+            ('player', 'slot'),
+        )
 
 
 class PropAnsweredQuestionInSubject(Property):
@@ -600,7 +2141,17 @@ class PropAnsweredQuestionInSubject(Property):
 
     def is_unlocked(self, player):
         """ Return whether property is unlocked """
-        return len(PlayerAnswer.objects.filter(player=player, question__topic__subject=self.subject)) >= self.number
+        if self.number <= 0:
+            return True
+        return PlayerSubjectStats.objects.filter(player=player, subject_id=self.subject_id,
+                                                 answered__gte=self.number).exists()
+
+    def unlocked_players(self):
+        """ Return the ids of the players with at least number answers in the subject """
+        if self.number <= 0:
+            return super(PropAnsweredQuestionInSubject, self).unlocked_players()
+        return PlayerSubjectStats.objects.filter(subject_id=self.subject_id, answered__gte=self.number)\
+            .values_list('player', flat=True)
 
     def __str__(self):
         return '%r in %s' % (self.number, self.subject.title)
@@ -616,3 +2167,86 @@ class QuestionReport(models.Model):
     inappropriate = models.BooleanField(verbose_name="inappropriate", default=False)
     other = models.BooleanField(verbose_name='Other', default=False)
     comment = models.CharField(max_length=500, verbose_name='Comment', default="")
+    date = models.DateTimeField(default=timezone.now, verbose_name='Date')
+
+    # Flags a report can have, and how they are shown to moderators
+    FLAGS = (
+        ('red_right', 'Red right'),
+        ('green_wrong', 'Green wrong'),
+        ('unclear', 'Unclear'),
+        ('off_topic', 'Off topic'),
+        ('inappropriate', 'Inappropriate'),
+        ('other', 'Other'),
+    )
+
+    # Number of reported questions on a page of the moderation queue
+    QUEUE_PAGE_SIZE = 20
+
+    def save(self, *args, **kwargs):
+        """
+        Saves QuestionReport, and quarantines the question if it has been reported enough
+        Model.save doc: https://docs.djangoproject.com/en/1.10/_modules/django/db/models/base/#Model.save
+
+        :param args: see Model.save documentation
+        :param kwargs: see Model.save documentation
+
+        :return: None
+        :rtype: None
+        """
+        with transaction.atomic():
+            created = self.pk is None
+            super(QuestionReport, self).save(*args, **kwargs)
+            if created:
+                Question.check_reports(self.question_id)
+
+    @staticmethod
+    def flag_counts():
+        """
+        Aggregates counting the reports with each flag, named <flag>_count
+
+        :return: Aggregates by name
+        :rtype: dict
+        """
+        return {
+            field + '_count': Sum(Case(When(**{field: True, 'then': Value(1)}), default=Value(0),
+                                       output_field=IntegerField()))
+            for field, _ in QuestionReport.FLAGS
+        }
+
+    @staticmethod
+    def queue(after=None, page_size=None):
+        """
+        Return a page of reported questions, the most reported first, with the number of reports of each flag.
+        The reports are grouped in one query, and pages are found by keyset so any page is as fast as the first.
+
+        :param after: (reports, question id) of the last question of the previous page, None for the first page
+        :type after: tuple
+
+        :param page_size: Number of questions on the page, QUEUE_PAGE_SIZE by default
+        :type page_size: int
+
+        :return: A dict for each question with its id, text, topic, subject code, number of reports,
+                 whether it is quarantined and a list of (label, number of reports) of each flag
+        :rtype: list
+        """
+        rows = QuestionReport.objects.exclude(question__status=Question.DELETED).order_by()\
+            .values('question_id', 'question__question_text', 'question__topic__title',
+                    'question__topic__subject__code', 'question__status')\
+            .annotate(reports=Count('id'), **QuestionReport.flag_counts())\
+            .order_by('-reports', '-question_id')
+        if after:
+            reports, question_id = after
+            rows = rows.filter(Q(reports__lt=reports) | Q(reports=reports, question_id__lt=question_id))
+
+        queue = []
+        for row in rows[:page_size or QuestionReport.QUEUE_PAGE_SIZE]:
+            queue.append({
+                'id': row['question_id'],
+                'question_text': row['question__question_text'],
+                'topic': row['question__topic__title'],
+                'subject_code': row['question__topic__subject__code'],
+                'reports': row['reports'],
+                'quarantined': row['question__status'] == Question.QUARANTINED,
+                'flags': [(label, row[field + '_count']) for field, label in QuestionReport.FLAGS],
+            })
+        return queue
@@ -0,0 +1,36 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from quiz.models import Achievement, Property, PropAnsweredQuestionInSubject, Trigger, Title, AchievementGraph, \
+    Catalog, Subject, Topic, Question, TextQuestion, NumberQuestion, TrueFalseQuestion, MultipleChoiceQuestion, \
+    PlayerRating, RatingBucket
+
+
+def invalidate_achievement_graph(sender, **kwargs):
+    # Once right away for this process, and again on commit so no process compiles the old definitions
+    # between now and the commit
+    AchievementGraph.invalidate()
+    transaction.on_commit(AchievementGraph.invalidate)
+
+
+def invalidate_catalog(sender, **kwargs):
+    Catalog.invalidate()
+    transaction.on_commit(Catalog.invalidate)
+
+
+def uncount_rating(sender, instance, **kwargs):
+    # Also sent for ratings deleted along with their player or subject
+    RatingBucket.remove(instance.subject_id, instance.rating)
+
+
+def connect():
+    for model in (Achievement, Property, PropAnsweredQuestionInSubject, Trigger, Title):
+        post_save.connect(invalidate_achievement_graph, sender=model, dispatch_uid='achievement_graph_save')
+        post_delete.connect(invalidate_achievement_graph, sender=model, dispatch_uid='achievement_graph_delete')
+    for through in (Trigger.properties.through, Property.achievements.through):
+        m2m_changed.connect(invalidate_achievement_graph, sender=through, dispatch_uid='achievement_graph_m2m')
+    # Saving a question of a concrete type only sends signals with that type as sender
+    for model in (Subject, Topic, Question, TextQuestion, NumberQuestion, TrueFalseQuestion, MultipleChoiceQuestion):
+        post_save.connect(invalidate_catalog, sender=model, dispatch_uid='catalog_save')
+        post_delete.connect(invalidate_catalog, sender=model, dispatch_uid='catalog_delete')
+    post_delete.connect(uncount_rating, sender=PlayerRating, dispatch_uid='rating_bucket_delete')
@@ -0,0 +1,128 @@
+// Answers questions through /quiz/next/ and renders the next question in place,
+// so the page only has to be loaded once per quiz session.
+var quiz = (function() {
+  var csrfToken = '';
+  var answered = false;
+
+  function currentQuestion() {
+    return $('.quiz .question');
+  }
+
+  function showFeedback(type, feedback) {
+    var answer = feedback['answer'];
+    var correct = feedback['correct'];
+
+    if (type === 'multiplechoice') {
+      $('.answer[answer=' + answer + ']').css('background-color', '#EF5350');
+      for (var i = 0; i < correct.length; i++) {
+        $('.answer[answer=' + correct[i] + ']').css('background-color', '#66BB6A');
+      }
+    } else if (type === 'truefalse') {
+      $('.answer[answer=' + answer + ']').css('background-color', '#EF5350');
+      $('.answer[answer=' + correct + ']').css('background-color', '#66BB6A');
+    } else if (feedback['answered_correct']) {
+      $('.inputfield').addClass('correct');
+    } else {
+      $('.inputfield').parent().addClass('error');
+    }
+  }
+
+  function updateReportModal(question, recentQuestions) {
+    var menu = $('.ui.questions .menu').empty();
+    $.each([question].concat(recentQuestions), function(i, q) {
+      menu.append($('<a class="item">').attr('data-value', q['id']).text(q['question_text']));
+    });
+    $('.ui.questions').dropdown('refresh').dropdown('set exactly', String(question['id']));
+  }
+
+  function render(question, recentQuestions) {
+    var segment = $('<div class="ui piled segment question">')
+      .attr('question', question['id'])
+      .attr('type', question['type']);
+    var content = $('<div class="content">');
+    var body = $('<div style="position: relative;">');
+
+    content.append($('<h4 class="info stuff">').text(question['topic'] + ' - ' + question['subject']));
+    content.append($('<i class="flag icon report" id="report-flag">').click(function() {
+      $('.ui.modal.report').modal('show');
+    }));
+
+    body.append($('<div class="ui questionText">').text(question['question_text']));
+    $.each(question['alternatives'], function(i, alternative) {
+      body.append($('<div class="ui secondary segment answer">')
+        .attr('answer', alternative[0])
+        .append($('<div class="content">').text(alternative[1])));
+    });
+    content.append(body);
+    segment.append(content);
+
+    if (question['type'] === 'text' || question['type'] === 'number') {
+      segment.append(
+        '<form class="ui form">' +
+        '  <div class="field"><input type="text" class="inputfield answerfield"></div>' +
+        '  <div class="ui primary button submit">Submit</div>' +
+        '</form>');
+    }
+
+    $('.quiz').empty().append(segment);
+    updateReportModal(question, recentQuestions);
+    answered = false;
+    bind();
+  }
+
+  function submit(answer) {
+    if (answered) {
+      return;
+    }
+    answered = true;
+
+    var question = currentQuestion();
+
+    $.ajax({
+      type: 'POST',
+      url: '/quiz/next/',
+      headers: {'X-CSRFToken': csrfToken},
+      data: {
+        'question': question.attr('question'),
+        'answer': answer,
+      },
+      success: function(data) {
+        if (data['feedback']) {
+          showFeedback(question.attr('type'), data['feedback']);
+        }
+
+        setTimeout(function() {
+          if (data['question']) {
+            render(data['question'], data['recent_questions']);
+          } else {
+            window.location.replace(data['redirect'] || '/quiz/');
+          }
+        }, 500);
+      }
+    });
+  }
+
+  function bind() {
+    $('.quiz .answer').click(function() {
+      submit($(this).attr('answer'));
+    });
+
+    $('.quiz .inputfield.answerfield').keypress(function(event) {
+      if (event.which == 13) {
+        event.preventDefault();
+        submit($(this).val());
+      }
+    });
+
+    $('.quiz .submit.primary.button').click(function() {
+      submit($('.quiz .inputfield').val());
+    });
+  }
+
+  return {
+    start: function(token) {
+      csrfToken = token;
+      bind();
+    }
+  };
+})();
@@ -1,9 +1,140 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.db import connection, OperationalError
+from django.db.models import QuerySet
+from django.db.backends.utils import format_number
 from quiz.models import *
 from django.contrib.auth.admin import User
+import os
 import random
 import json
+import re
+import shutil
+import tempfile
+import threading
+from unittest import mock
 from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core.cache.backends.db import DatabaseCache
+from django.conf import settings
+from quiz.apps import check_shared_cache
+from django.utils import timezone
+from io import StringIO
+
+
+def old_text_validate(answer, in_answer):
+    # TextQuestion.validate before the canonical answer was stored
+    user_answer = in_answer.strip().casefold()
+    correct_answer = answer.strip().casefold()
+    user_answer = ''.join([c for c in user_answer if c.isalnum()])
+    correct_answer = ''.join([c for c in correct_answer if c.isalnum()])
+    return user_answer == correct_answer
+
+
+def old_number_validate(answer, in_answer):
+    # NumberQuestion.validate before the canonical answer was stored
+    if in_answer == '':
+        return False
+    user_answer = in_answer.casefold().strip().replace(',', '.')
+    correct_answer = answer.casefold().strip().replace(',', '.')
+    while len(user_answer) > 1 and user_answer[0] == '0':
+        user_answer = user_answer[1:]
+    if user_answer[0] == '.':
+        user_answer = '0' + user_answer
+    if '.' not in correct_answer:
+        if '.' in user_answer:
+            spl = user_answer.split('.')
+            if re.match(r'^0*$', spl[1]):
+                return spl[0] == correct_answer
+            return False
+        return user_answer == correct_answer
+    correct_num_of_decimals = len(correct_answer.split('.')[1])
+    if '.' in user_answer:
+        user_answer = user_answer.split('.')
+        num_of_decimals = len(user_answer[1])
+        if num_of_decimals < correct_num_of_decimals:
+            user_answer[1] += ''.join(['0']*(correct_num_of_decimals-num_of_decimals))
+        if num_of_decimals > correct_num_of_decimals:
+            extra = user_answer[1][correct_num_of_decimals:]
+            if re.match(r'^0*$', extra):
+                user_answer[1] = user_answer[1][0:correct_num_of_decimals]
+        user_answer = '.'.join(user_answer)
+    else:
+        user_answer += '.' + ''.join(['0']*correct_num_of_decimals)
+    pattern_match = bool(re.match(r'^0*[0-9a-f]*[.][0-9a-f]*$', user_answer))
+    return (user_answer == correct_answer) and pattern_match
+
+
+class CanonicalAnswerTestCase(TestCase):
+
+    def random_answer(self, rng, alphabet):
+        return ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 8)))
+
+    def assertEquivalent(self, model, old_validate, alphabet, seed):
+        rng = random.Random(seed)
+        for _ in range(200):
+            question = model(question_text='TEST_QUESTION', answer=self.random_answer(rng, alphabet))
+            answers = [self.random_answer(rng, alphabet) for _ in range(20)]
+            # Variations of the correct answer, the ones most likely to be right
+            answers += [question.answer.upper(), ' ' + question.answer + '0', '0' + question.answer.replace('.', ',')]
+            for answer in answers:
+                try:
+                    expected = old_validate(question.answer, answer)
+                except IndexError:
+                    # The old implementation failed on answers of only whitespace
+                    expected = False
+                self.assertEqual(question.validate(answer), expected, (question.answer, answer))
+
+    def test_text_equivalent(self):
+        self.assertEquivalent(TextQuestion, old_text_validate, 'aAbß ._-1\t', 0)
+
+    def test_number_equivalent(self):
+        self.assertEquivalent(NumberQuestion, old_number_validate, '0012.,a \n', 1)
+        self.assertEquivalent(NumberQuestion, old_number_validate, '00.5e-', 2)
+
+    def test_stored(self):
+        TextQuestion.objects.create(question_text='TEST_QUESTION_A', answer=' Straße-1 ')
+        NumberQuestion.objects.create(question_text='TEST_QUESTION_B', answer=' 3,50')
+        self.assertEqual(TextQuestion.objects.get().canonical_answer, 'strasse1')
+        self.assertEqual(NumberQuestion.objects.get().canonical_answer, '3.50')
+
+    def test_loaded_question_not_normalized_again(self):
+        TextQuestion.objects.create(question_text='TEST_QUESTION', answer='Answer')
+        TextQuestion.objects.update(canonical_answer='stored')
+        question = TextQuestion.objects.get()
+        self.assertTrue(question.validate('STORED'))
+        # Unless the answer is changed
+        question.answer = 'Other answer'
+        self.assertTrue(question.validate('otheranswer'))
+
+
+class BenchmarkValidationTestCase(TestCase):
+
+    def test_corpora_have_right_answers(self):
+        from quiz.management.commands.benchmark_validation import benchmarks
+        results = {name: [function(*args) for args in calls]
+                   for name, function, calls in benchmarks(random.Random(0), 200)}
+        for name in ('TextQuestion.validate', 'NumberQuestion.validate'):
+            self.assertTrue(any(results[name]), name)
+            self.assertFalse(all(results[name]), name)
+
+    def test_json_and_compare(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'results.json')
+        call_command('benchmark_validation', size=20, repeat=1, traced=5, json=path, stdout=StringIO())
+        with open(path) as f:
+            results = json.load(f)['results']
+        self.assertEqual(sorted(results), ['NumberQuestion.validate', 'Player.exp', 'Player.rating_change',
+                                           'TextQuestion.validate', 'TrueFalseQuestion.answer_feedback_raw'])
+        self.assertGreater(results['TextQuestion.validate']['ops_per_sec'], 0)
+
+        out = StringIO()
+        call_command('benchmark_validation', size=20, repeat=1, traced=5, compare=path, only='exp', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertRegex(lines[1], r'^Player.exp .*%$')
 
 
 class TextQuestionTestCase(TestCase):
@@ -259,6 +390,51 @@ class QuestionTestCase(TestCase):
         self.assertEqual(self.question.answer_to_list(), [])
 
 
+class QuestionSubclassTestCase(TestCase):
+
+    def setUp(self):
+        self.true_false = TrueFalseQuestion.objects.create(question_text='TEST_TF', answer=True, rating=1300)
+        self.text = TextQuestion.objects.create(question_text='TEST_TEXT', answer='TEST_ANSWER')
+        self.number = NumberQuestion.objects.create(question_text='TEST_NUMBER', answer='42')
+        self.multiple_choice = MultipleChoiceQuestion.objects.create(question_text='TEST_MC')
+        self.answers = [MultipleChoiceAnswer.objects.create(question=self.multiple_choice, answer=ans,
+                                                            correct=(ans == 'A')) for ans in ('A', 'B')]
+
+    def test_get_subclass_returns_concrete_type(self):
+        self.assertIsInstance(Question.get_subclass(self.true_false.id), TrueFalseQuestion)
+        self.assertIsInstance(Question.get_subclass(self.text.id), TextQuestion)
+        self.assertIsInstance(Question.get_subclass(self.number.id), NumberQuestion)
+        self.assertIsInstance(Question.get_subclass(self.multiple_choice.id), MultipleChoiceQuestion)
+
+    def test_get_subclass_loads_question_fields(self):
+        question = Question.get_subclass(self.true_false.id)
+        self.assertEqual(question.question_text, 'TEST_TF')
+        self.assertEqual(question.rating, 1300)
+        self.assertTrue(question.answer)
+
+    def test_get_subclass_does_not_exist(self):
+        self.assertEqual(Question.get_subclass(1337), None)
+
+    def test_get_subclass_single_query(self):
+        with self.assertNumQueries(1):
+            Question.get_subclass(self.text.id).answer_feedback_raw('TEST_ANSWER')
+
+    def test_get_subclass_prefetches_alternatives(self):
+        with self.assertNumQueries(2):
+            question = Question.get_subclass(self.multiple_choice.id)
+            feedback = question.answer_feedback_raw(str(self.answers[0].id))
+            question.answer_to_list()
+        self.assertEqual(feedback, {'answer': self.answers[0].id, 'correct': [self.answers[0].id],
+                                    'answered_correct': True})
+
+    def test_get_subclasses_keeps_order(self):
+        ids = [self.multiple_choice.id, 1337, self.true_false.id, self.number.id]
+        with self.assertNumQueries(2):
+            questions = Question.get_subclasses(ids)
+        self.assertEqual([question.id for question in questions],
+                         [self.multiple_choice.id, self.true_false.id, self.number.id])
+
+
 class AchievementTestCase(TestCase):
 
     def setUp(self):
@@ -316,6 +492,246 @@ class AchievementTestCase(TestCase):
 
         self.assertEqual(title_unlock.count(), 1)
 
+    def test_achievement_needs_every_property(self):
+        player = Player.objects.get()
+        achievement = Achievement.objects.get()
+        other = Property.objects.create(name='TEST_OTHER_PROPERTY')
+        other.achievements.add(achievement)
+
+        Trigger.objects.get().trigger(player)
+        self.assertFalse(achievement.is_achieved(player))
+        self.assertFalse(AchievementUnlock.objects.exists())
+
+        other.update(player)
+        self.assertTrue(achievement.is_achieved(player))
+        self.assertEqual(AchievementUnlock.objects.filter(player=player, achievement=achievement).count(), 1)
+
+    def test_trigger_twice_unlocks_once(self):
+        player = Player.objects.get()
+        trigger = Trigger.objects.get()
+        trigger.trigger(player)
+        trigger.trigger(player)
+        self.assertEqual(PropertyUnlock.objects.count(), 1)
+        self.assertEqual(AchievementUnlock.objects.count(), 1)
+        self.assertEqual(TitleUnlock.objects.count(), 1)
+
+    def test_trigger_uses_concrete_property(self):
+        player = Player.objects.get()
+        trigger = Trigger.objects.get()
+        subject = Subject.objects.create(title='TEST_SUBJECT', category=Category.objects.create(title='TEST'))
+        question = Question.objects.create(question_text='TEST_QUESTION',
+                                           topic=Topic.objects.create(title='TEST_TOPIC', subject=subject))
+        prop = PropAnsweredQuestionInSubject.objects.create(name='TEST_ANSWERED', number=2, subject=subject)
+        prop.achievements.add(Achievement.objects.get())
+        trigger.properties.add(prop)
+
+        PlayerAnswer.objects.create(player=player, question=question, result=True)
+        trigger.trigger(player)
+        self.assertFalse(PropertyUnlock.objects.filter(prop=prop).exists())
+        self.assertFalse(AchievementUnlock.objects.exists())
+
+        PlayerAnswer.objects.create(player=player, question=question, result=True)
+        trigger.trigger(player)
+        self.assertTrue(PropertyUnlock.objects.filter(prop=prop).exists())
+        self.assertEqual(AchievementUnlock.objects.count(), 1)
+
+    def test_trigger_query_count(self):
+        player = Player.objects.get()
+        trigger = Trigger.objects.get()
+        AchievementGraph.get()
+        # Graph token in the cache, existing property unlocks, property unlocks, existing achievement unlocks,
+        # unlocked properties, achievement unlocks, title unlocks and the savepoint of the transaction,
+        # no definitions
+        with self.assertNumQueries(9):
+            trigger.trigger(player)
+
+
+class AchievementGraphTestCase(TestCase):
+
+    def setUp(self):
+        self.player = Player.objects.create(user=User.objects.create(username='TEST_USER'))
+        self.achievement = Achievement.objects.create(name='TEST_ACHIEVEMENT')
+        self.prop = Property.objects.create(name='TEST_PROPERTY')
+        self.prop.achievements.add(self.achievement)
+        self.trigger = Trigger.objects.create(name='TEST_TRIGGER')
+        self.trigger.properties.add(self.prop)
+
+    def test_graph(self):
+        graph = AchievementGraph.get()
+        self.assertEqual(graph.properties_of({self.trigger.pk}), [self.prop])
+        self.assertEqual(graph.properties_of({None}), [self.prop])
+        self.assertEqual(graph.achievements_of([self.prop.pk]), {self.achievement.pk})
+        self.assertEqual(graph.achievement_properties[self.achievement.pk], {self.prop.pk})
+
+    def test_graph_compiled_once(self):
+        AchievementGraph.get()
+        # Only the token in the cache
+        with self.assertNumQueries(1):
+            AchievementGraph.get()
+
+    def test_graph_concrete_properties(self):
+        subject = Subject.objects.create(title='TEST_SUBJECT', category=Category.objects.create(title='TEST'))
+        prop = PropAnsweredQuestionInSubject.objects.create(name='TEST_ANSWERED', number=1, subject=subject)
+        self.trigger.properties.add(prop)
+        self.assertIsInstance(AchievementGraph.get().properties_of({self.trigger.pk})[1], PropAnsweredQuestionInSubject)
+
+    def test_graph_invalidated_on_changes(self):
+        other = Property.objects.create(name='TEST_OTHER_PROPERTY')
+        AchievementGraph.get()
+        self.trigger.properties.add(other)
+        self.assertEqual(AchievementGraph.get().properties_of({self.trigger.pk}), [self.prop, other])
+
+        AchievementGraph.get()
+        other.achievements.add(self.achievement)
+        self.trigger.trigger(self.player)
+        self.assertEqual(AchievementUnlock.objects.count(), 1)
+
+        title = Title.objects.create(title='TEST_TITLE', achievement=self.achievement)
+        self.assertEqual(AchievementGraph.get().achievement_titles, {self.achievement.pk: (title.pk,)})
+
+        title.delete()
+        self.assertEqual(AchievementGraph.get().achievement_titles, {})
+
+    def test_graph_invalidated_by_other_process(self):
+        graph = AchievementGraph.get()
+        # A cache client of its own, like the one of another process
+        other = DatabaseCache(settings.CACHES['default']['LOCATION'], {})
+        other.set(AchievementGraph.CACHE_KEY, 'OTHER_TOKEN')
+        self.assertIsNot(AchievementGraph.get(), graph)
+
+    def test_cache_shared_between_processes(self):
+        self.assertEqual(check_shared_cache(None), [])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([warning.id for warning in check_shared_cache(None)], ['quiz.W001'])
+
+
+class AchievementEventTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(title='TEST_CATEGORY')
+        subject = Subject.objects.create(title='TEST_SUBJECT', category=category)
+        self.question = Question.objects.create(
+            question_text='TEST_QUESTION', topic=Topic.objects.create(title='TEST_TOPIC', subject=subject))
+        self.player = Player.objects.create(user=User.objects.create(username='TEST_USER'))
+        self.achievement = Achievement.objects.create(name='TEST_ACHIEVEMENT')
+        Title.objects.create(title='TEST_TITLE', achievement=self.achievement)
+        prop = PropAnsweredQuestionInSubject.objects.create(name='TEST_PROPERTY', number=2, subject=subject)
+        prop.achievements.add(self.achievement)
+        Trigger.objects.create(name='TEST_TRIGGER').properties.add(prop)
+
+    def answer(self, report_skip=False):
+        PlayerAnswer.objects.create(player=self.player, question=self.question, result=True, report_skip=report_skip)
+
+    def test_answer_is_queued(self):
+        self.answer()
+        self.answer(report_skip=True)
+        self.assertEqual(AchievementEvent.objects.filter(player=self.player).count(), 1)
+        self.assertFalse(PropertyUnlock.objects.exists())
+
+    def test_process_coalesces_player_events(self):
+        self.answer()
+        self.answer()
+        AchievementGraph.get()
+        # Events, graph token in the cache, player lock, answers, existing property unlocks, property unlocks, existing achievement unlocks,
+        # unlocked properties, achievement unlocks, title unlocks, deleted events and savepoints:
+        # one evaluation for both events
+        with self.assertNumQueries(17):
+            self.assertEqual(AchievementEvent.process(), 2)
+        self.assertFalse(AchievementEvent.objects.exists())
+        self.assertEqual(AchievementUnlock.objects.filter(player=self.player, achievement=self.achievement).count(), 1)
+        self.assertEqual(TitleUnlock.objects.filter(player=self.player).count(), 1)
+
+    def test_process_again_is_idempotent(self):
+        self.answer()
+        self.answer()
+        AchievementEvent.process()
+        AchievementEvent.enqueue(self.player)
+        AchievementEvent.process()
+        self.assertEqual(PropertyUnlock.objects.count(), 1)
+        self.assertEqual(AchievementUnlock.objects.count(), 1)
+        self.assertEqual(TitleUnlock.objects.count(), 1)
+
+    def test_process_achievements_command(self):
+        self.answer()
+        self.answer()
+        out = StringIO()
+        call_command('process_achievements', '--batch-size', '1', stdout=out)
+        self.assertIn('2 events processed', out.getvalue())
+        self.assertEqual(AchievementUnlock.objects.count(), 1)
+
+    @override_settings(ACHIEVEMENTS_INLINE=True)
+    def test_inline(self):
+        self.answer()
+        self.assertFalse(AchievementUnlock.objects.exists())
+        self.answer()
+        self.assertEqual(AchievementUnlock.objects.count(), 1)
+        self.assertFalse(AchievementEvent.objects.exists())
+
+
+class BackfillAchievementsTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(title='TEST_CATEGORY')
+        subject = Subject.objects.create(title='TEST_SUBJECT', category=category)
+        question = Question.objects.create(
+            question_text='TEST_QUESTION', topic=Topic.objects.create(title='TEST_TOPIC', subject=subject))
+        self.players = [Player.objects.create(user=User.objects.create(username='TEST_USER_%r' % i))
+                        for i in range(4)]
+        for i, player in enumerate(self.players):
+            for _ in range(i):
+                PlayerAnswer.objects.create(player=player, question=question, result=True)
+
+        self.achievement = Achievement.objects.create(name='TEST_ACHIEVEMENT')
+        self.title = Title.objects.create(title='TEST_TITLE', achievement=self.achievement)
+        self.answered = PropAnsweredQuestionInSubject.objects.create(name='TEST_ANSWERED', number=2, subject=subject)
+        self.answered.achievements.add(self.achievement)
+        self.other = Property.objects.create(name='TEST_PROPERTY')
+        self.other.achievements.add(self.achievement)
+
+    def assertUnlocked(self, model, players, **fields):
+        self.assertEqual(sorted(model.objects.filter(**fields).values_list('player_id', flat=True)),
+                         [player.pk for player in players])
+
+    def test_unlocked_players(self):
+        self.assertEqual(sorted(self.answered.unlocked_players()), [self.players[2].pk, self.players[3].pk])
+
+    def test_backfill(self):
+        # Already unlocked rows are left alone
+        PropertyUnlock.objects.create(player=self.players[3], prop=self.answered)
+        call_command('backfill_achievements', '--batch-size', '1', stdout=StringIO())
+        self.assertUnlocked(PropertyUnlock, self.players[2:], prop=self.answered)
+        self.assertUnlocked(PropertyUnlock, self.players, prop=self.other)
+        self.assertUnlocked(AchievementUnlock, self.players[2:], achievement=self.achievement)
+        self.assertUnlocked(TitleUnlock, self.players[2:], title=self.title)
+
+    def test_backfill_twice(self):
+        call_command('backfill_achievements', stdout=StringIO())
+        out = StringIO()
+        call_command('backfill_achievements', stdout=out)
+        self.assertEqual(AchievementUnlock.objects.count(), 2)
+        self.assertIn('Achievement %d (TEST_ACHIEVEMENT): 0 unlocked' % self.achievement.pk, out.getvalue())
+
+    def test_backfill_concurrent_unlock(self):
+        # The worker unlocks the property for a player after the backfill has read the existing unlocks
+        players = [player.pk for player in self.players[2:]]
+
+        def racing_players(prop):
+            PropertyUnlock.objects.create(player=self.players[3], prop=self.answered)
+            yield from players
+
+        out = StringIO()
+        with mock.patch.object(PropAnsweredQuestionInSubject, 'unlocked_players',
+                               lambda prop: mock.Mock(iterator=lambda: racing_players(prop))):
+            call_command('backfill_achievements', '--properties', str(self.answered.pk), stdout=out)
+        self.assertUnlocked(PropertyUnlock, self.players[2:], prop=self.answered)
+        self.assertIn('Property %d (2 in TEST_SUBJECT): 1 unlocked' % self.answered.pk, out.getvalue())
+
+    def test_backfill_properties(self):
+        call_command('backfill_achievements', '--properties', str(self.answered.pk), stdout=StringIO())
+        self.assertUnlocked(PropertyUnlock, self.players[2:], prop=self.answered)
+        self.assertFalse(PropertyUnlock.objects.filter(prop=self.other).exists())
+        self.assertFalse(AchievementUnlock.objects.exists())
+
 
 class TitleTestCase(TestCase):
 
@@ -393,6 +809,17 @@ class PropAnsweredQuestionInSubjectTestCase(TestCase):
         )
         self.assertTrue(prop.is_unlocked(player))
 
+    def test_is_unlocked_does_not_count_all_answers(self):
+        prop = PropAnsweredQuestionInSubject.objects.get()
+        player = Player.objects.get()
+        question = Question.objects.get()
+        for _ in range(3):
+            PlayerAnswer.objects.create(player=player, question=question, result=True)
+        with self.assertNumQueries(1):
+            self.assertTrue(prop.is_unlocked(player))
+        prop.number = 4
+        self.assertFalse(prop.is_unlocked(player))
+
     def test_does_not_exist_not_thrown_on_update(self):
         prop = PropAnsweredQuestionInSubject.objects.get()
         player = Player.objects.get()
@@ -559,6 +986,957 @@ class RatingTestCase(TestCase):
         )
         self.assertTrue(player.rating() == player.virtual_rating([question.topic]))
 
+    def test_virtual_rating_streak_kept_on_answer(self):
+        player = Player.objects.get()
+        question = Question.objects.get()
+        player.virtual_rating([question.topic])
+        for result in (True, True, False, True, True, True):
+            PlayerAnswer.objects.create(player=player, question=question, result=result)
+        PlayerAnswer.objects.create(player=player, question=question, result=False, report_skip=True)
+        self.assertEqual(Player.objects.get().streak, '10111')
+        rating = player.rating()
+        with self.assertNumQueries(3):
+            self.assertEqual(player.virtual_rating([question.topic]), rating + 30)
+
+    def test_virtual_rating_streak_rebuilt_for_other_topics(self):
+        player = Player.objects.get()
+        question = Question.objects.get()
+        other_topic = Topic.objects.create(title='other_topic', subject=question.topic.subject)
+        PlayerAnswer.objects.create(player=player, question=question, result=True)
+        player.set_topics([other_topic.id])
+        self.assertEqual(player.virtual_rating([other_topic]), player.rating())
+        PlayerAnswer.objects.create(player=player, question=question, result=True)
+        player.set_topics([question.topic_id, other_topic.id])
+        self.assertEqual(player.virtual_rating([question.topic, other_topic]), player.rating() + 20)
+
+    def test_rebuild_streaks(self):
+        player = Player.objects.get()
+        question = Question.objects.get()
+        player.virtual_rating([question.topic])
+        PlayerAnswer.objects.create(player=player, question=question, result=True)
+        Player.objects.update(streak='00000')
+        call_command('rebuild_streaks', '--dry-run', stdout=StringIO())
+        self.assertEqual(Player.objects.get().streak, '00000')
+        call_command('rebuild_streaks', stdout=StringIO())
+        self.assertEqual(Player.objects.get().streak, '1')
+
+    def test_update_statement_count(self):
+        player = Player.objects.get()
+        question = Question.objects.get()
+        player.update(question, 1)
+        # Eleven statements, two to move the player to a new rating bucket and three to insert it in a savepoint,
+        # one to insert the slot of a ring that is filling up, the subject of the question, which is not loaded,
+        # and the savepoint of the transaction
+        with self.assertNumQueries(20):
+            player.update(question, 0)
+        answer = PlayerAnswer.objects.latest('id')
+        self.assertEqual(answer.rating, player.rating())
+
+    def test_update_statement_count_steady(self):
+        player = Player.objects.get()
+        question = Question.objects.select_related('topic').get()
+        for _ in range(RecentAnswer.SIZE):
+            player.update(question, 1)
+        # The eleven statements and the savepoint, with a full ring and the player kept in its rating bucket
+        with mock.patch.object(RatingBucket, 'bucket_of', return_value=0), self.assertNumQueries(13):
+            player.update(question, 0)
+
+
+class PlayerSubjectStatsTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(title='TEST_CATEGORY')
+        self.subject_a = Subject.objects.create(title='TEST_SUBJECT_A', category=category)
+        self.subject_b = Subject.objects.create(title='TEST_SUBJECT_B', category=category)
+        self.question_a = Question.objects.create(
+            question_text='TEST_QUESTION_A', topic=Topic.objects.create(title='TEST_TOPIC_A', subject=self.subject_a))
+        self.question_b = Question.objects.create(
+            question_text='TEST_QUESTION_B', topic=Topic.objects.create(title='TEST_TOPIC_B', subject=self.subject_b))
+        self.player = Player.objects.create(user=User.objects.create(username='TEST_USER'))
+        for question, result, report_skip in ((self.question_a, True, False), (self.question_a, False, False),
+                                              (self.question_a, False, True), (self.question_b, True, False)):
+            PlayerAnswer.objects.create(player=self.player, question=question, result=result, report_skip=report_skip)
+
+    def counters(self):
+        return sorted(PlayerSubjectStats.objects.values_list('subject_id', 'answered', 'correct', 'report_skips'))
+
+    def test_answers_counted(self):
+        self.assertEqual(self.counters(), [(self.subject_a.id, 3, 1, 1), (self.subject_b.id, 1, 1, 0)])
+
+    def test_answer_without_topic_not_counted(self):
+        PlayerAnswer.objects.create(player=self.player, question=Question.objects.create(question_text='Q'),
+                                    result=True)
+        self.assertEqual(PlayerSubjectStats.objects.count(), 2)
+
+    def test_favourite_subject(self):
+        self.assertEqual(self.player.favourite_subject(), self.subject_a)
+        other = Player.objects.create(user=User.objects.create(username='TEST_OTHER'))
+        self.assertIsNone(other.favourite_subject())
+
+    def test_rebuild_subject_stats(self):
+        counters = self.counters()
+        PlayerSubjectStats.objects.filter(subject=self.subject_a).update(correct=5)
+        PlayerSubjectStats.objects.filter(subject=self.subject_b).delete()
+        out = StringIO()
+        call_command('rebuild_subject_stats', '--dry-run', stdout=out)
+        self.assertIn('2 counters checked, 2 differ', out.getvalue())
+        self.assertNotEqual(self.counters(), counters)
+        call_command('rebuild_subject_stats', stdout=StringIO())
+        self.assertEqual(self.counters(), counters)
+
+
+class RatingHistoryTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(title='TEST_CATEGORY')
+        self.subject = Subject.objects.create(title='TEST_SUBJECT', category=category)
+        self.question = Question.objects.create(
+            question_text='TEST_QUESTION', topic=Topic.objects.create(title='TEST_TOPIC', subject=self.subject))
+        self.user = User.objects.create_user(username='TEST_USER', password='TEST_PASSWORD')
+        self.player = Player.objects.create(user=self.user)
+        self.start = timezone.now() - timezone.timedelta(days=10)
+        # Three answers a day for the last ten days, rating 1000 + 10 * day + answer
+        for day in range(10):
+            for i in range(3):
+                PlayerAnswer.objects.create(player=self.player, question=self.question, result=True,
+                                            rating=1000 + 10 * day + i,
+                                            answer_date=self.start + timezone.timedelta(days=day, seconds=i))
+
+    def test_every_answer_when_few(self):
+        history = self.player.rating_history(self.subject, 30)
+        self.assertEqual(history['resolution'], 'answer')
+        self.assertEqual(len(history['labels']), 30)
+        self.assertEqual(history['close'][:4], [1000, 1001, 1002, 1010])
+
+    def test_days(self):
+        history = self.player.rating_history(self.subject, 20)
+        self.assertEqual(history['resolution'], 'day')
+        self.assertEqual(len(history['labels']), 10)
+        self.assertEqual([history[field][0] for field in ('open', 'high', 'low', 'close')], [1000, 1002, 1000, 1002])
+
+    def test_days_downsampled(self):
+        history = self.player.rating_history(self.subject, 5)
+        self.assertEqual(len(history['labels']), 5)
+        self.assertEqual(history['open'][0], 1000)
+        self.assertEqual(history['close'][-1], 1092)
+
+    def test_rolled_up_days_read_from_rollup(self):
+        days = self.player.rating_days(self.subject)
+        call_command('rollup_answers', stdout=StringIO())
+        self.assertEqual(self.player.rating_days(self.subject), days)
+        PlayerAnswer.objects.update(rating=1500)
+        self.assertEqual(self.player.rating_days(self.subject)[:-1], days[:-1])
+
+    def test_largest_triangle_three_buckets(self):
+        points = [(x, 0) for x in range(100)]
+        points[42] = (42, 100)
+        keep = Player.largest_triangle_three_buckets(points, 10)
+        self.assertEqual(len(keep), 10)
+        self.assertEqual((keep[0], keep[-1]), (0, 99))
+        self.assertIn(42, keep)
+        self.assertEqual(Player.largest_triangle_three_buckets(points[:5], 10), [0, 1, 2, 3, 4])
+
+    def test_rating_history_view(self):
+        client = Client()
+        client.login(username='TEST_USER', password='TEST_PASSWORD')
+        url = '/quiz/stats/%r/rating-history/?points=5' % self.subject.id
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content.decode())['labels']), 5)
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        etag = response['ETag']
+        PlayerAnswer.objects.create(player=self.player, question=self.question, result=True)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Cookie', response['Vary'])
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_rating_history_etag_per_player(self):
+        # Another player with as many answers in the subject does not get the first player's history
+        url = '/quiz/stats/%r/rating-history/?points=5' % self.subject.id
+        client = Client()
+        client.login(username='TEST_USER', password='TEST_PASSWORD')
+        etag = client.get(url)['ETag']
+
+        other = Player.objects.create(user=User.objects.create_user(username='TEST_OTHER', password='TEST_PASSWORD'))
+        answered = PlayerSubjectStats.objects.get(player=self.player, subject=self.subject).answered
+        PlayerSubjectStats.objects.create(player=other, subject=self.subject, answered=answered)
+        client.login(username='TEST_OTHER', password='TEST_PASSWORD')
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_rating_history_view_not_logged_in(self):
+        response = Client().get('/quiz/stats/%r/rating-history/' % self.subject.id)
+        self.assertEqual(response.status_code, 403)
+
+
+class RollupTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(title='TEST_CATEGORY')
+        subject = Subject.objects.create(title='TEST_SUBJECT', category=category)
+        self.topic_a = Topic.objects.create(title='TEST_TOPIC_A', subject=subject)
+        self.topic_b = Topic.objects.create(title='TEST_TOPIC_B', subject=subject)
+        self.question_a = Question.objects.create(question_text='TEST_QUESTION_A', topic=self.topic_a)
+        self.question_b = Question.objects.create(question_text='TEST_QUESTION_B', topic=self.topic_b)
+        self.player = Player.objects.create(user=User.objects.create(username='TEST_USER'))
+        now = timezone.now()
+        self.yesterday = now - timezone.timedelta(days=1)
+        for i, (question, result, report_skip) in enumerate(((self.question_a, True, False),
+                                                             (self.question_a, False, True),
+                                                             (self.question_b, True, False))):
+            PlayerAnswer.objects.create(player=self.player, question=question, result=result, report_skip=report_skip,
+                                        rating=1200 + i, answer_date=self.yesterday.replace(hour=12, second=i))
+        PlayerAnswer.objects.create(player=self.player, question=self.question_a, result=True, rating=1300,
+                                    answer_date=now)
+
+    def test_rollup(self):
+        out = StringIO()
+        call_command('rollup_answers', stdout=out)
+        self.assertIn('1 days rolled up, 3 answers', out.getvalue())
+        day = PlayerTopicDay.objects.get(topic=self.topic_a)
+        self.assertEqual((day.day, day.attempts, day.correct, day.report_skips, day.first_rating, day.last_rating),
+                         (self.yesterday.date(), 2, 1, 1, 1200, 1201))
+        question = QuestionDay.objects.get(question=self.question_b)
+        self.assertEqual((question.attempts, question.correct, question.high_rating), (1, 1, 1202))
+        self.assertEqual(RollupDay.last(), self.yesterday.date())
+
+    def test_rollup_is_incremental_and_idempotent(self):
+        call_command('rollup_answers', stdout=StringIO())
+        out = StringIO()
+        call_command('rollup_answers', stdout=out)
+        self.assertIn('0 days rolled up', out.getvalue())
+        call_command('rollup_answers', '--since', self.yesterday.date().isoformat(), stdout=StringIO())
+        self.assertEqual(PlayerTopicDay.objects.count(), 2)
+        self.assertEqual(QuestionDay.objects.count(), 2)
+
+    def test_rating_days_combine_topics(self):
+        days = self.player.rating_days(self.topic_a.subject)
+        call_command('rollup_answers', stdout=StringIO())
+        self.assertEqual(self.player.rating_days(self.topic_a.subject), days)
+        self.assertEqual(days[0][1:], (1200, 1202, 1200, 1202))
+
+    def test_activity(self):
+        self.assertEqual(self.player.activity(7), (4, 3))
+        call_command('rollup_answers', stdout=StringIO())
+        self.assertEqual(self.player.activity(7), (4, 3))
+        self.assertEqual(self.player.activity(1), (1, 1))
+
+    def test_activity_leaves_out_questions_without_topic(self):
+        question = Question.objects.create(question_text='TEST_QUESTION_NO_TOPIC')
+        PlayerAnswer.objects.create(player=self.player, question=question, result=True, rating=1200,
+                                    answer_date=self.yesterday.replace(hour=13))
+        self.assertEqual(self.player.activity(7), (4, 3))
+        call_command('rollup_answers', stdout=StringIO())
+        self.assertEqual(self.player.activity(7), (4, 3))
+
+
+class RatingBucketTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(title='TEST_CATEGORY')
+        self.subject = Subject.objects.create(title='TEST_SUBJECT', category=category)
+        topic = Topic.objects.create(title='TEST_TOPIC', subject=self.subject)
+        self.questions = [Question.objects.create(question_text='TEST_QUESTION_%r' % i, topic=topic,
+                                                  rating=1000 + 100 * i) for i in range(5)]
+        self.players = []
+        for i in range(12):
+            player = Player.objects.create(user=User.objects.create(username='TEST_USER_%r' % i))
+            PlayerTopic.objects.create(player=player, topic=topic)
+            self.players.append(player)
+        rng = random.Random(0)
+        for _ in range(100):
+            rng.choice(self.players).update(rng.choice(self.questions), rng.random() < 0.5)
+        self.players[0].set_rating(1234.5)
+        self.players[1].set_rating(1234.5)
+        self.players[2].set_rating(1239.999)
+
+    def assertStandingsExact(self):
+        ratings = PlayerRating.objects.filter(subject=self.subject).order_by('-rating')
+        ordered = [rating.rating for rating in ratings]
+        for player in self.players:
+            rating = player.rating()
+            rank, total, percentile = PlayerRating.standing(player)
+            self.assertEqual(rank, ordered.index(rating) + 1)
+            self.assertEqual(total, len(ordered))
+            self.assertAlmostEqual(percentile, 100 * len([r for r in ordered if r < rating]) / len(ordered))
+
+    def test_standing_matches_order_by(self):
+        self.assertStandingsExact()
+
+    def test_equal_ratings_share_rank(self):
+        self.assertEqual(PlayerRating.standing(self.players[0])[0], PlayerRating.standing(self.players[1])[0])
+
+    def test_standing_query_count(self):
+        with self.assertNumQueries(4):
+            PlayerRating.standing(self.players[0])
+
+    def test_rebuild_rating_buckets(self):
+        counts = dict(RatingBucket.objects.values_list('bucket', 'count'))
+        RatingBucket.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_rating_buckets', stdout=out)
+        self.assertEqual(dict(RatingBucket.objects.exclude(count=0).values_list('bucket', 'count')),
+                         {bucket: count for bucket, count in counts.items() if count})
+        self.assertStandingsExact()
+        self.assertIn('1 subjects rebuilt', out.getvalue())
+
+    def test_standing_without_buckets(self):
+        RatingBucket.objects.all().delete()
+        self.assertEqual(PlayerRating.standing(self.players[0])[1:], (0, 0))
+
+    def test_standing_no_subject(self):
+        player = Player.objects.create(user=User.objects.create(username='TEST_USER_NO_SUBJECT'))
+        self.assertIsNone(PlayerRating.standing(player))
+
+    def test_move_in_bucket_order(self):
+        # Down and up across the same boundary, the lower bucket is updated first both ways
+        for old, new in ((1255, 1245), (1245, 1255)):
+            with mock.patch.object(RatingBucket, 'add') as add:
+                RatingBucket.move(self.subject.id, old, new)
+            self.assertEqual([RatingBucket.bucket_of(call[0][1]) for call in add.call_args_list], [124, 125])
+
+    def test_deleted_rating_leaves_bucket(self):
+        PlayerRating.objects.filter(player=self.players[3]).delete()
+        self.players[4].delete()
+        self.players = self.players[:3] + self.players[5:]
+        self.assertStandingsExact()
+
+    def test_deleted_subject_creates_no_bucket(self):
+        self.subject.delete()
+        self.assertFalse(RatingBucket.objects.exists())
+
+    def test_add_bucket_created_concurrently(self):
+        # The first update misses, as if another transaction creates the bucket before the insert
+        bucket = RatingBucket.bucket_of(1234.5)
+        count = RatingBucket.objects.get(subject=self.subject, bucket=bucket).count
+        update = QuerySet.update
+        calls = []
+
+        def missed_update(queryset, **kwargs):
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', missed_update):
+            RatingBucket.add(self.subject.id, 1234.5, 2)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(RatingBucket.objects.get(subject=self.subject, bucket=bucket).count, count + 2)
+        # The failed insert did not break the surrounding transaction
+        self.assertTrue(PlayerRating.objects.filter(subject=self.subject).exists())
+
+
+class QueueRefillTestCase(TransactionTestCase):
+
+    def setUp(self):
+        category = Category.objects.create(title='TEST_CATEGORY')
+        subject = Subject.objects.create(title='TEST_SUBJECT', category=category)
+        topic = Topic.objects.create(title='TEST_TOPIC', subject=subject)
+        self.questions = [TrueFalseQuestion.objects.create(question_text='TEST_QUESTION_%r' % i, answer=True,
+                                                           topic=topic, rating=1150 + 50 * i) for i in range(3)]
+        self.player = Player.objects.create(user=User.objects.create_user(username='TEST_USER',
+                                                                          password='TEST_PASSWORD'))
+        self.player.set_topics([topic.id])
+        self.client = Client()
+        self.client.login(username='TEST_USER', password='TEST_PASSWORD')
+
+    def test_refilled_after_answer(self):
+        self.client.post('/quiz/', {'question': self.questions[1].id, 'answer': 'True'})
+        player = Player.objects.get()
+        self.assertEqual(player.queue_version, player.topic_version)
+        self.assertNotIn(str(self.questions[1].id), player.question_queue.split(','))
+        self.assertTrue(player.question_queue)
+
+        # The next question is popped from the queue, nothing is selected
+        with mock.patch.object(Question, 'nearest', side_effect=AssertionError('selected on GET')):
+            response = self.client.get('/quiz/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['question'].id, int(player.question_queue.split(',')[0]))
+
+    def test_valid_queue_kept(self):
+        self.player.next_question([self.questions[0].topic])
+        queue = Player.objects.get().question_queue
+        self.player.refill_queue()
+        self.assertEqual(Player.objects.get().question_queue, queue)
+
+
+class RatingConcurrencyTestCase(TransactionTestCase):
+    PLAYERS = 4
+    QUESTIONS = 3
+    THREADS = 6
+    ANSWERS = 120
+
+    def setUp(self):
+        category = Category.objects.create(title='TEST_CATEGORY')
+        subject = Subject.objects.create(title='TEST_SUBJECT', category=category)
+        topic = Topic.objects.create(title='TEST_TOPIC', subject=subject)
+        self.players = []
+        for i in range(self.PLAYERS):
+            player = Player.objects.create(user=User.objects.create(username='TEST_USER_%r' % i))
+            PlayerTopic.objects.create(player=player, topic=topic)
+            self.players.append(player.id)
+        self.questions = {
+            Question.objects.create(question_text='TEST_QUESTION_%r' % i, topic=topic, rating=1100 + 100 * i).id:
+                1100 + 100 * i
+            for i in range(self.QUESTIONS)
+        }
+
+    def answer_all(self, answers):
+        try:
+            for player_id, question_id, win in answers:
+                while True:
+                    try:
+                        Player.objects.get(pk=player_id).update(Question.objects.get(pk=question_id), win)
+                        break
+                    except OperationalError:
+                        # SQLite reports a locked database instead of waiting for the lock, try again
+                        pass
+        finally:
+            connection.close()
+
+    def test_concurrent_updates_equal_serial_replay(self):
+        rng = random.Random(0)
+        answers = [(rng.choice(self.players), rng.choice(list(self.questions)), rng.random() < 0.5)
+                   for _ in range(self.ANSWERS)]
+        threads = [threading.Thread(target=self.answer_all, args=(answers[i::self.THREADS],))
+                   for i in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Replay the answers in the order they were committed, rounding like the database does
+        ratings = {player_id: 1200.0 for player_id in self.players}
+        question_ratings = dict(self.questions)
+        for answer in PlayerAnswer.objects.order_by('id'):
+            new_ratings = Player.rating_change(
+                ratings[answer.player_id], question_ratings[answer.question_id], int(answer.result))
+            if new_ratings:
+                ratings[answer.player_id] = float(format_number(new_ratings[0], 8, 3))
+                question_ratings[answer.question_id] = float(format_number(new_ratings[1], 8, 3))
+            self.assertAlmostEqual(float(answer.rating), ratings[answer.player_id], places=3)
+
+        self.assertEqual(PlayerAnswer.objects.count(), self.ANSWERS)
+        for rating in PlayerRating.objects.all():
+            self.assertAlmostEqual(float(rating.rating), ratings[rating.player_id], places=3)
+        for question in Question.objects.all():
+            self.assertAlmostEqual(float(question.rating), question_ratings[question.id], places=3)
+
+
+class ReplayRatingsTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(title='TEST_CATEGORY')
+        self.subject = Subject.objects.create(title='TEST_SUBJECT', category=category)
+        topic = Topic.objects.create(title='TEST_TOPIC', subject=self.subject)
+        self.players = []
+        for i in range(3):
+            player = Player.objects.create(user=User.objects.create(username='TEST_USER_%r' % i))
+            PlayerTopic.objects.create(player=player, topic=topic)
+            self.players.append(player)
+        self.questions = [Question.objects.create(question_text='TEST_QUESTION_%r' % i, topic=topic,
+                                                  rating=1000 + 150 * i) for i in range(4)]
+        rng = random.Random(0)
+        for _ in range(20):
+            rng.choice(self.players).update(rng.choice(self.questions), rng.random() < 0.5)
+        self.player_ratings = {r.player_id: r.rating for r in PlayerRating.objects.all()}
+        self.question_ratings = {q.id: q.rating for q in Question.objects.all()}
+
+    def assertRatingsRestored(self):
+        for rating in PlayerRating.objects.all():
+            self.assertAlmostEqual(rating.rating, self.player_ratings[rating.player_id], places=2)
+        for question in Question.objects.all():
+            self.assertAlmostEqual(question.rating, self.question_ratings[question.id], places=2)
+
+    def test_replay_restores_ratings(self):
+        PlayerRating.objects.update(rating=1500)
+        Question.objects.update(rating=900)
+        call_command('replay_ratings', '--chunk-size', '3', stdout=StringIO())
+        self.assertRatingsRestored()
+
+    def test_replay_creates_missing_ratings(self):
+        PlayerRating.objects.all().delete()
+        call_command('replay_ratings', stdout=StringIO())
+        self.assertRatingsRestored()
+
+    def test_replay_skips_report_skips(self):
+        for player in self.players[:2]:
+            PlayerAnswer.objects.create(player=player, question=self.questions[3], result=True, report_skip=True)
+        self.player_ratings = {r.player_id: r.rating for r in PlayerRating.objects.all()}
+        self.question_ratings = {q.id: q.rating for q in Question.objects.all()}
+        call_command('replay_ratings', stdout=StringIO())
+        self.assertRatingsRestored()
+
+    def test_replay_dry_run(self):
+        Question.objects.filter(pk=self.questions[0].pk).update(rating=900)
+        out = StringIO()
+        call_command('replay_ratings', '--dry-run', stdout=out)
+        self.assertEqual(Question.objects.get(pk=self.questions[0].pk).rating, 900)
+        self.assertIn('question %d 900.000 -> ' % self.questions[0].pk, out.getvalue())
+        self.assertIn('0 player ratings and 1 question ratings differ', out.getvalue())
+
+
+class CalibrateQuestionsTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(title='TEST_CATEGORY')
+        subject = Subject.objects.create(title='TEST_SUBJECT', category=category)
+        topic = Topic.objects.create(title='TEST_TOPIC', subject=subject)
+        self.questions = [Question.objects.create(question_text='TEST_QUESTION_%r' % i, topic=topic)
+                          for i in range(3)]
+        difficulties = [900, 1200, 1500]
+        rng = random.Random(0)
+        answers = []
+        for i in range(30):
+            player = Player.objects.create(user=User.objects.create(username='TEST_USER_%r' % i))
+            ability = 900 + 20 * i
+            for question, difficulty in zip(self.questions, difficulties):
+                for _ in range(5):
+                    answers.append(PlayerAnswer(player=player, question=question, rating=1200,
+                                                result=rng.random() < Player.exp(ability, difficulty)))
+        PlayerAnswer.objects.bulk_create(answers)
+
+    def test_calibration_orders_questions(self):
+        call_command('calibrate_questions', stdout=StringIO())
+        ratings = [float(Question.objects.get(pk=question.pk).rating) for question in self.questions]
+        self.assertTrue(ratings[0] < 1100 < ratings[1] < 1300 < ratings[2])
+        self.assertEqual(Question.objects.get(pk=self.questions[0].pk).original_rating, 1200)
+
+    def test_calibration_dry_run(self):
+        out = StringIO()
+        call_command('calibrate_questions', '--dry-run', stdout=out)
+        self.assertEqual(set(Question.objects.values_list('rating', flat=True)), {1200})
+        self.assertIn('3 questions fitted from 450 answers', out.getvalue())
+
+    def test_calibration_reads_only_ratings(self):
+        # Only the ratings of the subject's questions are read, not their rows
+        with CaptureQueriesContext(connection) as queries:
+            call_command('calibrate_questions', '--dry-run', stdout=StringIO())
+        self.assertFalse([query for query in queries if 'question_text' in query['sql']])
+
+
+class CatalogTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(title='TEST_CATEGORY')
+        self.subject_a = Subject.objects.create(title='TEST_SUBJECT_A', category=category)
+        self.subject_b = Subject.objects.create(title='TEST_SUBJECT_B', category=category)
+        self.topic_a = Topic.objects.create(title='TEST_TOPIC_A', subject=self.subject_a)
+        self.topic_b = Topic.objects.create(title='TEST_TOPIC_B', subject=self.subject_a)
+        TrueFalseQuestion.objects.create(question_text='TEST_QUESTION_A', answer=True, topic=self.topic_a)
+        TextQuestion.objects.create(question_text='TEST_QUESTION_B', answer='TEST_ANSWER', topic=self.topic_a)
+
+    def test_catalog(self):
+        catalog = Catalog.get()
+        self.assertEqual(catalog.subjects, [self.subject_a, self.subject_b])
+        self.assertEqual(catalog.topics, [self.topic_a, self.topic_b])
+        self.assertEqual([topic.question_count for topic in catalog.topics], [2, 0])
+        self.assertEqual(catalog.playable_topics, [self.topic_a])
+        self.assertEqual(catalog.topics[0].subject.title, 'TEST_SUBJECT_A')
+        self.assertEqual(catalog.subject_topics(self.subject_b), [])
+        self.assertEqual(json.loads(catalog.subject_dict),
+                         {'TEST_SUBJECT_A': ['TEST_TOPIC_A'], 'TEST_SUBJECT_B': []})
+
+    def test_cached(self):
+        Catalog.get()
+        # Only the cache, not the subjects and topics
+        with self.assertNumQueries(1):
+            Catalog.get()
+
+    def test_invalidated_by_other_process(self):
+        Catalog.get()
+        Topic.objects.bulk_create([Topic(title='TEST_TOPIC_C', subject=self.subject_b)])
+        DatabaseCache(settings.CACHES['default']['LOCATION'], {}).delete(Catalog.CACHE_KEY)
+        self.assertEqual(len(Catalog.get().subject_topics(self.subject_b)), 1)
+
+    def test_question_invalidates(self):
+        Catalog.get()
+        MultipleChoiceQuestion.objects.create(question_text='TEST_QUESTION_C', topic=self.topic_b)
+        self.assertEqual([topic.question_count for topic in Catalog.get().topics], [2, 1])
+        Question.objects.get(question_text='TEST_QUESTION_A').delete()
+        self.assertEqual([topic.question_count for topic in Catalog.get().topics], [1, 1])
+
+    def test_topic_and_subject_invalidate(self):
+        Catalog.get()
+        topic = Topic.objects.create(title='TEST_TOPIC_C', subject=self.subject_b)
+        self.assertEqual(Catalog.get().subject_topics(self.subject_b), [topic])
+        self.subject_b.title = 'TEST_SUBJECT_C'
+        self.subject_b.save()
+        self.assertEqual(Catalog.get().subjects[1].title, 'TEST_SUBJECT_C')
+
+    def test_select_topic_page_queries(self):
+        user = User.objects.create_user(username='TEST_USER', password='TEST_PASSWORD')
+        player = Player.objects.create(user=user)
+        PlayerTopic.objects.create(player=player, topic=self.topic_a)
+        client = Client()
+        client.login(username='TEST_USER', password='TEST_PASSWORD')
+        client.get('/quiz/select-topics/')
+
+        # Session, user, player, player topics, the catalog in the cache, and the player's rating in the header
+        with self.assertNumQueries(7):
+            response = client.get('/quiz/select-topics/')
+        self.assertEqual(response.context['subject'], self.subject_a)
+        self.assertEqual(response.context['topics'], [self.topic_a])
+        self.assertEqual(response.context['player_topics'], [self.topic_a])
+
+
+class SetTopicsTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(title='TEST_CATEGORY')
+        subject = Subject.objects.create(title='TEST_SUBJECT', category=category)
+        self.topics = [Topic.objects.create(title='TEST_TOPIC_%r' % i, subject=subject) for i in range(3)]
+        self.player = Player.objects.create(user=User.objects.create(username='TEST_USER'))
+
+    def topic_ids(self):
+        return sorted(PlayerTopic.objects.filter(player=self.player).values_list('topic_id', flat=True))
+
+    def test_set_topics(self):
+        self.assertEqual(self.player.set_topics([self.topics[0].id, self.topics[1].id]), 1)
+        self.assertEqual(self.topic_ids(), [self.topics[0].id, self.topics[1].id])
+        kept = PlayerTopic.objects.get(player=self.player, topic=self.topics[1]).id
+
+        self.assertEqual(self.player.set_topics([self.topics[1].id, self.topics[2].id]), 2)
+        self.assertEqual(self.topic_ids(), [self.topics[1].id, self.topics[2].id])
+        self.assertEqual(PlayerTopic.objects.get(player=self.player, topic=self.topics[1]).id, kept)
+        self.assertEqual(Player.objects.get(pk=self.player.pk).topic_version, 2)
+
+    def test_unchanged_topics_keep_version_and_queue(self):
+        self.player.set_topics([self.topics[0].id])
+        Player.objects.filter(pk=self.player.pk).update(question_queue='1,2')
+        # Lock and read the player, read the current topics, and the savepoint of the transaction
+        with self.assertNumQueries(4):
+            self.assertEqual(self.player.set_topics([self.topics[0].id]), 1)
+        self.assertEqual(Player.objects.get(pk=self.player.pk).question_queue, '1,2')
+
+    def test_changed_topics_clear_queue(self):
+        self.player.set_topics([self.topics[0].id])
+        Player.objects.filter(pk=self.player.pk).update(question_queue='1,2')
+        # Lock and read the player, read the current topics, delete, insert, update the player,
+        # and the savepoint of the transaction
+        with self.assertNumQueries(7):
+            self.player.set_topics([self.topics[1].id, self.topics[2].id])
+        self.assertEqual(Player.objects.get(pk=self.player.pk).question_queue, '')
+
+    def test_no_topics(self):
+        self.player.set_topics([self.topics[0].id])
+        self.assertEqual(self.player.set_topics([]), 2)
+        self.assertEqual(self.topic_ids(), [])
+
+
+@override_settings(QUARANTINE_THRESHOLDS={'reports': (4, 0.5), 'green_wrong': (2, 0.1)})
+class QuarantineTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(title='TEST_CATEGORY')
+        subject = Subject.objects.create(title='TEST_SUBJECT', category=category)
+        self.topic = Topic.objects.create(title='TEST_TOPIC', subject=subject)
+        self.question = TrueFalseQuestion.objects.create(question_text='TEST_QUESTION_A', answer=True,
+                                                         topic=self.topic, rating=1200)
+        self.other = TrueFalseQuestion.objects.create(question_text='TEST_QUESTION_B', answer=True,
+                                                      topic=self.topic, rating=1300)
+        self.players = [Player.objects.create(user=User.objects.create(username='TEST_USER_%r' % i))
+                        for i in range(4)]
+
+    def report(self, **flags):
+        for player in self.players:
+            if not QuestionReport.objects.filter(question=self.question, player=player).exists():
+                return QuestionReport.objects.create(question=self.question, player=player, **flags)
+
+    def status(self):
+        return Question.objects.get(pk=self.question.pk).status
+
+    def test_flag_threshold(self):
+        self.report(green_wrong=True)
+        self.assertEqual(self.status(), Question.ACTIVE)
+        self.report(green_wrong=True)
+        self.assertEqual(self.status(), Question.QUARANTINED)
+
+    def test_total_threshold(self):
+        for _ in range(3):
+            self.report(unclear=True)
+        self.assertEqual(self.status(), Question.ACTIVE)
+        self.report(other=True)
+        self.assertEqual(self.status(), Question.QUARANTINED)
+
+    def test_threshold_relative_to_answers(self):
+        for i in range(30):
+            PlayerAnswer.objects.create(player=self.players[i % 4], question=self.question, result=True)
+        self.report(green_wrong=True)
+        self.report(green_wrong=True)
+        self.assertEqual(self.status(), Question.ACTIVE)
+        self.report(green_wrong=True)
+        self.assertEqual(self.status(), Question.QUARANTINED)
+
+    def test_quarantined_not_selected(self):
+        self.assertEqual(Question.nearest([self.topic], 1200).id, self.question.id)
+        self.report(green_wrong=True)
+        self.report(green_wrong=True)
+        self.assertEqual(Question.nearest([self.topic], 1200).id, self.other.id)
+
+    def test_queued_question_quarantined(self):
+        player = self.players[0]
+        PlayerTopic.objects.create(player=player, topic=self.topic)
+        self.assertEqual(player.next_question([self.topic]).id, self.question.id)
+        Question.objects.filter(pk=self.question.pk).update(status=Question.QUARANTINED)
+        self.assertEqual(player.next_question([self.topic]).id, self.other.id)
+
+    def test_release(self):
+        self.report(green_wrong=True)
+        self.report(green_wrong=True)
+        self.assertEqual(Question.release([self.question.id, self.other.id]), 1)
+        self.assertEqual(self.status(), Question.ACTIVE)
+        # Only reports after the release count
+        self.report(green_wrong=True)
+        self.assertEqual(self.status(), Question.ACTIVE)
+        self.report(green_wrong=True)
+        self.assertEqual(self.status(), Question.QUARANTINED)
+
+
+class SoftDeleteTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(title='TEST_CATEGORY')
+        subject = Subject.objects.create(title='TEST_SUBJECT', category=category)
+        self.topic = Topic.objects.create(title='TEST_TOPIC', subject=subject)
+        self.question = MultipleChoiceQuestion.objects.create(question_text='TEST_QUESTION_A', topic=self.topic)
+        MultipleChoiceAnswer.objects.create(question=self.question, answer='TEST_ANSWER_A', correct=True)
+        MultipleChoiceAnswer.objects.create(question=self.question, answer='TEST_ANSWER_B', correct=False)
+        self.other = TrueFalseQuestion.objects.create(question_text='TEST_QUESTION_B', answer=True, topic=self.topic)
+        self.player = Player.objects.create(user=User.objects.create(username='TEST_USER'))
+        PlayerTopic.objects.create(player=self.player, topic=self.topic)
+        for i in range(5):
+            PlayerAnswer.objects.create(player=self.player, question=self.question, result=i % 2 == 0)
+        PlayerAnswer.objects.create(player=self.player, question=self.other, result=True)
+        QuestionReport.objects.create(player=self.player, question=self.question)
+
+    def test_hidden(self):
+        self.assertEqual(Question.soft_delete([self.question.id]), 1)
+        self.assertFalse(Question.objects.filter(pk=self.question.pk).exists())
+        self.assertFalse(MultipleChoiceQuestion.objects.filter(pk=self.question.pk).exists())
+        self.assertEqual(Question.all_objects.get(pk=self.question.pk).status, Question.DELETED)
+        self.assertIsNone(Question.get_subclass(self.question.id))
+        self.assertEqual([question.id for question in Question.nearest([self.topic], 1200, count=2)], [self.other.id])
+        self.assertEqual(Catalog.get().topics[0].question_count, 1)
+        self.assertEqual(QuestionReport.queue(), [])
+
+    def test_answers_kept_until_purged(self):
+        Question.soft_delete([self.question.id])
+        answers = PlayerAnswer.objects.filter(question_id=self.question.id)
+        self.assertEqual(answers.count(), 5)
+        self.assertEqual(answers.first().question.question_text, 'TEST_QUESTION_A')
+        # An answer to a question deleted after it was served still counts
+        PlayerAnswer.objects.create(player=self.player, question=self.question, result=True)
+        self.assertEqual(answers.count(), 6)
+
+    def test_purge(self):
+        Question.soft_delete([self.question.id])
+        out = StringIO()
+        call_command('purge_questions', batch_size=2, stdout=out)
+        self.assertIn('Question %d: 5 PlayerAnswer rows purged' % self.question.id, out.getvalue())
+        self.assertIn('1 questions purged', out.getvalue())
+        self.assertFalse(Question.all_objects.filter(pk=self.question.pk).exists())
+        self.assertFalse(PlayerAnswer.objects.filter(question_id=self.question.id).exists())
+        self.assertFalse(MultipleChoiceAnswer.objects.exists())
+        self.assertFalse(QuestionReport.objects.exists())
+        self.assertFalse(RecentAnswer.objects.filter(question_id=self.question.id).exists())
+        self.assertEqual(PlayerAnswer.objects.filter(question=self.other).count(), 1)
+
+    def test_purge_counters(self):
+        # Five answers, three correct, on a rolled up day, and the other question's correct answer
+        day = timezone.now().date() - timezone.timedelta(days=2)
+        PlayerAnswer.objects.update(answer_date=RollupDay.start(day) + timezone.timedelta(hours=12))
+        RollupDay.roll_up(day)
+        self.player.set_rating(1300)
+        buckets = list(RatingBucket.objects.values_list('subject_id', 'bucket', 'count'))
+
+        Question.soft_delete([self.question.id])
+        out = StringIO()
+        call_command('purge_questions', batch_size=2, stdout=out)
+        self.assertIn('Question %d: 1 days rolled up again' % self.question.id, out.getvalue())
+
+        stats = PlayerSubjectStats.objects.get(player=self.player)
+        self.assertEqual((stats.answered, stats.correct, stats.report_skips), (1, 1, 0))
+        summary = PlayerTopicDay.objects.get(player=self.player, day=day)
+        self.assertEqual((summary.attempts, summary.correct), (1, 1))
+        self.assertEqual(list(QuestionDay.objects.values_list('question_id', flat=True)), [self.other.id])
+        # Ratings are not replayed, so their buckets are kept
+        self.assertEqual(list(RatingBucket.objects.values_list('subject_id', 'bucket', 'count')), buckets)
+
+    def test_purge_rows_in_batches(self):
+        from quiz.management.commands.purge_questions import purge_rows
+        answers = PlayerAnswer.objects.filter(question_id=self.question.id)
+        # Three batches of ids and deletes, each in a transaction, and a last empty batch
+        with self.assertNumQueries(3 * 4 + 3):
+            self.assertEqual(purge_rows(answers, 2), 5)
+
+
+class SelectionTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(title='TEST_CATEGORY')
+        subject = Subject.objects.create(title='TEST_SUBJECT', category=category)
+        self.topic_a = Topic.objects.create(title='TEST_TOPIC_A', subject=subject)
+        self.topic_b = Topic.objects.create(title='TEST_TOPIC_B', subject=subject)
+        self.player = Player.objects.create(user=User.objects.create(username='TEST_USER'))
+        PlayerTopic.objects.create(player=self.player, topic=self.topic_a)
+        self.questions = [Question.objects.create(question_text='TEST_QUESTION_%r' % rating,
+                                                  rating=rating, topic=self.topic_a)
+                          for rating in (1000, 1150, 1230, 1450)]
+
+    def test_nearest_above(self):
+        self.assertEqual(Question.nearest([self.topic_a], 1210), self.questions[2])
+
+    def test_nearest_below(self):
+        self.assertEqual(Question.nearest([self.topic_a], 1180), self.questions[1])
+
+    def test_nearest_excludes(self):
+        self.assertEqual(Question.nearest([self.topic_a], 1210, exclude=[self.questions[2].id]), self.questions[1])
+
+    def test_nearest_across_topics(self):
+        question = Question.objects.create(question_text='TEST_QUESTION_B', rating=1205, topic=self.topic_b)
+        self.assertEqual(Question.nearest([self.topic_a], 1200), self.questions[2])
+        self.assertEqual(Question.nearest([self.topic_a, self.topic_b], 1200), question)
+
+    def test_nearest_no_questions(self):
+        self.assertEqual(Question.nearest([self.topic_b], 1200), None)
+
+    def test_nearest_probes_scan_the_index(self):
+        # Both probes are read in index order, neither sorts the questions of the topic
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plan is sqlite specific')
+        with CaptureQueriesContext(connection) as queries:
+            Question.nearest([self.topic_a], 1200)
+        self.assertEqual(len(queries), 2)
+        for query in queries:
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plan = ' '.join(str(row) for row in cursor.fetchall())
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_nearest_below_ties(self):
+        tie = Question.objects.create(question_text='TEST_QUESTION_TIE', rating=1150, topic=self.topic_a)
+        self.assertEqual(Question.nearest([self.topic_a], 1180), tie)
+
+    def test_next_question_skips_recent(self):
+        PlayerAnswer.objects.create(player=self.player, question=self.questions[1], result=False)
+        PlayerAnswer.objects.create(player=self.player, question=self.questions[2], result=True)
+        self.assertEqual(self.player.next_question([self.topic_a]), self.questions[0])
+
+    def test_next_question_all_recent_repeats_oldest(self):
+        for question in self.questions:
+            PlayerAnswer.objects.create(player=self.player, question=question, result=True,
+                                        report_skip=True)
+        self.assertEqual(self.player.next_question([self.topic_a]), self.questions[0])
+
+    def test_next_question_query_count(self):
+        self.player.rating()
+        with self.assertNumQueries(13):
+            self.player.next_question([self.topic_a])
+        with self.assertNumQueries(4):
+            self.player.next_question([self.topic_a])
+
+    def test_next_question_queued(self):
+        self.assertEqual(self.player.next_question([self.topic_a]), self.questions[2])
+        self.assertEqual(Player.objects.get().question_queue,
+                         ','.join(str(self.questions[i].id) for i in (2, 1, 0, 3)))
+        PlayerAnswer.objects.create(player=self.player, question=self.questions[2], result=True)
+        self.assertEqual(Player.objects.get().question_queue,
+                         ','.join(str(self.questions[i].id) for i in (1, 0, 3)))
+        self.assertEqual(self.player.next_question([self.topic_a]), self.questions[1])
+
+    def test_next_question_queue_selected_again_when_rating_moves(self):
+        self.player.next_question([self.topic_a])
+        self.player.set_rating(1400 + Player.QUEUE_THRESHOLD)
+        self.assertEqual(self.player.next_question([self.topic_a]), self.questions[3])
+
+    def test_next_question_queue_selected_again_when_topics_change(self):
+        self.player.next_question([self.topic_a])
+        # A queue written under the old topics after they changed is not used
+        version = self.player.topic_version
+        self.player.set_topics([self.topic_b.id])
+        Player.objects.filter(pk=self.player.pk).update(question_queue=str(self.questions[0].id),
+                                                        queue_rating=self.player.rating(), queue_version=version)
+        question = Question.objects.create(question_text='TEST_QUESTION_B', rating=1200, topic=self.topic_b)
+        self.assertEqual(self.player.next_question([self.topic_b]), question)
+        self.assertEqual(Player.objects.get().queue_version, self.player.topic_version)
+
+    def test_next_question_queue_not_kept_for_old_topics(self):
+        # The topics change while the questions are selected
+        stale = Player.objects.get(pk=self.player.pk)
+        self.player.set_topics([self.topic_b.id])
+        stale.next_question([self.topic_a])
+        self.assertEqual(Player.objects.get().question_queue, '')
+
+
+class RecentAnswerTestCase(TestCase):
+
+    def setUp(self):
+        self.player = Player.objects.create(user=User.objects.create(username='TEST_USER'))
+        self.other = Player.objects.create(user=User.objects.create(username='TEST_OTHER'))
+        self.questions = [Question.objects.create(question_text='TEST_QUESTION_%r' % i) for i in range(15)]
+
+    def test_answers_pushed_newest_first(self):
+        PlayerAnswer.objects.create(player=self.player, question=self.questions[0], result=True)
+        PlayerAnswer.objects.create(player=self.player, question=self.questions[1], result=False, report_skip=True)
+        recent = self.player.recent_answers()
+        self.assertEqual([ra.question for ra in recent], [self.questions[1], self.questions[0]])
+        self.assertEqual([ra.report_skip for ra in recent], [True, False])
+
+    def test_ring_is_bounded(self):
+        for question in self.questions:
+            PlayerAnswer.objects.create(player=self.player, question=question, result=True)
+        recent = self.player.recent_answers()
+        self.assertEqual(len(recent), RecentAnswer.SIZE)
+        self.assertEqual([ra.question for ra in recent], self.questions[::-1][:RecentAnswer.SIZE])
+        self.assertEqual(RecentAnswer.objects.filter(player=self.player).count(), RecentAnswer.SIZE)
+
+    def test_ring_is_per_player(self):
+        PlayerAnswer.objects.create(player=self.player, question=self.questions[0], result=True)
+        PlayerAnswer.objects.create(player=self.other, question=self.questions[1], result=True)
+        self.assertEqual([ra.question for ra in self.player.recent_answers()], [self.questions[0]])
+
+    def test_seed_recent_answers(self):
+        for question in self.questions[:12]:
+            PlayerAnswer.objects.create(player=self.player, question=question, result=True)
+        PlayerAnswer.objects.create(player=self.other, question=self.questions[0], result=True)
+        # Answers given before the rings were kept, and two after
+        RecentAnswer.objects.all().delete()
+        Player.objects.update(recent_count=0)
+        for question in self.questions[12:]:
+            PlayerAnswer.objects.create(player=self.player, question=question, result=False, report_skip=True)
+
+        out = StringIO()
+        call_command('seed_recent_answers', stdout=out)
+        self.assertIn('2 rings seeded', out.getvalue())
+        recent = self.player.recent_answers()
+        self.assertEqual([ra.question for ra in recent], self.questions[::-1][:RecentAnswer.SIZE])
+        self.assertEqual([ra.report_skip for ra in recent[:4]], [True, True, True, False])
+        self.assertEqual([ra.question for ra in self.other.recent_answers()], [self.questions[0]])
+
+        # Later answers overwrite the oldest seeded one
+        PlayerAnswer.objects.create(player=self.player, question=self.questions[0], result=True)
+        recent = self.player.recent_answers()
+        self.assertEqual([ra.question for ra in recent],
+                         [self.questions[0]] + self.questions[::-1][:RecentAnswer.SIZE - 1])
+
+        # Rings that hold every answer of their player are left alone
+        out = StringIO()
+        call_command('seed_recent_answers', stdout=out)
+        self.assertIn('0 rings seeded', out.getvalue())
+
+    def test_update_does_not_push(self):
+        answer = PlayerAnswer.objects.create(player=self.player, question=self.questions[0], result=True)
+        answer.result = False
+        answer.save()
+        self.assertEqual(len(self.player.recent_answers()), 1)
+
 
 class RedirectTestCase(TestCase):
     TEST_USERNAME = 'TEST_USERNAME'
@@ -623,6 +2001,24 @@ class StatsTestCase(TestCase):
         self.playerB.set_rating(1250)
         self.assertEqual(self.subjectA.high_score(), [(1, 'TEST_USER_A', 1300), (2, 'TEST_USER_B', 1250)])
 
+    def test_highscore_pages(self):
+        for i in range(5):
+            player = Player.objects.create(user=User.objects.create(username='TEST_USER_%r' % i))
+            PlayerRating.set_rating(player, 1000 + 10 * i, self.subjectA)
+        with self.assertNumQueries(1):
+            page = self.subjectA.high_score(2, 2)
+        self.assertEqual(page, [(3, 'TEST_USER_2', 1020), (4, 'TEST_USER_1', 1010)])
+        self.assertEqual(self.subjectA.high_score(3, 2), [(5, 'TEST_USER_0', 1000)])
+        self.assertEqual(self.subjectA.high_score(4, 2), [])
+
+    def test_highscore_order_is_indexed(self):
+        # Ordered by -rating, -id, so the page is a backwards scan of the index with no sort
+        self.assertIn(('subject', 'rating', 'id'), PlayerRating._meta.index_together)
+        with CaptureQueriesContext(connection) as queries:
+            self.subjectA.high_score()
+        self.assertIn('ORDER BY "quiz_playerrating"."rating" DESC, "quiz_playerrating"."id" DESC',
+                      queries[0]['sql'])
+
     def test_set_rating(self):
         self.playerA.set_rating(1500)
         self.assertEqual(PlayerRating.get_rating(self.playerA), 1500)
@@ -796,6 +2192,19 @@ class ViewTestCase(TestCase):
         response = self.client.post('/quiz/', post)
         self.assertEquals(json.loads(response.content.decode()), self.question_a.answer_feedback_raw(post['answer']))
 
+    def test_post_answer_statement_count(self):
+        post = {
+            'question': self.question_a.id,
+            'answer': 'True',
+        }
+        self.client.post('/quiz/', post)
+        # The question, the session, user and player, and the eleven statements of the rating update,
+        # five to move the player to a new rating bucket, one to insert the ring slot and the savepoint
+        with self.assertNumQueries(23):
+            response = self.client.post('/quiz/', post)
+        self.assertEqual(json.loads(response.content.decode()), self.question_a.answer_feedback_raw('True'))
+        self.assertEqual(PlayerAnswer.objects.filter(player=self.player).count(), 2)
+
     def test_post_truefalse_question_not_int(self):
         response = self.client.post('/quiz/', {'question': 'NOT_INT'})
         self.assertEquals(json.loads(response.content.decode()), {})
@@ -804,6 +2213,49 @@ class ViewTestCase(TestCase):
         response = self.client.post('/quiz/', {'question': '1337'})
         self.assertEquals(json.loads(response.content.decode()), {})
 
+    def test_next_question(self):
+        response = self.client.get('/quiz/next/')
+        question = json.loads(response.content.decode())['question']
+        self.assertEqual(sorted(question.keys()),
+                         ['alternatives', 'id', 'question_text', 'subject', 'topic', 'type'])
+        self.assertIn(question['id'], [self.question_a.id, self.question_b.id,
+                                       self.question_c.id, self.question_d.id])
+
+    def test_next_question_post_returns_feedback_and_question(self):
+        response = self.client.post('/quiz/next/', {
+            'question': self.question_a.id,
+            'answer': 'True',
+        })
+        data = json.loads(response.content.decode())
+        self.assertEqual(data['feedback'], self.question_a.answer_feedback_raw('True'))
+        self.assertNotEqual(data['question']['id'], self.question_a.id)
+        self.assertEqual(PlayerAnswer.objects.filter(player=self.player).count(), 1)
+
+    def test_next_question_multiple_choice_hides_answer(self):
+        self.assertEqual(self.question_d.question_json(), {
+            'id': self.question_d.id,
+            'type': 'multiplechoice',
+            'question_text': 'TEST_QUESTION_D',
+            'topic': 'TEST_TOPIC_A',
+            'subject': '',
+            'alternatives': [[answer.id, answer.answer] for answer in
+                             MultipleChoiceAnswer.objects.filter(question=self.question_d)],
+        })
+
+    def test_next_question_post_question_doesnt_exist(self):
+        response = self.client.post('/quiz/next/', {'question': '1337', 'answer': ''})
+        self.assertEqual(json.loads(response.content.decode()), {})
+
+    def test_next_question_without_topics(self):
+        PlayerTopic.objects.all().delete()
+        response = self.client.get('/quiz/next/')
+        self.assertEqual(json.loads(response.content.decode()), {'redirect': '/quiz/select-topics'})
+
+    def test_next_question_not_signed_in(self):
+        self.client.logout()
+        response = self.client.get('/quiz/next/')
+        self.assertEqual(response.status_code, 403)
+
     def test_select_topic_page(self):
         response = self.client.get('/quiz/select-topics/')
         self.assertEquals(response.status_code, 200)
@@ -830,6 +2282,26 @@ class ViewTestCase(TestCase):
         self.assertEquals(response.url, '/quiz')
         self.assertEquals(PlayerTopic.objects.all().count(), 2)
 
+    def test_select_topics_keeps_selected_topic(self):
+        kept = PlayerTopic.objects.get().id
+        self.client.post('/quiz/select-topics/', {
+            'subject': 'TEST_SUBJECT',
+            'topics': 'TEST_TOPIC_A,TEST_TOPIC_B',
+        })
+        self.assertEqual(sorted(PlayerTopic.objects.values_list('topic_id', flat=True)),
+                         [self.topic_a.id, self.topic_b.id])
+        self.assertTrue(PlayerTopic.objects.filter(id=kept).exists())
+        self.assertEqual(Player.objects.get(pk=self.player.pk).topic_version, 1)
+
+    def test_select_topics_other_subject(self):
+        other = Subject.objects.create(title='TEST_SUBJECT_B', category=self.subject.category)
+        Topic.objects.create(title='TEST_TOPIC_C', subject=other)
+        self.client.post('/quiz/select-topics/', {
+            'subject': 'TEST_SUBJECT',
+            'topics': 'TEST_TOPIC_B,TEST_TOPIC_C',
+        })
+        self.assertEqual(list(PlayerTopic.objects.values_list('topic_id', flat=True)), [self.topic_b.id])
+
     def test_select_topics_no_data(self):
         response = self.client.post('/quiz/select-topics/', {})
         self.assertEquals(response.status_code, 302)
@@ -881,6 +2353,14 @@ class ViewTestCase(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertEqual(response.url, '/quiz/select-topics')
 
+    def test_question_page_recent_questions(self):
+        other = Player.objects.create(user=User.objects.create(username='TEST_OTHER'))
+        PlayerAnswer.objects.create(question=self.question_a, player=self.player, result=True)
+        PlayerAnswer.objects.create(question=self.question_b, player=self.player, result=True, report_skip=True)
+        PlayerAnswer.objects.create(question=self.question_c, player=other, result=True)
+        response = self.client.get('/quiz/')
+        self.assertEqual([q.id for q in response.context['recent_questions']], [self.question_a.id])
+
     def test_question_page_answered_all(self):
         PlayerAnswer.objects.create(question=self.question_a, player=self.player, result=True)
         PlayerAnswer.objects.create(question=self.question_b, player=self.player, result=True)
@@ -925,6 +2405,32 @@ class ViewTestCase(TestCase):
         response = self.client.get('/quiz/stats/%r' % self.topic_a.id)
         self.assertEqual(response.status_code, 200)
 
+    def test_stats_page_standing(self):
+        self.player.set_rating(1300)
+        response = self.client.get('/quiz/stats/%r' % self.subject.id)
+        self.assertEqual(response.context['standing'][0], 1)
+
+    def test_stats_page_unplayed_subject_writes_nothing(self):
+        other = Subject.objects.create(title='TEST_SUBJECT_B', category=self.subject.category)
+        response = self.client.get('/quiz/stats/%r' % other.id)
+        self.assertIsNone(response.context['standing'])
+        self.assertFalse(PlayerRating.objects.filter(subject=other).exists())
+        self.assertFalse(RatingBucket.objects.filter(subject=other).exists())
+        self.assertEqual(other.high_score(), [])
+
+    def test_stats_page_high_score_pages(self):
+        for i in range(Subject.HIGH_SCORE_PAGE_SIZE + 1):
+            player = Player.objects.create(user=User.objects.create(username='TEST_USER_%r' % i))
+            PlayerRating.set_rating(player, 1000 + i, self.subject)
+        response = self.client.get('/quiz/stats/%r' % self.subject.id)
+        self.assertEqual(len(response.context['high_score']), Subject.HIGH_SCORE_PAGE_SIZE)
+        self.assertEqual(response.context['next_page'], 2)
+        response = self.client.get('/quiz/stats/%r?page=2' % self.subject.id)
+        self.assertEqual(response.context['high_score'][-1][0],
+                         PlayerRating.objects.filter(subject=self.subject).count())
+        self.assertEqual(response.context['previous_page'], 1)
+        self.assertEqual(response.context['next_page'], 0)
+
     def test_report(self):
         response = self.client.post('/quiz/report/', {
             'question_id': self.question_a.id,
@@ -964,6 +2470,98 @@ class ViewTestCase(TestCase):
         response = self.client.get('/quiz/viewreports/')
         self.assertEqual(response.status_code, 200)
 
+    def test_view_reports_queue(self):
+        self.user.is_superuser = True
+        self.user.save()
+        QuestionReport.objects.create(question=self.question_a, player=self.player, unclear=True)
+        QuestionReport.objects.create(question=self.question_b, player=self.player, unclear=True, other=True)
+        QuestionReport.objects.create(question=self.question_b, player=self.player, red_right=True)
+        response = self.client.get('/quiz/viewreports/')
+        reports = response.context['reports']
+        self.assertEqual([(question['id'], question['reports']) for question in reports],
+                         [(self.question_b.id, 2), (self.question_a.id, 1)])
+        self.assertEqual(reports[0]['question_text'], 'TEST_QUESTION_B')
+        self.assertEqual(reports[0]['topic'], 'TEST_TOPIC_A')
+        self.assertEqual(reports[0]['flags'], [('Red right', 1), ('Green wrong', 0), ('Unclear', 1),
+                                               ('Off topic', 0), ('Inappropriate', 0), ('Other', 1)])
+        self.assertEqual(response.context['next_page'], '')
+
+    def test_report_queue_pages(self):
+        questions = [self.question_a, self.question_b, self.question_c, self.question_d]
+        for i, question in enumerate(questions):
+            for _ in range(i % 2 + 1):
+                QuestionReport.objects.create(question=question, player=self.player)
+        with self.assertNumQueries(1):
+            first = QuestionReport.queue(page_size=3)
+        self.assertEqual([question['id'] for question in first],
+                         [self.question_d.id, self.question_b.id, self.question_c.id])
+        last = first[-1]
+        second = QuestionReport.queue((last['reports'], last['id']), page_size=3)
+        self.assertEqual([question['id'] for question in second], [self.question_a.id])
+
+    def test_view_reports_next_page(self):
+        self.user.is_superuser = True
+        self.user.save()
+        for i in range(QuestionReport.QUEUE_PAGE_SIZE + 1):
+            question = TextQuestion.objects.create(question_text='TEST_QUESTION_%r' % i, answer='TEST_ANSWER')
+            QuestionReport.objects.create(question=question, player=self.player)
+        response = self.client.get('/quiz/viewreports/')
+        last = response.context['reports'][-1]
+        self.assertEqual(response.context['next_page'], '?reports=1&question=%d' % last['id'])
+        response = self.client.get('/quiz/viewreports/' + response.context['next_page'])
+        self.assertEqual(len(response.context['reports']), 1)
+        self.assertEqual(response.context['next_page'], '')
+
+    def test_moderate_reports_dismiss(self):
+        self.user.is_superuser = True
+        self.user.save()
+        for question in (self.question_a, self.question_a, self.question_b, self.question_c):
+            QuestionReport.objects.create(question=question, player=self.player)
+        response = self.client.post('/quiz/viewreports/moderate/', {
+            'action': 'dismiss',
+            'questions': [self.question_a.id, self.question_b.id],
+        })
+        self.assertEqual(response.url, '/quiz/viewreports/')
+        self.assertEqual(list(QuestionReport.objects.values_list('question_id', flat=True)), [self.question_c.id])
+        self.assertEqual(Question.objects.filter(pk=self.question_a.id).count(), 1)
+
+    def test_moderate_reports_delete(self):
+        self.user.is_superuser = True
+        self.user.save()
+        QuestionReport.objects.create(question=self.question_a, player=self.player)
+        QuestionReport.objects.create(question=self.question_b, player=self.player)
+        self.client.post('/quiz/viewreports/moderate/', {
+            'action': 'delete',
+            'questions': [self.question_a.id],
+        })
+        self.assertEqual(Question.objects.filter(pk=self.question_a.id).count(), 0)
+        # Reports of deleted questions are purged later, but no longer in the queue
+        self.assertEqual(QuestionReport.objects.count(), 2)
+        self.assertEqual([question['id'] for question in QuestionReport.queue()], [self.question_b.id])
+
+    def test_moderate_reports_release(self):
+        self.user.is_superuser = True
+        self.user.save()
+        QuestionReport.objects.create(question=self.question_a, player=self.player)
+        Question.objects.filter(pk=self.question_a.pk).update(status=Question.QUARANTINED)
+        self.assertTrue(self.client.get('/quiz/viewreports/').context['reports'][0]['quarantined'])
+        self.client.post('/quiz/viewreports/moderate/', {
+            'action': 'release',
+            'questions': [self.question_a.id],
+        })
+        self.assertEqual(Question.objects.get(pk=self.question_a.pk).status, Question.ACTIVE)
+        self.assertEqual(QuestionReport.objects.count(), 1)
+
+    def test_moderate_reports_as_nonadmin(self):
+        QuestionReport.objects.create(question=self.question_a, player=self.player)
+        response = self.client.post('/quiz/viewreports/moderate/', {
+            'action': 'delete',
+            'questions': [self.question_a.id],
+        })
+        self.assertEqual(response.url, '/')
+        self.assertEqual(QuestionReport.objects.count(), 1)
+        self.assertEqual(Question.objects.filter(pk=self.question_a.id).count(), 1)
+
     def test_view_reports_as_nonadmin(self):
         response = self.client.get('/quiz/viewreports/')
         self.assertNotEqual(response.status_code, 200)
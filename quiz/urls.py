@@ -3,6 +3,7 @@ import quiz.views as views
 
 urlpatterns = [
     url(r'^$', views.question, name='question'),
+    url(r'^next/$', views.next_question, name='nextQuestion'),
     url(r'^select-topics/', views.select_topic, name='selectTopic'),
     url(r'^new/multiplechoice', views.new_multiple_choice_question, name='newMultiplechoiceQuestion'),
     url(r'^new/truefalse', views.new_true_false_question, name='newTrueFalseQuestion'),
@@ -10,9 +11,11 @@ urlpatterns = [
     url(r'^new/', views.new_question, name='newQuestion'),
     url(r'^report/', views.report, name='report'),
     url(r'^viewreports/$', views.view_reports, name='viewReport'),
+    url(r'^viewreports/moderate/$', views.moderate_reports, name='moderateReports'),
     url(r'^viewreports/handlereport/(?P<question_id>[0-9]+)/$', views.handle_report, name='handleReport'),
     url(r'^viewreports/deletequestion/(?P<question_id>[0-9]+)/$', views.delete_question, name='deleteQuestion'),
     url(r'^viewreports/deletereport/(?P<question_id>[0-9]+)/(?P<report_id>[0-9]+)/$', views.delete_report, name='deleteReport'),
+    url(r'^stats/(?P<subject_id>[0-9]+)/rating-history/$', views.rating_history, name='ratingHistory'),
     url(r'^stats/(?P<subject_id>[0-9]+)', views.stats, name='stats'),
     url(r'^stats/', views.stats_default, name='statsDefault'),
 ]
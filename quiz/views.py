@@ -1,7 +1,10 @@
 from django.http import JsonResponse, HttpResponseRedirect
 from django.utils.datastructures import MultiValueDictKeyError
-from django.db.models import Func, F
+from django.views.decorators.http import condition
+from django.views.decorators.cache import cache_control
+from django.views.decorators.vary import vary_on_cookie
 from django.shortcuts import render
+from django.db import transaction
 from quiz.models import *
 from quiz.forms import *
 from django.contrib import messages
@@ -18,71 +21,16 @@ def question(request):
     :return: JsonResponse, HttPResponse, render
     """
     if request.method == 'POST':
-        try:
-            question_id = int(request.POST['question'])
-        except ValueError:
-            return JsonResponse({}, safe=False)
-
-        question_list = (list(TrueFalseQuestion.objects.filter(id=question_id))
-                         + list(MultipleChoiceQuestion.objects.filter(id=question_id))
-                         + list(TextQuestion.objects.filter(id=question_id))
-                         + list(NumberQuestion.objects.filter(id=question_id)))
-
-        if question_list:
-            question = question_list[0]
-        else:
-            return JsonResponse({}, safe=False)
-
-        feedback = question.answer_feedback_raw(request.POST['answer'])
-
-        if hasattr(request, 'user') and hasattr(request.user, 'player') and feedback:
-            result = feedback['answered_correct']
-            request.user.player.update(question, result)
-
-        return JsonResponse(feedback, safe=False)
+        return JsonResponse(answer_question(request), safe=False)
 
     else:
         if hasattr(request, 'user') and hasattr(request.user, 'player'):
 
-            topics = [PT.topic for PT in list(PlayerTopic.objects.filter(player=request.user.player))]
+            question, recent_questions = select_question(request.user.player)
 
-            if not topics:
+            if not question:
                 return HttpResponseRedirect('/quiz/select-topics')
 
-            virtual_rating = request.user.player.virtual_rating(topics)
-            questions = Question.objects.filter(topic__in=topics).annotate(
-                dist=Func(F('rating') - virtual_rating, function='ABS')).order_by('dist')
-
-            repeat = 5
-
-            question_return = None
-
-            for question in questions:
-                if question not in [pa.question for pa in list(
-                        PlayerAnswer.objects.filter(player=request.user.player).order_by('-answer_date')[:repeat])]:
-                    question_return = question
-                    break
-
-            if not question_return:
-                question_return = PlayerAnswer.objects.filter(player=request.user.player).order_by('-answer_date')[
-                    len(questions) - 1].question
-
-            question = (list(TrueFalseQuestion.objects.filter(id=question_return.id))
-                        + list(MultipleChoiceQuestion.objects.filter(id=question_return.id))
-                        + list(TextQuestion.objects.filter(id=question_return.id))
-                        + list(NumberQuestion.objects.filter(id=question_return.id)))[0]
-
-            # To have recently answered questions from current topics in list over reportable questions in report_modal
-            # How far back the list of questions goes is defined by reportable_amount
-            # Only list questions that have been ANSWERED, not REPORTED (report_skip must equal False)
-            reportable_amount = 2
-            recent_questions = [pa.question for pa in PlayerAnswer.objects.order_by('-answer_date') if
-                                (pa.question.topic in topics and not pa.report_skip)]
-            q_list = [question]
-            for q in recent_questions:
-                if q not in q_list:
-                    q_list.append(q)
-            recent_questions = q_list[1:reportable_amount + 1]
             context = {
                 'recent_questions': recent_questions,
             }
@@ -102,6 +50,106 @@ def question(request):
         return HttpResponseRedirect('/')
 
 
+def next_question(request):
+    """
+    POST: answers a question like question does, and returns the feedback together with the next question
+    GET: returns the next question
+    Questions are returned without their answers, so the quiz can go on without reloading the page
+
+    :param request: Request to be handled
+
+    :return: JsonResponse
+    """
+    if not (hasattr(request, 'user') and hasattr(request.user, 'player')):
+        return JsonResponse({}, status=403)
+
+    response = {}
+
+    if request.method == 'POST':
+        feedback = answer_question(request)
+        if not feedback:
+            return JsonResponse({})
+        response['feedback'] = feedback
+
+    question, recent_questions = select_question(request.user.player)
+
+    if question:
+        response['question'] = question.question_json()
+        response['recent_questions'] = [{'id': q.id, 'question_text': q.question_text} for q in recent_questions]
+    else:
+        response['redirect'] = '/quiz/select-topics'
+
+    return JsonResponse(response)
+
+
+def answer_question(request):
+    """
+    Validates a posted answer and updates player and question rating if a player answered.
+    Once the answer is committed the player's question queue is refilled if it has run out
+
+    :param request: Request with question id and answer
+
+    :return: Feedback as JSON-object, empty if the question does not exist
+    :rtype: dict
+    """
+    try:
+        question_id = int(request.POST['question'])
+    except (ValueError, MultiValueDictKeyError):
+        return {}
+
+    question = Question.get_subclass(question_id)
+
+    if not question:
+        return {}
+
+    feedback = question.answer_feedback_raw(request.POST['answer'])
+
+    if hasattr(request, 'user') and hasattr(request.user, 'player') and feedback:
+        result = feedback['answered_correct']
+        request.user.player.update(question, result)
+        # Select the next questions now, so the next request only pops the queue
+        transaction.on_commit(request.user.player.refill_queue)
+
+    return feedback
+
+
+def select_question(player):
+    """
+    Selects the next question for a player, and the recently answered questions that can be reported
+
+    :param player: Player to select a question for
+    :type player: Player object
+
+    :return: Question of concrete type and list of recent questions, None and an empty list if there is nothing to answer
+    :rtype: tuple
+    """
+    # The version first, so the topics read are never older than it
+    player.refresh_from_db(fields=['topic_version'])
+    topics = [PT.topic for PT in PlayerTopic.objects.filter(player=player).select_related('topic')]
+
+    if not topics:
+        return None, []
+
+    recent_answers = player.recent_answers()
+    question = player.next_question(topics, recent_answers)
+
+    if not question:
+        return None, []
+
+    # To have recently answered questions from current topics in list over reportable questions in report_modal
+    # How far back the list of questions goes is defined by reportable_amount
+    # Only list questions that have been ANSWERED, not REPORTED (report_skip must equal False)
+    reportable_amount = 2
+    topic_ids = [topic.id for topic in topics]
+    recent_questions = []
+    for ra in recent_answers:
+        if ra.question.topic_id in topic_ids and not ra.report_skip and \
+                ra.question_id not in [q.id for q in [question] + recent_questions]:
+            recent_questions.append(ra.question)
+
+    return question, recent_questions[:reportable_amount]
+
+
 def select_topic(request):
     """
     POST: updates a player's PlayerTopic objects
@@ -112,9 +160,6 @@ def select_topic(request):
     :return: HttPResponse, render
     """
     if request.method == 'POST':
-        # deletes all previously selected topics
-        PlayerTopic.objects.filter(player=request.user.player).delete()
-
         try:
             # string
             subject = request.POST['subject']
@@ -134,49 +179,34 @@ def select_topic(request):
         topics = topics.split(',')
 
         # if no specified topics, include all topics that belong to subject
-        if topics[0] == '':
-            topics = [topic.title for topic in Topic.objects.filter(subject=Subject.objects.get(title=subject))]
-
-        # make new player-topic-links in database
-        for topic in topics:
-            try:
-                PlayerTopic.objects.create(
-                    player=request.user.player,
-                    topic=Topic.objects.get(title=topic),
-                )
-            except Topic.DoesNotExist:
-                pass
+        topic_ids = Topic.objects.filter(subject__title=subject)
+        if topics[0] != '':
+            topic_ids = topic_ids.filter(title__in=topics)
+
+        # replaces the previously selected topics, unknown topics are left out
+        request.user.player.set_topics(topic_ids.values_list('id', flat=True))
 
         return HttpResponseRedirect('/quiz')
     else:
-        subjects = Subject.objects.all()
-        topics = Topic.objects.all()
-
-        subject_dict = dict([(subject.title, []) for subject in subjects])
+        catalog = Catalog.get()
 
-        show_topics = []
-        for topic in topics:
-            if topic.question_set.count() > 0:
-                show_topics.append(topic)
-                subject_dict[topic.subject.title].append(topic.title)
-
-        topics_in_player = PlayerTopic.objects.filter(player=request.user.player)
-        try:
-            subject = topics_in_player.first().topic.subject
-            all_topics = Topic.objects.all().filter(subject=subject)
-        except AttributeError:
+        topics_in_player = list(PlayerTopic.objects.filter(player=request.user.player).select_related('topic'))
+        if topics_in_player:
+            subject = catalog.subject(topics_in_player[0].topic.subject_id)
+            all_topics = catalog.subject_topics(subject)
+        else:
             subject = None
-            all_topics = topics
+            all_topics = catalog.topics
 
         player_topics = [playerTopic.topic for playerTopic in topics_in_player] if \
-            len(topics_in_player) != all_topics.count() else []
+            len(topics_in_player) != len(all_topics) else []
 
         context = {
-            'subjects': subjects,
-            'topics': show_topics,
+            'subjects': catalog.subjects,
+            'topics': catalog.playable_topics,
             'subject': subject,
             'player_topics': player_topics,
-            'subject_dict': json.dumps(subject_dict),
+            'subject_dict': catalog.subject_dict,
         }
 
         return render(request, 'quiz/select_topic.html', context)
@@ -192,7 +222,7 @@ def multiple_choice_question(request, question, context):
 
     :return: render
     """
-    answers = MultipleChoiceAnswer.objects.filter(question=question)
+    answers = question.multiplechoiceanswer_set.all()
 
     context.update({
         'question': question,
@@ -271,12 +301,11 @@ def new_question(request):
     :return: HttPResponse, render
     """
     if request.user.is_authenticated:
-        subjects = Subject.objects.all()
-        topics = Topic.objects.all()
+        catalog = Catalog.get()
 
         context = {
-            'subjects': subjects,
-            'topics': topics,
+            'subjects': catalog.subjects,
+            'topics': catalog.topics,
         }
 
         return render(request, 'quiz/newQuestion.html', context)
@@ -322,13 +351,12 @@ def new_text_question(request):
             messages.success(request, 'Question successfully created')
             return HttpResponseRedirect('/quiz/new/')
 
-    subjects = Subject.objects.all()
-    topics = Topic.objects.all()
+    catalog = Catalog.get()
 
     context = {
         'tForm': form,
-        'subjects': subjects,
-        'topics': topics,
+        'subjects': catalog.subjects,
+        'topics': catalog.topics,
         'active': 'text',
     }
 
@@ -365,13 +393,12 @@ def new_true_false_question(request):
             messages.success(request, 'Question successfully created')
             return HttpResponseRedirect('/quiz/new/')
 
-    subjects = Subject.objects.all()
-    topics = Topic.objects.all()
+    catalog = Catalog.get()
 
     context = {
         'tfForm': form,
-        'subjects': subjects,
-        'topics': topics,
+        'subjects': catalog.subjects,
+        'topics': catalog.topics,
         'active': 'truefalse',
     }
 
@@ -437,13 +464,12 @@ def new_multiple_choice_question(request):
             messages.success(request, 'Question successfully created')
             return HttpResponseRedirect('/quiz/new/')
 
-    subjects = Subject.objects.all()
-    topics = Topic.objects.all()
+    catalog = Catalog.get()
 
     context = {
         'mcForm': form,
-        'subjects': subjects,
-        'topics': topics,
+        'subjects': catalog.subjects,
+        'topics': catalog.topics,
         'active': 'multiplechoice',
     }
 
@@ -490,16 +516,18 @@ def view_reports(request):
     # Only site admins are allowed to see and handle reports
     user = request.user
     if user.is_superuser:
-        reported_question_ids = QuestionReport.objects.all().values_list('question_id', flat=True)
-        questions = Question.objects.filter(id__in=reported_question_ids)
-        reports = []
-
-        reports = [[question, QuestionReport.objects.filter(question_id=question.id).count()] for question in questions]
+        # The page after the question with the given number of reports and id, the first page if not given
+        try:
+            after = (int(request.GET['reports']), int(request.GET['question']))
+        except (KeyError, ValueError):
+            after = None
 
-        reports.sort(key=lambda tup: tup[1], reverse=True)
+        reports = QuestionReport.queue(after)
+        last = reports[-1] if len(reports) == QuestionReport.QUEUE_PAGE_SIZE else None
 
         context = {
             'reports': reports,
+            'next_page': '?reports=%d&question=%d' % (last['reports'], last['id']) if last else '',
         }
 
         return render(request, 'quiz/viewReports.html', context)
@@ -507,22 +535,53 @@ def view_reports(request):
     return HttpResponseRedirect('/')
 
 
+def moderate_reports(request):
+    """
+    POST: handles the selected questions of the moderation queue at once.
+    "dismiss" deletes all reports of the questions, "release" puts quarantined questions back into the selection,
+    "delete" deletes the questions, their answers and reports are purged later.
+    Redirects to the moderation queue afterwards.
+
+    :param request: Request to be handled
+
+    :return: HttPResponse
+    """
+    # Only site admins are allowed to handle reports
+    if not request.user.is_superuser:
+        return HttpResponseRedirect('/')
+
+    if request.method == 'POST':
+        try:
+            question_ids = [int(pk) for pk in request.POST.getlist('questions')]
+        except ValueError:
+            question_ids = []
+        action = request.POST.get('action')
+
+        if question_ids and action == 'dismiss':
+            QuestionReport.objects.filter(question_id__in=question_ids).delete()
+            messages.success(request, 'Reports of %d questions dismissed' % len(question_ids))
+        elif question_ids and action == 'release':
+            released = Question.release(question_ids)
+            messages.success(request, '%d questions released' % released)
+        elif question_ids and action == 'delete':
+            deleted = Question.soft_delete(question_ids)
+            messages.success(request, '%d questions deleted' % deleted)
+
+    return HttpResponseRedirect('/quiz/viewreports/')
+
+
 def handle_report(request, question_id):
     # Only site admins are allowed to see and handle reports
     user = request.user
     if user.is_superuser:
-        questionList = (list(TrueFalseQuestion.objects.filter(id=question_id))
-            + list(MultipleChoiceQuestion.objects.filter(id=question_id))
-            + list(TextQuestion.objects.filter(id=question_id))
-            + list(NumberQuestion.objects.filter(id=question_id)))
-
         reports = QuestionReport.objects.filter(question_id=question_id)
+        question = Question.get_subclass(int(question_id))
 
-        if not reports:
+        if not reports or not question:
             return HttpResponseRedirect('/quiz/viewreports/')
 
         context = {
-            'question': questionList[0],
+            'question': question,
             'question_id': question_id,
             'reports': reports,
         }
@@ -536,8 +595,8 @@ def delete_question(request, question_id):
     # Only site admins are allowed to delete questions
     user = request.user
     if user.is_superuser:
-        question = Question.objects.get(pk=question_id)
-        question.delete()
+        # The answers and reports of the question are removed later by the purge_questions command
+        Question.soft_delete([question_id])
         return HttpResponseRedirect('/quiz/viewreports')
     return HttpResponseRedirect('/')
 
@@ -565,10 +624,66 @@ def stats(request, subject_id):
     except Subject.DoesNotExist:
         subject = None
 
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    high_score = subject.high_score(page) if subject else []
+
     context = {
         'subjects': subjects,
         'subject': subject,
-        'ratingList': request.user.player.rating_list(subject),
+        'high_score': high_score,
+        'standing': PlayerRating.standing(request.user.player, subject) if subject else None,
+        'page': page,
+        'previous_page': page - 1,
+        'next_page': page + 1 if len(high_score) == Subject.HIGH_SCORE_PAGE_SIZE else 0,
+        'has_ratings': bool(subject) and PlayerSubjectStats.objects
+        .filter(player=request.user.player, subject=subject, answered__gt=0).exists(),
         'subjectAnswers': request.user.player.subject_answers(),
     }
     return render(request, 'quiz/stats.html', context)
+
+
+def rating_history_etag(request, subject_id):
+    """
+    ETag of a player's rating history, which only changes when the player answers in the subject.
+    The player is part of the ETag, since the same URL serves every player
+
+    :param request: Request to be handled
+    :param subject_id: id of the subject
+    :return: ETag, None if there is no player
+    """
+    if not (hasattr(request, 'user') and hasattr(request.user, 'player')):
+        return None
+    answered = PlayerSubjectStats.objects.filter(player=request.user.player, subject_id=subject_id)\
+        .values_list('answered', flat=True).first()
+    return '%s-%s-%s-%s' % (request.user.player.id, subject_id, answered or 0, request.GET.get('points', ''))
+
+
+@cache_control(private=True)
+@vary_on_cookie
+@condition(etag_func=rating_history_etag)
+def rating_history(request, subject_id):
+    """
+    Returns the player's rating history in a subject as JSON, downsampled to at most points points
+
+    :param request: Request to be handled
+    :param subject_id: id of the subject
+    :return: JsonResponse
+    """
+    if not (hasattr(request, 'user') and hasattr(request.user, 'player')):
+        return JsonResponse({}, status=403)
+
+    try:
+        subject = Subject.objects.get(pk=subject_id)
+    except Subject.DoesNotExist:
+        return JsonResponse({}, status=404)
+
+    try:
+        points = int(request.GET.get('points', Player.RATING_HISTORY_POINTS))
+    except ValueError:
+        points = Player.RATING_HISTORY_POINTS
+    points = min(max(points, 3), Player.RATING_HISTORY_MAX_POINTS)
+
+    return JsonResponse(request.user.player.rating_history(subject, points))